@@ -0,0 +1,83 @@
+"""
+Automatic1111 engines against local mock servers: per-call overhead of the client, sequential and concurrent,
+and the handling of the response of a large batch, every image decoded by webuiapi vs only the generated ones.
+"""
+import sys
+import time
+
+sys.path.append("./src/")
+sys.path.append("./tests/")
+import sdqrcode.sdqrcode as sdqrcode
+from a1111_stub import A1111Stub
+from sdqrcode.Engines import auto_payload
+from sdqrcode.workers import GenerationWorkers
+
+CONCURRENT_CALLS = 16
+BATCH_SIZE = 16
+
+
+def run(number: int = 20) -> dict:
+    results = {}
+    stubs = [A1111Stub(image_size=512).start() for _ in range(2)]
+    try:
+        host, port = stubs[0].hostname.split(":")
+        generator = sdqrcode.init(config="default_auto", auto_api_hostname=host, auto_api_port=int(port))
+        generator.generate_sd_qrcode(seed=0)
+        start = time.perf_counter()
+        for i in range(number):
+            generator.generate_sd_qrcode(seed=i)
+        results["auto/sequential/latency"] = (time.perf_counter() - start) / number
+
+        generator = sdqrcode.init(config="default_auto", auto_api_hostname=[stub.hostname for stub in stubs])
+        try:
+            items = [{"seed": i, "qrcode_text": f"https://koll.ai/{i}"} for i in range(CONCURRENT_CALLS)]
+            with GenerationWorkers(generator) as workers:
+                workers.map(items[:2])
+                start = time.perf_counter()
+                workers.map(items)
+            results[f"auto_async/concurrent{CONCURRENT_CALLS}/per_call"] = (time.perf_counter() - start) / CONCURRENT_CALLS
+        finally:
+            generator.release()
+    finally:
+        for stub in stubs:
+            stub.stop()
+    results.update(run_large_batch(max(1, number // 4)))
+    return results
+
+
+def run_large_batch(number: int = 5) -> dict:
+    results = {}
+    stub = A1111Stub(image_size=512, noise=True).start()
+    try:
+        host, port = stub.hostname.split(":")
+        generator = sdqrcode.init(config="default_auto", auto_api_hostname=host, auto_api_port=int(port))
+        config = generator.request_config(batch_size=BATCH_SIZE)
+        _, cn_images = generator._prepare_images(config, None)
+        engine = generator.engine
+
+        def webuiapi_all_images():
+            # before: the detect maps were sent, webuiapi decoded every image and the maps were dropped after
+            _, payload = auto_payload.build_payload(config, None, cn_images, engine.image_cache, return_cn_imgs=True)
+            r = engine.api.post_and_get_api_result(f"{engine.api.baseurl}/txt2img", payload, False)
+            return [image.convert("RGB") for image in r.images[0 : -len(cn_images)]]
+
+        calls = {
+            "webuiapi_all_images": webuiapi_all_images,
+            "pil": lambda: [image.convert("RGB") for image in engine.generate_sd_qrcode(None, cn_images, config=config)],
+            "np": lambda: engine.generate_sd_qrcode(None, cn_images, config=config, output_type="np"),
+            "png": lambda: engine.generate_sd_qrcode(None, cn_images, config=config, output_type="png"),
+        }
+        for name, call in calls.items():
+            call()
+            start = time.perf_counter()
+            for _ in range(number):
+                call()
+            results[f"auto/batch{BATCH_SIZE}/{name}"] = (time.perf_counter() - start) / number
+    finally:
+        stub.stop()
+    return results
+
+
+if __name__ == "__main__":
+    for name, seconds in run().items():
+        print(f"{name:40s} {seconds * 1e3:10.3f} ms/call")
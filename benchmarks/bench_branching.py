@@ -0,0 +1,44 @@
+"""ControlNet weight sweep: one generation per variant vs shared-prefix branching, on a tiny random model (cpu)."""
+import sys
+import timeit
+
+sys.path.append("./src/")
+sys.path.append("./tests/")
+import sdqrcode.sdqrcode as sdqrcode
+from tiny_models import get_tiny_config
+
+N_VARIANTS = 4
+STEPS = 20
+
+
+def get_generator():
+    config = get_tiny_config("txt2img", n_units=2, device="cpu")
+    config["global"]["steps"] = STEPS
+    config["global"]["scheduler_name"] = "DDIM"
+    # tile-like unit starting at 35% of the steps, its weight is swept
+    config["controlnet_units"]["unit_1"]["start"] = 0.35
+    return sdqrcode.Sdqrcode(config)
+
+
+def run(number: int = 3) -> dict:
+    generator = get_generator()
+    variants = [{"controlnet_weights": [0.5, 0.2 + 0.2 * i]} for i in range(N_VARIANTS)]
+
+    def one_by_one():
+        for variant in variants:
+            generator.generate_sd_qrcode(seed=1, **variant)
+
+    def branched():
+        generator.generate_sd_qrcode_variants(variants, seed=1)
+
+    results = {}
+    for name, fn in [("one_by_one", one_by_one), ("branched", branched)]:
+        fn()  # warm up
+        results[f"branching/{N_VARIANTS}_variants_{name}"] = timeit.timeit(fn, number=number) / number
+    generator.release()
+    return results
+
+
+if __name__ == "__main__":
+    for name, seconds in run().items():
+        print(f"{name:40s} {seconds * 1e3:10.3f} ms/call")
@@ -0,0 +1,44 @@
+"""Per-request config: yaml parse + deepcopy + update_config_dict vs cached load_config + with_overrides."""
+import copy
+import sys
+import timeit
+
+import yaml
+
+sys.path.append("./src/")
+import sdqrcode.sdqrcode as sdqrcode
+from sdqrcode.config import load_config
+
+CONFIG = "default_diffusers"
+OVERRIDES = dict(prompt="a cat", seed=42, qrcode_text="https://example.com", controlnet_weights=[0.3, 0.6])
+
+
+def parse_and_update():
+    # previous path: the yaml is parsed on each get_config, each request deep copies and mutates it
+    with open(sdqrcode.CONFIGS[CONFIG], "r") as f:
+        config = yaml.safe_load(f)
+    return sdqrcode.update_config_dict(copy.deepcopy(config), **OVERRIDES)
+
+
+def deepcopy_and_update(config=sdqrcode.get_config(CONFIG)):
+    return sdqrcode.update_config_dict(copy.deepcopy(config), **OVERRIDES)
+
+
+def load_and_override():
+    return load_config(CONFIG).with_overrides(**OVERRIDES)
+
+
+def run(number: int = 2000) -> dict:
+    results = {}
+    for name, fn in [
+        ("parse+deepcopy+update", parse_and_update),
+        ("deepcopy+update", deepcopy_and_update),
+        ("load_config+with_overrides", load_and_override),
+    ]:
+        results[f"config/{name}"] = timeit.timeit(fn, number=number) / number
+    return results
+
+
+if __name__ == "__main__":
+    for name, seconds in run().items():
+        print(f"{name:40s} {seconds * 1e6:10.3f} us/call")
@@ -0,0 +1,46 @@
+"""DiffusersEngine end to end on tiny random models (cpu): latency of one generation, and per image in a batch."""
+import sys
+import time
+
+sys.path.append("./src/")
+sys.path.append("./tests/")
+import sdqrcode.sdqrcode as sdqrcode
+from tiny_models import get_tiny_config
+
+STEPS = 10
+BATCH = 8
+
+
+def timed(fn, number: int) -> float:
+    # best of number calls, the first call also builds the schedulers
+    fn()
+    best = float("inf")
+    for _ in range(number):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(number: int = 3) -> dict:
+    from diffusers.utils import logging
+
+    logging.disable_progress_bar()
+    results = {}
+    for mode in ("txt2img", "img2img"):
+        config = get_tiny_config(mode, n_units=2, device="cpu")
+        config["global"]["steps"] = STEPS
+        generator = sdqrcode.Sdqrcode(config)
+        try:
+            results[f"diffusers/{mode}/latency"] = timed(lambda: generator.generate_sd_qrcode(seed=1), number)
+            items = [{"seed": i, "qrcode_text": f"https://koll.ai/{i}"} for i in range(BATCH)]
+            batch_seconds = timed(lambda: generator.generate_sd_qrcode_batch(items, max_batch_size=BATCH), number)
+            results[f"diffusers/{mode}/batch{BATCH}_per_image"] = batch_seconds / BATCH
+        finally:
+            generator.release()
+    return results
+
+
+if __name__ == "__main__":
+    for name, seconds in run().items():
+        print(f"{name:40s} {seconds * 1e3:10.3f} ms")
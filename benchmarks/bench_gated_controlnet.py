@@ -0,0 +1,57 @@
+"""ControlNet units with a start/end window: every controlnet evaluated at every step vs gated, on a tiny random model (cpu)."""
+import sys
+import timeit
+
+import torch
+
+sys.path.append("./src/")
+sys.path.append("./tests/")
+import sdqrcode.sdqrcode as sdqrcode
+from sdqrcode.Engines.DiffusersEngine import build_pipeline
+from tiny_models import get_tiny_config
+
+STEPS = 20
+
+
+def run(number: int = 3) -> dict:
+    from diffusers import StableDiffusionControlNetPipeline
+
+    # windows of default_diffusers.yaml: brightness on every step, tile from 35% to 70% of the steps
+    config = get_tiny_config("txt2img", n_units=2, device="cpu")
+    config["global"]["steps"] = STEPS
+    config["global"]["scheduler_name"] = "DDIM"
+    config["controlnet_units"]["unit_1"].update(start=0.35, end=0.7)
+    generator = sdqrcode.Sdqrcode(config)
+    engine = generator.engine
+    controlnet_input_images = generator._prepare_images(generator.config)[1]
+
+    ungated = build_pipeline(StableDiffusionControlNetPipeline, engine.components, engine.controlnet_units)
+    ungated.scheduler = engine.pipeline.scheduler
+
+    def run_ungated():
+        ungated(
+            prompt="a dog",
+            image=controlnet_input_images,
+            width=64,
+            height=64,
+            num_inference_steps=STEPS,
+            controlnet_conditioning_scale=[0.5, 0.5],
+            control_guidance_start=[0.0, 0.35],
+            control_guidance_end=[1.0, 0.7],
+            generator=torch.Generator().manual_seed(1),
+        )
+
+    def run_gated():
+        generator.generate_sd_qrcode(seed=1)
+
+    results = {}
+    for name, fn in [("ungated", run_ungated), ("gated", run_gated)]:
+        fn()  # warm up
+        results[f"controlnet/{name}"] = timeit.timeit(fn, number=number) / number
+    generator.release()
+    return results
+
+
+if __name__ == "__main__":
+    for name, seconds in run().items():
+        print(f"{name:40s} {seconds * 1e3:10.3f} ms/call")
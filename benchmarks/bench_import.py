@@ -0,0 +1,40 @@
+"""Import time of the package in a fresh interpreter, and of a first qr code render, with the heavy modules loaded."""
+import subprocess
+import sys
+
+HEAVY_MODULES = ("torch", "diffusers", "transformers", "webuiapi", "requests", "yaml")
+
+SNIPPETS = {
+    "import sdqrcode": "import sdqrcode",
+    "import + render qr code": "import sdqrcode; sdqrcode.generate_qrcode_img(text='https://koll.ai', width=768)",
+    "import + auto engine": "import sdqrcode.Engines.engine_util as e; e.get_engine('auto')",
+}
+
+
+def measure(snippet: str) -> tuple[float, list[str]]:
+    code = (
+        "import sys, time; sys.path.insert(0, './src/'); start = time.perf_counter()\n"
+        f"{snippet}\n"
+        "print(time.perf_counter() - start)\n"
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout.splitlines()
+    return float(out[0]), [m for m in out[1].split(",") if m]
+
+
+def run(repeat: int = 5) -> dict:
+    results = {}
+    for name, snippet in SNIPPETS.items():
+        # best of a few fresh processes, the first one may read the files from disk
+        runs = [measure(snippet) for _ in range(repeat)]
+        results[f"import/{name}"] = min(seconds for seconds, _ in runs)
+        results[f"import/{name}/heavy_modules"] = runs[0][1]
+    return results
+
+
+if __name__ == "__main__":
+    for name, value in run().items():
+        if isinstance(value, float):
+            print(f"{name:40s} {value * 1e3:10.3f} ms")
+        else:
+            print(f"{name:40s} {', '.join(value) or '-'}")
@@ -0,0 +1,41 @@
+"""Encoding a batch of generated images: one png at a time (default compression) vs outputs.encode_images."""
+import sys
+import timeit
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+sys.path.append("./src/")
+from sdqrcode import outputs
+
+SIZE = 768
+BATCH = 8
+
+
+def save_sequentially(images):
+    # previous path: callers saved the PIL images one by one with the default png settings
+    for image in images:
+        image.save(BytesIO(), format="PNG")
+
+
+def run(number: int = 3) -> dict:
+    # smooth noise compresses like generated images, white noise would not compress at all
+    rng = np.random.default_rng(0)
+    small = rng.integers(0, 256, (BATCH, SIZE // 16, SIZE // 16, 3), dtype=np.uint8)
+    images = [Image.fromarray(pixels).resize((SIZE, SIZE), Image.BICUBIC) for pixels in small]
+
+    results = {}
+    for name, fn in [
+        ("png/sequential_default", lambda: save_sequentially(images)),
+        ("png/parallel_fast", lambda: outputs.encode_images(images, "png")),
+        ("webp/parallel", lambda: outputs.encode_images(images, "webp")),
+        ("jpeg/parallel", lambda: outputs.encode_images(images, "jpeg")),
+    ]:
+        results[f"encode_{BATCH}x{SIZE}/{name}"] = timeit.timeit(fn, number=number) / number
+    return results
+
+
+if __name__ == "__main__":
+    for name, seconds in run().items():
+        print(f"{name:40s} {seconds * 1e3:10.3f} ms/call")
@@ -0,0 +1,33 @@
+"""ProcessWorkers on tiny random models (cpu): images per second with 1 and 2 worker processes, 1 torch thread each."""
+import os
+import sys
+import time
+
+sys.path.append("./src/")
+sys.path.append("./tests/")
+from sdqrcode.process_workers import ProcessWorkers
+from tiny_models import get_tiny_config
+
+STEPS = 10
+JOBS = 16
+
+
+def run() -> dict:
+    config = get_tiny_config("txt2img", n_units=2, device="cpu")
+    config["global"]["steps"] = STEPS
+    items = [{"seed": i, "qrcode_text": f"https://koll.ai/{i}"} for i in range(JOBS)]
+
+    results = {}
+    # more workers than cpus only adds contention
+    for n_workers in sorted({1, min(2, os.cpu_count() or 1)}):
+        with ProcessWorkers(config, devices=["cpu"] * n_workers, threads_per_worker=1) as workers:
+            workers.map(items[:n_workers])  # warm up the schedulers of each worker
+            start = time.perf_counter()
+            workers.map(items)
+            results[f"process_workers/{n_workers}_workers/per_image"] = (time.perf_counter() - start) / JOBS
+    return results
+
+
+if __name__ == "__main__":
+    for name, seconds in run().items():
+        print(f"{name:50s} {seconds * 1e3:10.3f} ms/image")
@@ -0,0 +1,48 @@
+"""QR code rendering: qrcode's make_image resampled to the generation size vs numpy rendering at the target size."""
+import sys
+import timeit
+
+import qrcode
+from PIL import Image
+
+sys.path.append("./src/")
+import sdqrcode.sdqrcode as sdqrcode
+
+TEXT = "https://koll.ai"
+SIZE = 768
+
+
+def make_image_and_resize(text: str = TEXT):
+    # previous rendering path: qrcode image at box_size pixels per module, resampled by the engines
+    qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_H, box_size=10, border=4)
+    qr.add_data(text)
+    qr.make(fit=True)
+    qr_img = qr.make_image(fill_color="black", back_color="white").convert("RGB")
+    return qr_img.resize((SIZE, SIZE))
+
+
+def render(text: str = TEXT):
+    return sdqrcode.generate_qrcode_img(
+        error_correction=qrcode.constants.ERROR_CORRECT_H, text=text, width=SIZE, height=SIZE
+    )
+
+
+def render_uncached(text: str = TEXT):
+    sdqrcode.get_qrcode_matrix.cache_clear()
+    return render(text)
+
+
+def run(number: int = 50) -> dict:
+    results = {}
+    for name, fn in [
+        ("make_image+resize", make_image_and_resize),
+        ("numpy_uncached", render_uncached),
+        ("numpy_cached", render),
+    ]:
+        results[f"qrcode/{name}"] = timeit.timeit(fn, number=number) / number
+    return results
+
+
+if __name__ == "__main__":
+    for name, seconds in run().items():
+        print(f"{name:40s} {seconds * 1e3:10.3f} ms/call")
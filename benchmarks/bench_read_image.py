@@ -0,0 +1,55 @@
+"""read_image of a local png and of a url served by a local http server, downloaded or revalidated by the image cache."""
+import os
+import sys
+import tempfile
+import threading
+import timeit
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import PIL.Image
+
+sys.path.append("./src/")
+from sdqrcode.image_cache import ImageCache
+
+SIZE = 768
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def run(number: int = 20) -> dict:
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, "input.png")
+    pixels = np.random.default_rng(0).integers(0, 256, (SIZE, SIZE, 3), dtype=np.uint8)
+    PIL.Image.fromarray(pixels).save(path)
+
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), lambda *args: QuietHandler(*args, directory=tmp_dir)
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/input.png"
+
+    results = {}
+    cache = ImageCache()
+    try:
+        # images are opened lazily, load() includes the png decoding
+        seconds = timeit.timeit(lambda: cache.read(path).load(), number=number)
+        results["read_image/file"] = seconds / number
+        # the first fetch of a url downloads it, the next ones are answered by a 304
+        seconds = timeit.timeit(lambda: ImageCache().read(url).load(), number=number)
+        results["read_image/url_download"] = seconds / number
+        seconds = timeit.timeit(lambda: cache.read(url).load(), number=number)
+        results["read_image/url_revalidated"] = seconds / number
+    finally:
+        cache.close()
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+if __name__ == "__main__":
+    for name, seconds in run().items():
+        print(f"{name:40s} {seconds * 1e3:10.3f} ms/call")
@@ -0,0 +1,31 @@
+"""Per-call overhead of setting the scheduler before a generation: rebuilt every call vs cached."""
+import sys
+import timeit
+
+sys.path.append("./src/")
+from sdqrcode.Engines import schedulers
+
+SCHEDULER_NAMES = ["Euler a", "DDIM", "UniPC", "DPM++ 2M Karras"]
+
+
+def run(number: int = 200) -> dict:
+    from diffusers import DDIMScheduler
+
+    # same scheduler config as the stable diffusion 1.5 checkpoints
+    scheduler_config = DDIMScheduler(
+        beta_start=0.00085, beta_end=0.012, beta_schedule="scaled_linear", clip_sample=False, set_alpha_to_one=False
+    ).config
+
+    results = {}
+    for name in SCHEDULER_NAMES:
+        rebuild = timeit.timeit(lambda: schedulers.create_scheduler(name, scheduler_config), number=number)
+        cache = schedulers.SchedulerCache(scheduler_config)
+        cached = timeit.timeit(lambda: cache.get(name), number=number)
+        results[f"scheduler/{name}/rebuild"] = rebuild / number
+        results[f"scheduler/{name}/cached"] = cached / number
+    return results
+
+
+if __name__ == "__main__":
+    for name, seconds in run().items():
+        print(f"{name:40s} {seconds * 1e6:10.1f} us/call")
@@ -0,0 +1,123 @@
+"""
+Run the benchmarks (benchmarks/bench_*.py) and write their results with the commit and environment as json,
+to compare runs across commits. Runs on cpu: the diffusers benchmarks use tiny random models and the
+Automatic1111 ones local mock servers.
+
+    python benchmarks/run_benchmarks.py --out results.json
+    python benchmarks/run_benchmarks.py --only qrcode,config --compare results.json
+"""
+import argparse
+import contextlib
+import datetime
+import glob
+import importlib
+import importlib.metadata
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import traceback
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PACKAGES = ("torch", "diffusers", "transformers", "numpy", "Pillow", "qrcode", "webuiapi")
+
+
+def benchmark_names() -> list[str]:
+    paths = sorted(glob.glob(os.path.join(BENCHMARKS_DIR, "bench_*.py")))
+    return [os.path.basename(path)[len("bench_") : -len(".py")] for path in paths]
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=BENCHMARKS_DIR
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            versions[package] = None
+    return {
+        "commit": commit,
+        "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "packages": versions,
+    }
+
+
+def run_benchmarks(names: list[str]) -> dict:
+    """
+    Results of each benchmark: {"results": {metric: value}, "seconds": duration} or {"error": traceback}.
+    Metrics are in seconds (per call or per image, lower is better) unless their name says otherwise.
+    """
+    sys.path.insert(0, BENCHMARKS_DIR)
+    benchmarks = {}
+    for name in names:
+        print(f"running {name}", file=sys.stderr)
+        start = time.perf_counter()
+        try:
+            # the output of the benchmarked code doesn't mix with the json on stdout
+            with contextlib.redirect_stdout(sys.stderr):
+                results = importlib.import_module(f"bench_{name}").run()
+            benchmarks[name] = {"results": results, "seconds": time.perf_counter() - start}
+        except Exception:
+            # a benchmark missing an optional dependency doesn't stop the others
+            benchmarks[name] = {"error": traceback.format_exc()}
+    return benchmarks
+
+
+def compare(old: dict, new: dict) -> list[tuple]:
+    """(metric, old value, new value, new / old) of the numeric metrics of both runs"""
+    rows = []
+    for name, benchmark in new["benchmarks"].items():
+        old_results = old["benchmarks"].get(name, {}).get("results", {})
+        for metric, value in benchmark.get("results", {}).items():
+            old_value = old_results.get(metric)
+            if isinstance(value, (int, float)) and isinstance(old_value, (int, float)) and old_value:
+                rows.append((metric, old_value, value, value / old_value))
+    return rows
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Run the benchmarks and save their results as json")
+    parser.add_argument("--out", default=None, help="json file of the results (default: stdout)")
+    parser.add_argument("--only", default=None, help=f"comma separated benchmarks, among {', '.join(benchmark_names())}")
+    parser.add_argument("--compare", default=None, help="json file of a previous run to compare with")
+    args = parser.parse_args(args)
+
+    names = benchmark_names() if args.only is None else args.only.split(",")
+    unknown = set(names) - set(benchmark_names())
+    if unknown:
+        parser.error(f"unknown benchmarks {sorted(unknown)}")
+
+    run = {"environment": environment(), "benchmarks": run_benchmarks(names)}
+    data = json.dumps(run, indent=2, default=str)
+    if args.out is None:
+        print(data)
+    else:
+        with open(args.out, "w") as f:
+            f.write(data)
+
+    for name, benchmark in run["benchmarks"].items():
+        if "error" in benchmark:
+            print(f"{name} failed:\n{benchmark['error']}", file=sys.stderr)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print(f"\ncompared to {old['environment']['commit']}", file=sys.stderr)
+        for metric, old_value, value, ratio in compare(old, run):
+            print(f"{metric:50s} {old_value:12.6f} -> {value:12.6f} x{ratio:.2f}", file=sys.stderr)
+    return run
+
+
+if __name__ == "__main__":
+    main()
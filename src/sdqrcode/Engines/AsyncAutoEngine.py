@@ -0,0 +1,200 @@
+import asyncio
+import threading
+from typing import Union
+
+import PIL.Image
+import sdqrcode.Engines.Engine as Engine
+import sdqrcode.Engines.auto_payload as auto_payload
+import sdqrcode.tracing as tracing
+
+
+class Host:
+    def __init__(self, baseurl: str):
+        self.baseurl = baseurl
+        self.active_model = None
+        self.in_flight = 0
+        self.completed = 0
+
+
+async def traced(parent, coroutine):
+    """Run a coroutine in another event loop as part of the trace of the calling thread"""
+    with tracing.attach(parent):
+        return await coroutine
+
+
+class AsyncAutomaticEngine(Engine.Engine):
+    def __init__(
+        self,
+        config,
+        hostname: Union[str, list[str]],
+        port: int = 7860,
+        https: bool = False,
+        username: str = "",
+        password: str = "",
+        connections_per_host: int = 4,
+    ):
+        """
+        Automatic1111 engine dispatching generations to a fleet of servers, each job going
+        to the host with the fewest jobs in flight. Connections are kept alive and pooled per host.
+
+        Args:
+            hostname: Hostname(s) of the Automatic1111 servers, "host", "host:port" or "http(s)://host:port"
+            port: Port of the Automatic1111 servers given without one (default: 7860)
+            https: Use HTTPS for the Automatic1111 servers
+            username: Username for the Automatic1111 servers (if any)
+            password: Password for the Automatic1111 servers (if any)
+            connections_per_host: Maximum number of open connections to each server
+        """
+        super().__init__(config)
+
+        port = 443 if https else port
+        scheme = "https" if https else "http"
+        hostnames = [hostname] if isinstance(hostname, str) else list(hostname)
+        self.hosts = []
+        for name in hostnames:
+            if "://" not in name:
+                name = f"{scheme}://{name}" if ":" in name else f"{scheme}://{name}:{port}"
+            self.hosts.append(Host(f"{name}/sdapi/v1"))
+
+        self.connections_per_host = connections_per_host
+        self.max_concurrency = connections_per_host * len(self.hosts)
+        self.output_types = ("pil", "np", "png")
+        self.returns_cn_imgs = True
+        self.image_cache = auto_payload.ImagePayloadCache()
+        self.auth = (username, password) if username and password else None
+        self._session = None
+        self._hosts_lock = threading.Lock()
+        self._loop = None
+        self._loop_thread = None
+
+    async def agenerate_sd_qrcode(
+        self,
+        input_image: PIL.Image.Image = None,
+        controlnet_input_images: list[PIL.Image.Image] = None,
+        return_cn_imgs=False,
+        config=None,
+        output_type: str = "pil",
+    ) -> list:
+        config = self.config if config is None else config
+        request = self._build_request(config, input_image, controlnet_input_images, return_cn_imgs)
+        # the requests run in the loop of the engine, whose connections are shared by every caller loop
+        future = asyncio.run_coroutine_threadsafe(
+            traced(tracing.current_span(), self._request(*request, return_cn_imgs, output_type)), self._get_loop()
+        )
+        return await asyncio.wrap_future(future)
+
+    async def agenerate_sd_qrcode_stream(
+        self, input_image=None, controlnet_input_images=None, config=None, preview_callback=None
+    ):
+        """
+        The images come with the response of the server, without previews: with concurrent jobs on a server,
+        its progress endpoint may show another job than this one
+        """
+        for image in await self.agenerate_sd_qrcode(input_image, controlnet_input_images, config=config):
+            yield image
+
+    def generate_sd_qrcode(
+        self,
+        input_image: PIL.Image.Image = None,
+        controlnet_input_images: list[PIL.Image.Image] = None,
+        return_cn_imgs=False,
+        config=None,
+        output_type: str = "pil",
+    ) -> list:
+        config = self.config if config is None else config
+        request = self._build_request(config, input_image, controlnet_input_images, return_cn_imgs)
+        # blocking calls share the connections of the background event loop
+        future = asyncio.run_coroutine_threadsafe(
+            traced(tracing.current_span(), self._request(*request, return_cn_imgs, output_type)), self._get_loop()
+        )
+        return future.result()
+
+    def release(self):
+        """Close the connections and stop the event loop of the engine"""
+        with self._hosts_lock:
+            loop, self._loop = self._loop, None
+        if loop is not None:
+            asyncio.run_coroutine_threadsafe(self._close_session(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            self._loop_thread.join()
+            loop.close()
+
+    @property
+    def active_models(self) -> list[str]:
+        return [host.active_model for host in self.hosts]
+
+    def _acquire_host(self, model_name: str) -> Host:
+        with self._hosts_lock:
+            # least loaded host, preferring the ones that already have the checkpoint loaded
+            host = min(self.hosts, key=lambda h: (h.in_flight, h.active_model != model_name, h.completed))
+            host.in_flight += 1
+            host.active_model = model_name
+            return host
+
+    def _release_host(self, host: Host):
+        with self._hosts_lock:
+            host.in_flight -= 1
+            host.completed += 1
+
+    def _build_request(self, config: dict, input_image, controlnet_input_images, return_cn_imgs: bool) -> tuple:
+        # the images are encoded by the calling thread, the event loop of the engine only does the io
+        with tracing.span("encode_payload"):
+            endpoint, payload = auto_payload.build_payload(
+                config, input_image, controlnet_input_images, self.image_cache, return_cn_imgs
+            )
+        model_name = config["global"]["model_name_or_path"]
+
+        # the checkpoint travels with the request: the server only reloads it when it differs
+        # from the loaded one, and concurrent jobs can't switch it under each other's feet
+        payload["override_settings"]["sd_model_checkpoint"] = model_name
+        payload["override_settings_restore_afterwards"] = False
+        return endpoint, payload, model_name
+
+    async def _request(
+        self, endpoint: str, payload: dict, model_name: str, return_cn_imgs: bool, output_type: str
+    ) -> list:
+        session = self._get_session()
+        host = self._acquire_host(model_name)
+        try:
+            with tracing.span("request", endpoint=endpoint, host=host.baseurl):
+                r = await self._post(session, host, endpoint, payload)
+        finally:
+            self._release_host(host)
+
+        with tracing.span("decode_images", output_type=output_type):
+            encoded_images = auto_payload.select_images(r["images"], payload["batch_size"], return_cn_imgs)
+            # out of the event loop, which keeps serving the other jobs
+            return await asyncio.get_running_loop().run_in_executor(
+                None, auto_payload.decode_images, encoded_images, output_type
+            )
+
+    async def _post(self, session, host: Host, endpoint: str, payload: dict) -> dict:
+        async with session.post(f"{host.baseurl}/{endpoint}", json=payload) as response:
+            if response.status != 200:
+                raise RuntimeError(response.status, await response.text())
+            return await response.json()
+
+    def _get_session(self):
+        import aiohttp
+
+        # only used from the event loop of the engine, which the session is bound to
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit_per_host=self.connections_per_host),
+                auth=aiohttp.BasicAuth(*self.auth) if self.auth else None,
+                timeout=aiohttp.ClientTimeout(total=None),
+            )
+        return self._session
+
+    async def _close_session(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _get_loop(self):
+        with self._hosts_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+                self._loop_thread.start()
+            return self._loop
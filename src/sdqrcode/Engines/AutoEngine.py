@@ -1,10 +1,14 @@
+import base64
+import concurrent.futures
+import contextvars
+from io import BytesIO
+
 import webuiapi
 import PIL
-import os
-
-print(os.getcwd())
-import sys
+import PIL.Image
 import sdqrcode.Engines.Engine as Engine
+import sdqrcode.Engines.auto_payload as auto_payload
+import sdqrcode.tracing as tracing
 from typing import Union
 
 
@@ -33,65 +37,94 @@ class AutomaticEngine(Engine.Engine):
         self.api = webuiapi.WebUIApi(
             hostname, username=username, password=password, port=port, use_https=https
         )
+        self.active_model = None
+        self.output_types = ("pil", "np", "png")
+        self.returns_cn_imgs = True
+        self.image_cache = auto_payload.ImagePayloadCache()
+
+    @property
+    def active_models(self) -> list[str]:
+        return [self.active_model]
 
+    def set_model(self, model_name: str):
+        """Switch the server checkpoint, unless it is already the loaded one"""
+        if self.active_model is None:
+            self.active_model = self.api.util_get_current_model()
+        if model_name != self.active_model:
+            self.api.util_set_model(model_name)
+            self.active_model = model_name
+
+    # the server checkpoint is switched per call, calls run one at a time so it can't change mid-generation
+    @Engine.serialized
     def generate_sd_qrcode(
         self,
         input_image: PIL.Image.Image = None,
         controlnet_input_images: PIL.Image.Image = None,
         return_cn_imgs=False,
-    ) -> PIL.Image.Image:
-        
+        config=None,
+        output_type: str = "pil",
+    ) -> list:
+        """
+        Args:
+            return_cn_imgs: also return the detect maps of the controlnet units, after the generated images
+            output_type: pil, np, or png for the bytes sent by the server (see auto_payload.decode_images)
+        """
+        config = self.config if config is None else config
+
         # set the model
-        self.api.util_set_model(self.config["global"]["model_name_or_path"])
-        print("model set")
+        with tracing.span("set_model"):
+            self.set_model(config["global"]["model_name_or_path"])
 
-        # define controlnet units
-        cn_units = []
-        for cn_input_img, (name, unit) in zip(
-            controlnet_input_images, self.config["controlnet_units"].items()
-        ):
-            print("unit", unit)
-            cn_unit = webuiapi.ControlNetUnit(
-                input_image=cn_input_img,
-                module="none",
-                model=unit["model"],
-                pixel_perfect=True,
-                weight=unit["weight"],
-                guidance_start=unit["start"],
-                guidance_end=unit["end"],
+        with tracing.span("encode_payload"):
+            endpoint, payload = auto_payload.build_payload(
+                config, input_image, controlnet_input_images, self.image_cache, return_cn_imgs
             )
-            cn_units.append(cn_unit)
+        with tracing.span("request", endpoint=endpoint):
+            # the raw response, webuiapi would decode every image of it
+            response = self.api.session.post(url=f"{self.api.baseurl}/{endpoint}", json=payload)
+            if response.status_code != 200:
+                raise RuntimeError(response.status_code, response.text)
+            encoded_images = response.json()["images"]
 
-        if self.config["global"]["mode"] == "txt2img":
-            r = self.api.txt2img(
-                seed=self.config["global"]["seed"],
-                prompt=self.config["global"]["prompt"],
-                negative_prompt=self.config["global"]["negative_prompt"],
-                width=self.config["global"]["width"],
-                height=self.config["global"]["height"],
-                steps=self.config["global"]["steps"],
-                sampler_name=self.config["global"]["scheduler_name"],
-                cfg_scale=self.config["global"]["cfg_scale"],
-                controlnet_units=cn_units,
-                batch_size=self.config["global"]["batch_size"],
-            )
-        if self.config["global"]["mode"] == "img2img":
-            r = self.api.img2img(
-                seed=self.config["global"]["seed"],
-                images=[input_image],
-                denoising_strength=self.config["global"]["denoising_strength"],
-                prompt=self.config["global"]["prompt"],
-                negative_prompt=self.config["global"]["negative_prompt"],
-                width=self.config["global"]["width"],
-                height=self.config["global"]["height"],
-                steps=self.config["global"]["steps"],
-                sampler_name=self.config["global"]["scheduler_name"],
-                cfg_scale=self.config["global"]["cfg_scale"],
-                controlnet_units=cn_units,
-                batch_size=self.config["global"]["batch_size"],
-            )
+        with tracing.span("decode_images", output_type=output_type):
+            encoded_images = auto_payload.select_images(encoded_images, payload["batch_size"], return_cn_imgs)
+            return auto_payload.decode_images(encoded_images, output_type)
 
-        if return_cn_imgs:
-            return r.images
-        else:
-            return r.images[0 : -len(cn_units)]
+    def generate_sd_qrcode_stream(
+        self,
+        input_image: PIL.Image.Image = None,
+        controlnet_input_images: PIL.Image.Image = None,
+        config=None,
+        preview_callback=None,
+        preview_interval: float = 0.5,
+    ):
+        """
+        The images come with the response of the server. With a preview_callback, the progress endpoint
+        of the server is polled every preview_interval seconds while it generates, and the callback gets
+        (step, [preview]) each time the server has a new preview (live previews enabled in the webui settings).
+        """
+        if preview_callback is None:
+            yield from self.generate_sd_qrcode(input_image, controlnet_input_images, config=config)
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            future = executor.submit(
+                contextvars.copy_context().run,
+                self.generate_sd_qrcode,
+                input_image,
+                controlnet_input_images,
+                config=config,
+            )
+            last_step = None
+            while not concurrent.futures.wait([future], timeout=preview_interval).done:
+                try:
+                    progress = self.api.get_progress()
+                except Exception:
+                    # previews are best effort, the generation goes on without them
+                    continue
+                step = (progress.get("state") or {}).get("sampling_step")
+                if progress.get("current_image") and step != last_step:
+                    last_step = step
+                    preview_callback(step, [PIL.Image.open(BytesIO(base64.b64decode(progress["current_image"])))])
+            images = future.result()
+        yield from images
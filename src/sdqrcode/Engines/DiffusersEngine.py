@@ -1,202 +1,518 @@
 import sdqrcode.Engines.Engine as Engine
+import sdqrcode.Engines.branching as branching
+import sdqrcode.Engines.device_policy as device_policy
+import sdqrcode.Engines.gated_controlnet as gated_controlnet
+import sdqrcode.Engines.model_registry as model_registry
+import sdqrcode.Engines.previews as previews
+import sdqrcode.Engines.prompt_cache as prompt_cache
+import sdqrcode.Engines.schedulers as schedulers
+import sdqrcode.tracing as tracing
+import inspect
+import random
+import time
 
 from diffusers import (
-    ControlNetModel,
     StableDiffusionControlNetPipeline,
     StableDiffusionControlNetImg2ImgPipeline,
-    UniPCMultistepScheduler,
 )
 import torch
-import transformers
-from diffusers import UniPCMultistepScheduler
-from diffusers import DPMSolverMultistepScheduler
 import PIL
-import torch
 
-# [diffusers.schedulers.scheduling_ddim.DDIMScheduler,
-#  diffusers.schedulers.scheduling_euler_ancestral_discrete.EulerAncestralDiscreteScheduler,
-#  diffusers.schedulers.scheduling_lms_discrete.LMSDiscreteScheduler,
-#  diffusers.schedulers.scheduling_dpmsolver_singlestep.DPMSolverSinglestepScheduler,
-#  diffusers.schedulers.scheduling_k_dpm_2_discrete.KDPM2DiscreteScheduler,
-#  diffusers.schedulers.scheduling_heun_discrete.HeunDiscreteScheduler,
-#  diffusers.schedulers.scheduling_deis_multistep.DEISMultistepScheduler,
-#  diffusers.schedulers.scheduling_euler_discrete.EulerDiscreteScheduler,
-#  diffusers.schedulers.scheduling_k_dpm_2_ancestral_discrete.KDPM2AncestralDiscreteScheduler,
-#  diffusers.schedulers.scheduling_unipc_multistep.UniPCMultistepScheduler,
-#  diffusers.schedulers.scheduling_ddpm.DDPMScheduler,
-#  diffusers.utils.dummy_torch_and_torchsde_objects.DPMSolverSDEScheduler,
-#  diffusers.schedulers.scheduling_dpmsolver_multistep.DPMSolverMultistepScheduler,
-#  diffusers.schedulers.scheduling_pndm.PNDMScheduler]
-
-from diffusers.schedulers.scheduling_ddim import DDIMScheduler
-from diffusers.schedulers.scheduling_euler_ancestral_discrete import (
-    EulerAncestralDiscreteScheduler,
-)
-from diffusers.schedulers.scheduling_lms_discrete import LMSDiscreteScheduler
-from diffusers.schedulers.scheduling_dpmsolver_singlestep import (
-    DPMSolverSinglestepScheduler,
-)
-from diffusers.schedulers.scheduling_k_dpm_2_discrete import KDPM2DiscreteScheduler
-from diffusers.schedulers.scheduling_heun_discrete import HeunDiscreteScheduler
-from diffusers.schedulers.scheduling_deis_multistep import DEISMultistepScheduler
-from diffusers.schedulers.scheduling_euler_discrete import EulerDiscreteScheduler
-from diffusers.schedulers.scheduling_k_dpm_2_ancestral_discrete import (
-    KDPM2AncestralDiscreteScheduler,
-)
-from diffusers.schedulers.scheduling_unipc_multistep import UniPCMultistepScheduler
-from diffusers.schedulers.scheduling_ddpm import DDPMScheduler
-from diffusers.utils.dummy_torch_and_torchsde_objects import DPMSolverSDEScheduler
-from diffusers.schedulers.scheduling_dpmsolver_multistep import (
-    DPMSolverMultistepScheduler,
-)
-from diffusers.schedulers.scheduling_pndm import PNDMScheduler
+
+PIPELINE_CLASSES = {
+    "txt2img": StableDiffusionControlNetPipeline,
+    "img2img": StableDiffusionControlNetImg2ImgPipeline,
+}
 
 
 class DiffusersEngine(Engine.Engine):
     def __init__(self, config, torch_dtype):
         super().__init__(config)
+        # placement of the models, read once: changing it means loading the models again
+        self.device_config = device_policy.get_device_config(self.config)
+        self.device = self.device_config["name"]
+        # the attention and slicing settings are applied to the shared models, they are part of the registry keys
+        cn_settings = {key: self.device_config[key] for key in ("offload", "attention", "attention_slicing")}
+        base_settings = dict(cn_settings, vae_slicing=self.device_config["vae_slicing"])
+        # settings, duration and peak memory of the last generation
+        self.last_stats = None
+        # arrays are converted from the decoded tensor, without going through PIL
+        self.output_types = ("pil", "np")
+        # the prompt usually stays the same while the qr code, seed or controlnet params change
+        self.prompt_cache = prompt_cache.PromptEmbeddingCache()
 
+        # models are shared with the other engines of the process through the registry
+        self._registry_keys = []
         self.controlnet_units = []
         for name, unit in self.config["controlnet_units"].items():
-            cn_unit = ControlNetModel.from_pretrained(unit["model"], torch_dtype=torch_dtype)
-            self.controlnet_units.append(cn_unit)
-        
-        
-        
-        if len(self.controlnet_units) == 1:
-            self.controlnet_units = self.controlnet_units[0]
-            
-        if self.config["global"]["mode"] == "txt2img":  
-            self.pipeline = StableDiffusionControlNetPipeline.from_pretrained(
-                self.config["global"]["model_name_or_path"],
-                controlnet=self.controlnet_units,
-                torch_dtype=torch_dtype,
+            cn_unit = model_registry.acquire_controlnet(unit["model"], torch_dtype, self.device, **cn_settings)
+            self._registry_keys.append(
+                model_registry.controlnet_key(unit["model"], torch_dtype, self.device, **cn_settings)
             )
-        
-        if self.config["global"]["mode"] == "img2img":
-            self.pipeline = StableDiffusionControlNetImg2ImgPipeline.from_pretrained(
-                self.config["global"]["model_name_or_path"],
-                controlnet=self.controlnet_units,
-                torch_dtype=torch_dtype,
-            )
-        self.pipeline.enable_xformers_memory_efficient_attention()
-        self.pipeline = self.pipeline.to("cuda")
+            self.controlnet_units.append(cn_unit)
+
+        model_name = self.config["global"]["model_name_or_path"]
+        self.components = model_registry.acquire_base_components(model_name, torch_dtype, self.device, **base_settings)
+        self._registry_keys.append(model_registry.base_model_key(model_name, torch_dtype, self.device, **base_settings))
+
+        # even a single controlnet is wrapped: steps outside of a unit's start/end don't evaluate its controlnet
+        self.controlnet = gated_controlnet.GatedMultiControlNetModel(self.controlnet_units)
+
+        # txt2img and img2img pipelines are built on demand around the same components
+        self._pipelines = {}
+        self._scheduler_caches = {}
+        self.pipeline = self.get_pipeline(self.config["global"]["mode"])
+
+    def get_pipeline(self, mode: str):
+        """Pipeline for the mode (txt2img or img2img), sharing its weights with the other mode"""
+        if mode not in self._pipelines:
+            if mode not in PIPELINE_CLASSES:
+                raise ValueError(f"Mode {mode} not found, should be one of {list(PIPELINE_CLASSES)}")
+            pipeline = build_pipeline(PIPELINE_CLASSES[mode], self.components, self.controlnet)
+            self._pipelines[mode] = device_policy.apply_device_config(pipeline, self.device_config)
+            self._scheduler_caches[mode] = schedulers.SchedulerCache(pipeline.scheduler.config)
+        return self._pipelines[mode]
+
+    def set_scheduler(self, mode: str, scheduler_name: str):
+        """Set the scheduler of the pipeline of the mode, built once per name and reset for each generation"""
+        with tracing.span("scheduler", scheduler_name=scheduler_name):
+            scheduler = self._scheduler_caches[mode].get(scheduler_name)
+        self._pipelines[mode].scheduler = scheduler
+        return scheduler
+
+    def get_stats(self, monitor: device_policy.PeakMemoryMonitor) -> dict:
+        """Stats of the generation that just ran: device settings, duration, peak memory and controlnet evaluations"""
+        stats = monitor.stats(self.device_config)
+        # one tuple per step with whether each unit's controlnet ran, it is skipped when its scale is 0
+        stats["controlnet_active_steps"] = self.controlnet.active_steps
+        stats["controlnet_evaluated"] = self.controlnet.evaluated
+        stats["controlnet_skipped"] = self.controlnet.skipped
+        return stats
 
+    @Engine.serialized
+    def release(self):
+        """Give the shared models back to the registry, the engine can't generate afterwards"""
+        for key in self._registry_keys:
+            model_registry.REGISTRY.release(key)
+        self._registry_keys = []
+        self._pipelines = {}
+        self._scheduler_caches = {}
+        self.prompt_cache.clear()
+        self.components = None
+        self.pipeline = None
 
+
+    @Engine.serialized
     def generate_sd_qrcode(
         self,
         input_image: PIL.Image.Image = None,
         controlnet_input_images: PIL.Image.Image = None,
+        config=None,
+        output_type: str = "pil",
     ) -> list[PIL.Image.Image]:
+        """
+        Args:
+            output_type: pil, or np for (height, width, 3) uint8 arrays, views of one array of the batch
+        """
+        config = self.config if config is None else config
+        pipeline_kwargs = self.get_pipeline_kwargs(config, input_image, controlnet_input_images)
+        if output_type == "np":
+            pipeline_kwargs["output_type"] = "pt"
+
+        self.controlnet.reset_stats()
+        span = tracing.span("pipeline", mode=config["global"]["mode"], images=config["global"]["batch_size"])
+        step_ends = []
+        if span:
+            pipeline_kwargs.update(
+                step_callback_kwargs(self.pipeline, lambda step, latents: step_ends.append(time.perf_counter()))
+            )
+        with span, device_policy.PeakMemoryMonitor(self.device) as monitor:
+            start = time.perf_counter()
+            r = self.pipeline(**pipeline_kwargs)
+            add_step_spans(span, start, step_ends, time.perf_counter())
+        self.last_stats = self.get_stats(monitor)
+
+        if output_type == "np":
+            return list(to_uint8_array(r.images))
+        return r.images
+
+    def generate_sd_qrcode_stream(
+        self,
+        input_image: PIL.Image.Image = None,
+        controlnet_input_images: PIL.Image.Image = None,
+        config=None,
+        preview_callback=None,
+    ):
+        """
+        Yield the images one by one, each as soon as it is decoded: the batch is denoised in one pipeline call,
+        then the vae decodes its images one at a time. preview_callback(step, images) gets rough previews
+        of the batch after each step, see previews.latents_to_rgb.
+        """
+        config = self.config if config is None else config
+        with self._lock:
+            pipeline_kwargs = self.get_pipeline_kwargs(config, input_image, controlnet_input_images)
+            pipeline = self.pipeline
+            if preview_callback is not None:
+                pipeline_kwargs.update(
+                    step_callback_kwargs(
+                        pipeline, lambda step, latents: preview_callback(step, previews.latents_to_rgb(latents))
+                    )
+                )
+
+            self.controlnet.reset_stats()
+            with device_policy.PeakMemoryMonitor(self.device) as monitor:
+                latents = pipeline(**pipeline_kwargs, output_type="latent").images
+            self.last_stats = self.get_stats(monitor)
+
+        # the lock isn't held while the caller handles an image, other generations can run in between
+        generators = pipeline_kwargs["generator"]
+        for i, image_latents in enumerate(latents.split(1)):
+            with self._lock:
+                images = decode_latents(pipeline, image_latents, generators[i] if generators else None)
+            yield from images
+
+    def check_models(self, config: dict):
+        """The models are loaded once by the constructor, requests for other ones can't be honored"""
+        requested, loaded = [
+            (c["global"]["model_name_or_path"], [unit["model"] for unit in c["controlnet_units"].values()])
+            for c in (config, self.config)
+        ]
+        if requested != loaded:
+            raise ValueError(
+                f"The engine runs {loaded[0]} with controlnets {loaded[1]}, it can't generate with {requested[0]} "
+                f"and controlnets {requested[1]}: use another generator for these models"
+            )
+
+    def get_pipeline_kwargs(self, config, input_image=None, controlnet_input_images=None) -> dict:
+        """Pipeline call kwargs of a generation, self.pipeline is set to the pipeline of its mode and scheduler"""
+        self.check_models(config)
         controlnet_weights = [
-            unit["weight"] for unit in self.config["controlnet_units"].values()
+            unit["weight"] for unit in config["controlnet_units"].values()
         ]
         
         guidance_starts = [
-            unit["start"] for unit in self.config["controlnet_units"].values()
+            unit["start"] for unit in config["controlnet_units"].values()
         ]
         
         guidance_stops = [
-            unit["end"] for unit in self.config["controlnet_units"].values()
+            unit["end"] for unit in config["controlnet_units"].values()
         ]
 
-        self.pipeline.scheduler = get_scheduler(
-            self.config["global"]["scheduler_name"],
-            self.pipeline.scheduler.config,
-        )
+        self.pipeline = self.get_pipeline(config["global"]["mode"])
+        self.set_scheduler(config["global"]["mode"], config["global"]["scheduler_name"])
         
-        seeded_generator = torch.Generator(device="cuda").manual_seed(
-            self.config["global"]["seed"]
-        ) if self.config["global"]["seed"] != -1 else None
+        with tracing.span("encode_prompt"):
+            prompt_embeds, negative_prompt_embeds = self.prompt_cache.get(
+                self.pipeline,
+                config["global"]["model_name_or_path"],
+                config["global"]["prompt"],
+                config["global"]["negative_prompt"],
+            )
 
-        
-        # fix bug when only one image is provided in the list
-        if len(controlnet_input_images) == 1:
-            controlnet_input_images = controlnet_input_images[0]
-        if len(controlnet_weights) == 1:
-            controlnet_weights = controlnet_weights[0]
-        if len(guidance_starts) == 1:
-            guidance_starts = guidance_starts[0]
-        if len(guidance_stops) == 1:
-            guidance_stops = guidance_stops[0]
-            
-        if self.config["global"]["mode"] == "txt2img":
-            r = self.pipeline(
-                generator=seeded_generator,
-                prompt=self.config["global"]["prompt"],
-                negative_prompt=self.config["global"]["negative_prompt"],
-                width=self.config["global"]["width"],
-                height=self.config["global"]["height"],
-                num_inference_steps=self.config["global"]["steps"],
-                image=controlnet_input_images,
-                controlnet_conditioning_scale=controlnet_weights,
-                num_images_per_prompt=self.config["global"]["batch_size"],
-                control_guidance_start=guidance_starts,
-                control_guidance_end=guidance_stops,
+        # image i is seeded with seed + i, as in generate_sd_qrcode_batch: any image of the call
+        # is generated again by a call with its seed, alone or in another batch
+        seed = config["global"]["seed"]
+        seeded_generators = [
+            torch.Generator(device=self.device).manual_seed(seed + i) for i in range(config["global"]["batch_size"])
+        ] if seed != -1 else None
+
+        pipeline_kwargs = dict(
+            generator=seeded_generators,
+            prompt_embeds=prompt_embeds,
+            negative_prompt_embeds=negative_prompt_embeds,
+            width=config["global"]["width"],
+            height=config["global"]["height"],
+            num_inference_steps=config["global"]["steps"],
+            guidance_scale=config["global"]["cfg_scale"],
+            controlnet_conditioning_scale=controlnet_weights,
+            num_images_per_prompt=config["global"]["batch_size"],
+            control_guidance_start=guidance_starts,
+            control_guidance_end=guidance_stops,
+        )
+        if config["global"]["mode"] == "txt2img":
+            pipeline_kwargs["image"] = controlnet_input_images
+        if config["global"]["mode"] == "img2img":
+            pipeline_kwargs["image"] = input_image
+            pipeline_kwargs["control_image"] = controlnet_input_images
+        return pipeline_kwargs
+
+    @Engine.serialized
+    def generate_sd_qrcode_batch(self, configs, input_images, controlnet_input_images):
+        """
+        Generate every item in a single pipeline call, the configs must share the same batch key
+        (see sdqrcode.get_batch_key). Each image gets its own generator so that the images of an item
+        only depend on its seed, not on the other items of the batch.
+        """
+        for item_config in configs:
+            self.check_models(item_config)
+        config = configs[0]
+        batch_size = config["global"]["batch_size"]
+        units = list(config["controlnet_units"].values())
+
+        # one entry per generated image
+        prompts, negative_prompts, generators, init_images = [], [], [], []
+        units_images = [[] for _ in units]
+        for item_config, input_image, cn_input_images in zip(configs, input_images, controlnet_input_images):
+            seed = item_config["global"]["seed"]
+            if seed == -1:
+                seed = random.randrange(2**32)
+            for i in range(batch_size):
+                prompts.append(item_config["global"]["prompt"])
+                negative_prompts.append(item_config["global"]["negative_prompt"])
+                generators.append(torch.Generator(device=self.device).manual_seed(seed + i))
+                init_images.append(input_image)
+                for unit_images, cn_input_image in zip(units_images, cn_input_images):
+                    unit_images.append(cn_input_image)
+
+        self.pipeline = self.get_pipeline(config["global"]["mode"])
+        self.set_scheduler(config["global"]["mode"], config["global"]["scheduler_name"])
+
+        # stack the images of each unit in one (batch, 3, height, width) tensor,
+        # nested lists of images are read differently depending on the diffusers version
+        units_images = [
+            self.pipeline.control_image_processor.preprocess(
+                unit_images, height=config["global"]["height"], width=config["global"]["width"]
             )
-        
-        if self.config["global"]["mode"] == "img2img":
-            r = self.pipeline(
-                prompt=self.config["global"]["prompt"],
-                image=input_image,
-                negative_prompt=self.config["global"]["negative_prompt"],
-                width=self.config["global"]["width"],
-                height=self.config["global"]["height"],
-                num_inference_steps=self.config["global"]["steps"],
-                control_image=controlnet_input_images,
-                controlnet_conditioning_scale=controlnet_weights,
-                generator=seeded_generator,
-                control_guidance_start=guidance_starts,
-                control_guidance_end=guidance_stops,
-
-                num_images_per_prompt=self.config["global"]["batch_size"],
+            for unit_images in units_images
+        ]
+        with tracing.span("encode_prompt"):
+            prompt_embeds, negative_prompt_embeds = self.prompt_cache.get_batch(
+                self.pipeline, config["global"]["model_name_or_path"], prompts, negative_prompts
             )
+        controlnet_weights = [unit["weight"] for unit in units]
+        guidance_starts = [unit["start"] for unit in units]
+        guidance_stops = [unit["end"] for unit in units]
 
-        return r.images
+        self.controlnet.reset_stats()
+        span = tracing.span("pipeline", mode=config["global"]["mode"], images=len(generators))
+        step_ends = []
+        step_timer = {}
+        if span:
+            step_timer = step_callback_kwargs(self.pipeline, lambda step, latents: step_ends.append(time.perf_counter()))
+        with span, device_policy.PeakMemoryMonitor(self.device) as monitor:
+            start = time.perf_counter()
+            if config["global"]["mode"] == "txt2img":
+                r = self.pipeline(
+                    **step_timer,
+                    generator=generators,
+                    prompt_embeds=prompt_embeds,
+                    negative_prompt_embeds=negative_prompt_embeds,
+                    width=config["global"]["width"],
+                    height=config["global"]["height"],
+                    num_inference_steps=config["global"]["steps"],
+                    guidance_scale=config["global"]["cfg_scale"],
+                    image=units_images,
+                    controlnet_conditioning_scale=controlnet_weights,
+                    control_guidance_start=guidance_starts,
+                    control_guidance_end=guidance_stops,
+                )
 
+            if config["global"]["mode"] == "img2img":
+                r = self.pipeline(
+                    **step_timer,
+                    generator=generators,
+                    prompt_embeds=prompt_embeds,
+                    image=init_images,
+                    negative_prompt_embeds=negative_prompt_embeds,
+                    width=config["global"]["width"],
+                    height=config["global"]["height"],
+                    num_inference_steps=config["global"]["steps"],
+                    guidance_scale=config["global"]["cfg_scale"],
+                    control_image=units_images,
+                    controlnet_conditioning_scale=controlnet_weights,
+                    control_guidance_start=guidance_starts,
+                    control_guidance_end=guidance_stops,
+                )
+            add_step_spans(span, start, step_ends, time.perf_counter())
+        self.last_stats = self.get_stats(monitor)
 
+        return [r.images[i : i + batch_size] for i in range(0, len(r.images), batch_size)]
 
+    @Engine.serialized
+    @torch.no_grad()
+    def generate_sd_qrcode_variants(self, configs, input_image, controlnet_input_images):
+        """
+        Generate variants of a config differing only by the weight, start and end of their controlnet units,
+        from the same seed. In txt2img the denoising steps where the variants condition the same way are run once:
+        the variants are forked (latents, scheduler and generator state) when their controlnet scales start to differ,
+        so K variants sharing a prefix cost prefix + K x suffix steps instead of K x steps.
+        """
+        for variant_config in configs:
+            self.check_models(variant_config)
+        config = configs[0]
+        if config["global"]["mode"] != "txt2img":
+            return super().generate_sd_qrcode_variants(configs, input_image, controlnet_input_images)
 
-def get_scheduler(scheduler_name: str, config_scheduler):
-    if scheduler_name == "DDIM":
-        return DDIMScheduler.from_config(config_scheduler)
-    if scheduler_name == "Euler":
-        return EulerDiscreteScheduler.from_config(config_scheduler)
-    if scheduler_name == "Euler a":
-        return EulerAncestralDiscreteScheduler.from_config(config_scheduler)
-    if scheduler_name == "LMS":
-        return LMSDiscreteScheduler.from_config(config_scheduler)
-    if scheduler_name == "DPM2 Karras":
-        return KDPM2DiscreteScheduler.from_config(config_scheduler)
-    if scheduler_name == "DPM2 a Karras":
-        return KDPM2AncestralDiscreteScheduler.from_config(config_scheduler)
-    if scheduler_name == "Heun":
-        return HeunDiscreteScheduler.from_config(config_scheduler)
-    if scheduler_name == "DDPM":
-        return DDPMScheduler.from_config(config_scheduler)
-    if scheduler_name == "UniPC":
-        return UniPCMultistepScheduler.from_config(config_scheduler)
-    if scheduler_name == "PNDM":
-        return PNDMScheduler.from_config(config_scheduler)
-    if scheduler_name == "DEI":
-        return DEISMultistepScheduler.from_config(config_scheduler)
-    if scheduler_name == "DPM++ SDE":
-        return DPMSolverSDEScheduler.from_config(config_scheduler)
-    if scheduler_name == "DPM++ 2S a":
-        return DPMSolverSinglestepScheduler.from_config(config_scheduler)
-    if scheduler_name == "DPM++ 2M":
-        return DPMSolverMultistepScheduler.from_config(config_scheduler)
-    if scheduler_name == "DPM++ SDE Karras":
-        return DPMSolverSDEScheduler.from_config(
-            config_scheduler, use_karras_sigmas=True
+        self.pipeline = pipeline = self.get_pipeline("txt2img")
+        scheduler = self.set_scheduler("txt2img", config["global"]["scheduler_name"])
+        device = pipeline._execution_device
+        width, height = config["global"]["width"], config["global"]["height"]
+        batch_size = config["global"]["batch_size"]
+        guidance_scale = config["global"]["cfg_scale"]
+        do_classifier_free_guidance = guidance_scale > 1
+
+        # one generator per image seeded with seed + i, as generate_sd_qrcode does
+        seed = config["global"]["seed"]
+        seed = seed if seed != -1 else random.randrange(2**32)
+        generator = [torch.Generator(device=self.device).manual_seed(seed + i) for i in range(batch_size)]
+
+        # same inputs as the pipeline would prepare
+        prompt_embeds, negative_prompt_embeds = self.prompt_cache.get(
+            pipeline, config["global"]["model_name_or_path"], config["global"]["prompt"], config["global"]["negative_prompt"]
         )
-    if scheduler_name == "DPM++ 2S a Karras":
-        return DPMSolverSinglestepScheduler.from_config(
-            config_scheduler, use_karras_sigmas=True
+        prompt_embeds, negative_prompt_embeds = pipeline.encode_prompt(
+            None,
+            device,
+            batch_size,
+            do_classifier_free_guidance,
+            prompt_embeds=prompt_embeds,
+            negative_prompt_embeds=negative_prompt_embeds,
         )
-    if scheduler_name == "DPM++ 2M Karras":
-        return DPMSolverMultistepScheduler.from_config(
-            config_scheduler, use_karras_sigmas=True
+        if do_classifier_free_guidance:
+            prompt_embeds = torch.cat([negative_prompt_embeds, prompt_embeds])
+
+        control_images = [
+            pipeline.prepare_image(
+                image=cn_input_image,
+                width=width,
+                height=height,
+                batch_size=batch_size,
+                num_images_per_prompt=batch_size,
+                device=device,
+                dtype=pipeline.controlnet.dtype,
+                do_classifier_free_guidance=do_classifier_free_guidance,
+            )
+            for cn_input_image in controlnet_input_images
+        ]
+
+        scheduler.set_timesteps(config["global"]["steps"], device=device)
+        timesteps = scheduler.timesteps
+        latents = pipeline.prepare_latents(
+            batch_size,
+            pipeline.unet.config.in_channels,
+            height,
+            width,
+            prompt_embeds.dtype,
+            device,
+            generator,
         )
+        extra_step_kwargs = pipeline.prepare_extra_step_kwargs(generator, 0.0)
+
+        def step(i, latents, scales, scheduler):
+            t = timesteps[i]
+            latent_model_input = torch.cat([latents] * 2) if do_classifier_free_guidance else latents
+            latent_model_input = scheduler.scale_model_input(latent_model_input, t)
+            down_block_res_samples, mid_block_res_sample = pipeline.controlnet(
+                latent_model_input,
+                t,
+                encoder_hidden_states=prompt_embeds,
+                controlnet_cond=control_images,
+                conditioning_scale=list(scales),
+                return_dict=False,
+            )
+            noise_pred = pipeline.unet(
+                latent_model_input,
+                t,
+                encoder_hidden_states=prompt_embeds,
+                down_block_additional_residuals=down_block_res_samples,
+                mid_block_additional_residual=mid_block_res_sample,
+                return_dict=False,
+            )[0]
+            if do_classifier_free_guidance:
+                noise_pred_uncond, noise_pred_text = noise_pred.chunk(2)
+                noise_pred = noise_pred_uncond + guidance_scale * (noise_pred_text - noise_pred_uncond)
+            return scheduler.step(noise_pred, t, latents, **extra_step_kwargs, return_dict=False)[0]
+
+        schedules = [
+            branching.controlnet_scales(list(variant["controlnet_units"].values()), len(timesteps))
+            for variant in configs
+        ]
+        span = tracing.span("pipeline", mode="txt2img", images=batch_size * len(configs))
+        step_ends = []
+        if span:
+            timed_step = step
 
-    raise ValueError(f"Scheduler {scheduler_name} not found")
+            def step(i, latents, scales, scheduler):
+                latents = timed_step(i, latents, scales, scheduler)
+                step_ends.append(time.perf_counter())
+                return latents
+
+        self.controlnet.reset_stats()
+        with span, device_policy.PeakMemoryMonitor(self.device) as monitor:
+            start = time.perf_counter()
+            variants_latents, steps_run = branching.run_branches(schedules, step, latents, scheduler, generator)
+
+            results = []
+            for latents in variants_latents:
+                results.append(decode_latents(pipeline, latents, generator))
+            pipeline.maybe_free_model_hooks()
+            add_step_spans(span, start, step_ends, time.perf_counter())
+        self.last_stats = self.get_stats(monitor)
+        self.last_stats["denoising_steps"] = steps_run
+        return results
+
+
+def step_callback_kwargs(pipeline, on_step_end) -> dict:
+    """Pipeline call kwargs calling on_step_end(step, latents) after each denoising step"""
+    if "callback_on_step_end" in inspect.signature(pipeline.__call__).parameters:
+
+        def callback_on_step_end(pipeline, step, timestep, callback_kwargs):
+            on_step_end(step, callback_kwargs["latents"])
+            return callback_kwargs
+
+        return {"callback_on_step_end": callback_on_step_end}
+
+    # diffusers < 0.22
+    def callback(step, timestep, latents):
+        on_step_end(step, latents)
+
+    return {"callback": callback, "callback_steps": 1}
+
+
+def to_uint8_array(images: torch.Tensor):
+    """
+    (batch, height, width, 3) uint8 array of (batch, 3, height, width) images in [0, 1], rounded as for PIL images.
+    The array shares its memory with the uint8 tensor: no copy on cpu besides the conversion.
+    """
+    images = (images * 255).round().to(torch.uint8).permute(0, 2, 3, 1).contiguous()
+    return images.cpu().numpy()
+
+
+@torch.no_grad()
+def decode_latents(pipeline, latents, generator=None) -> list[PIL.Image.Image]:
+    """Images of denoised latents, as the pipeline decodes them (vae, safety checker, postprocessing)"""
+    image = pipeline.vae.decode(latents / pipeline.vae.config.scaling_factor, return_dict=False, generator=generator)[0]
+    image, has_nsfw_concept = pipeline.run_safety_checker(image, latents.device, latents.dtype)
+    do_denormalize = [True] * image.shape[0] if has_nsfw_concept is None else [not n for n in has_nsfw_concept]
+    return pipeline.image_processor.postprocess(image, output_type="pil", do_denormalize=do_denormalize)
+
+
+def add_step_spans(span, start: float, step_ends: list, end: float):
+    """
+    Denoising and decoding stages of a pipeline call from the time its steps ended. The first step
+    duration includes the preparation of the inputs, decoding includes the safety checker and postprocessing.
+    """
+    if not step_ends:
+        return
+    span.add(
+        "denoising",
+        step_ends[-1] - start,
+        steps=len(step_ends),
+        step_seconds=[end_ - start_ for start_, end_ in zip([start] + step_ends, step_ends)],
+    )
+    span.add("decode", end - step_ends[-1])
+
+
+def build_pipeline(pipeline_class, components: dict, controlnet):
+    """Assemble a controlnet pipeline around already loaded components without copying their weights"""
+    parameters = inspect.signature(pipeline_class.__init__).parameters
+    kwargs = {name: module for name, module in components.items() if name in parameters}
+    # the scheduler holds per-generation state, each pipeline gets its own
+    kwargs["scheduler"] = components["scheduler"].__class__.from_config(components["scheduler"].config)
+    if "requires_safety_checker" in parameters:
+        kwargs["requires_safety_checker"] = components.get("safety_checker") is not None
+    return pipeline_class(**kwargs, controlnet=controlnet)
+
+
+def get_scheduler(scheduler_name: str, config_scheduler):
+    return schedulers.create_scheduler(scheduler_name, config_scheduler)
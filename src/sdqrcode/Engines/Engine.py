@@ -1,12 +1,112 @@
+import asyncio
+import contextvars
+import functools
+import threading
+
+
+def serialized(method):
+    """Run the method holding the engine lock, for engine state that concurrent calls can't share (pipelines, server checkpoint)"""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
 class Engine:
     def __init__(self, config):
         self.config = config
+        # number of generations the engine runs at the same time, more concurrent calls wait for their turn
+        self.max_concurrency = 1
+        # output types (see outputs.OUTPUT_TYPES) generate_sd_qrcode produces with its output_type param,
+        # the other ones are converted from PIL images
+        self.output_types = ("pil",)
+        # whether generate_sd_qrcode takes return_cn_imgs, to return the controlnet detect maps after the images
+        self.returns_cn_imgs = False
+        self._lock = threading.RLock()
+
+    @property
+    def active_models(self) -> list:
+        """Checkpoints currently loaded by the backend, when it is known"""
+        return []
+
+    def check_models(self, config: dict):
+        """Raise ValueError if the engine can't generate with the checkpoint and controlnets of a request config"""
 
     def init_backend():
         pass
 
-    def generate_sd_qrcode():
+    def generate_sd_qrcode(self, input_image=None, controlnet_input_images=None, config=None):
+        """
+        Generate the images of a request config (default: the engine config). Engines only read the config
+        they are given, so concurrent calls with different configs don't interfere.
+        """
         pass
 
+    async def agenerate_sd_qrcode(self, input_image=None, controlnet_input_images=None, config=None):
+        """Engines without native async support generate in a worker thread"""
+        loop = asyncio.get_running_loop()
+        # the worker thread runs in the caller context, to be part of its trace
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            None,
+            functools.partial(context.run, self.generate_sd_qrcode, input_image, controlnet_input_images, config=config),
+        )
 
-# remove controlnet images
+    def generate_sd_qrcode_stream(self, input_image=None, controlnet_input_images=None, config=None, preview_callback=None):
+        """
+        Yield the images of a generation as they are ready, and call preview_callback(step, images) with
+        previews while it runs. Engines without intermediate results yield the images at the end, without previews.
+        """
+        yield from self.generate_sd_qrcode(input_image, controlnet_input_images, config=config)
+
+    async def agenerate_sd_qrcode_stream(
+        self, input_image=None, controlnet_input_images=None, config=None, preview_callback=None
+    ):
+        """Async version of generate_sd_qrcode_stream, the blocking stream runs in a worker thread"""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+
+        def produce():
+            try:
+                for image in self.generate_sd_qrcode_stream(
+                    input_image, controlnet_input_images, config=config, preview_callback=preview_callback
+                ):
+                    loop.call_soon_threadsafe(queue.put_nowait, image)
+            finally:
+                loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        # the worker thread runs in the caller context, to be part of its trace
+        future = loop.run_in_executor(None, contextvars.copy_context().run, produce)
+        while True:
+            image = await queue.get()
+            if image is done:
+                break
+            yield image
+        # raises the error of the stream, if any
+        await future
+
+    def generate_sd_qrcode_batch(self, configs, input_images, controlnet_input_images):
+        """
+        Generate one item per config, engines able to batch items together override this.
+        Returns the list of generated images of each item.
+        """
+        return [
+            self.generate_sd_qrcode(input_image, cn_input_images, config=config)
+            for config, input_image, cn_input_images in zip(configs, input_images, controlnet_input_images)
+        ]
+
+    def generate_sd_qrcode_variants(self, configs, input_image, controlnet_input_images):
+        """
+        Generate variants of a config differing only by their controlnet params, from the same input images.
+        Engines able to share the common denoising steps override this.
+        """
+        return Engine.generate_sd_qrcode_batch(
+            self, configs, [input_image] * len(configs), [controlnet_input_images] * len(configs)
+        )
+
+    def release(self):
+        pass
@@ -0,0 +1,161 @@
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import numpy as np
+import PIL
+import PIL.Image
+
+import sdqrcode.outputs as outputs
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# png compression of the uploaded images: the fastest level, higher ones take much longer for a few % of size
+PNG_COMPRESS_LEVEL = 1
+
+
+class ImagePayloadCache:
+    def __init__(self, max_entries: int = 32, compress_level: int = PNG_COMPRESS_LEVEL):
+        """
+        Base64 png encodings of the images sent to Automatic1111, keyed by the content of the image,
+        so an image used by several units or several requests is only encoded once.
+
+        Args:
+            max_entries: number of encoded images kept (least recently used are dropped first)
+            compress_level: png compression level, from 0 (no compression) to 9 (smallest, slowest)
+        """
+        self.max_entries = max_entries
+        self.compress_level = compress_level
+        self.hits = 0
+        self.misses = 0
+        self._encoded = OrderedDict()
+        self._lock = threading.Lock()
+
+    def encode(self, image: PIL.Image.Image) -> str:
+        """Raw base64 png of the image (without data uri header, as expected by controlnet)"""
+        return self.encode_with_digest(image)[1]
+
+    def encode_with_digest(self, image: PIL.Image.Image) -> tuple[str, str]:
+        digest = image_digest(image)
+        with self._lock:
+            encoded = self._encoded.get(digest)
+            if encoded is not None:
+                self._encoded.move_to_end(digest)
+                self.hits += 1
+                return digest, encoded
+
+        with BytesIO() as output_bytes:
+            image.save(output_bytes, format="PNG", compress_level=self.compress_level)
+            encoded = base64.b64encode(output_bytes.getvalue()).decode("utf-8")
+
+        with self._lock:
+            self.misses += 1
+            self._encoded[digest] = encoded
+            while len(self._encoded) > self.max_entries:
+                self._encoded.popitem(last=False)
+        return digest, encoded
+
+
+def image_digest(image: PIL.Image.Image) -> str:
+    h = hashlib.sha256()
+    h.update(f"{image.mode}{image.size}".encode())
+    h.update(image.tobytes())
+    return h.hexdigest()
+
+
+def build_controlnet_unit(unit: dict, encoded_img: str, save_detected_map: bool = False) -> dict:
+    return {
+        "image": encoded_img,
+        "module": "none",
+        "model": unit["model"],
+        "pixel_perfect": True,
+        "weight": unit["weight"],
+        "guidance_start": unit["start"],
+        "guidance_end": unit["end"],
+        "save_detected_map": save_detected_map,
+    }
+
+
+def build_payload(
+    config: dict,
+    input_image: PIL.Image.Image = None,
+    controlnet_input_images: list[PIL.Image.Image] = None,
+    image_cache: ImagePayloadCache = None,
+    return_cn_imgs: bool = False,
+) -> tuple[str, dict]:
+    """
+    Automatic1111 api endpoint (txt2img or img2img) and json payload of a generation.
+    Each distinct image is encoded once, and in img2img the units using the input image
+    don't send it again: controlnet falls back to the img2img input image when a unit has none.
+    The detect maps of the units are only asked for with return_cn_imgs, the server otherwise
+    doesn't render, encode and send images that would be thrown away.
+    """
+    image_cache = ImagePayloadCache() if image_cache is None else image_cache
+
+    payload = {
+        "seed": config["global"]["seed"],
+        "prompt": config["global"]["prompt"],
+        "negative_prompt": config["global"]["negative_prompt"],
+        "width": config["global"]["width"],
+        "height": config["global"]["height"],
+        "steps": config["global"]["steps"],
+        "sampler_name": config["global"]["scheduler_name"],
+        "cfg_scale": config["global"]["cfg_scale"],
+        "batch_size": config["global"]["batch_size"],
+        # the grid would come first in the images of the response
+        "do_not_save_grid": True,
+        # older controlnet versions ignore save_detected_map in the units but follow this setting
+        "override_settings": {"control_net_no_detectmap": not return_cn_imgs},
+    }
+
+    init_digest = None
+    if config["global"]["mode"] == "img2img":
+        init_digest, encoded_init = image_cache.encode_with_digest(input_image)
+        payload["init_images"] = ["data:image/png;base64," + encoded_init]
+        payload["denoising_strength"] = config["global"]["denoising_strength"]
+
+    # the same image object is usually given to several units, only hash it once
+    encoded_by_id = {}
+    units = []
+    for cn_input_img, unit in zip(controlnet_input_images, config["controlnet_units"].values()):
+        if id(cn_input_img) not in encoded_by_id:
+            encoded_by_id[id(cn_input_img)] = image_cache.encode_with_digest(cn_input_img)
+        digest, encoded_img = encoded_by_id[id(cn_input_img)]
+        units.append(build_controlnet_unit(unit, "" if digest == init_digest else encoded_img, return_cn_imgs))
+    payload["alwayson_scripts"] = {"ControlNet": {"args": units}}
+
+    return config["global"]["mode"], payload
+
+
+def select_images(encoded_images: list[str], batch_size: int, return_cn_imgs: bool = False) -> list[str]:
+    """
+    Generated images of a response, without the detect maps that follow them.
+    A server which doesn't know the no detect map settings still sends them, they are dropped before being decoded.
+    """
+    return encoded_images if return_cn_imgs else encoded_images[:batch_size]
+
+
+def decode_images(encoded_images: list[str], output_type: str = "pil") -> list:
+    """
+    Images of a response from their base64 encodings:
+        pil: opened lazily, the pixels are only decompressed when the image is used
+        np: (height, width, 3) uint8 arrays, decompressed in parallel
+        png: the bytes sent by the server, not decoded at all (re-encoded if the server saves another format)
+    """
+    data = [base64.b64decode(encoded) for encoded in encoded_images]
+    if output_type == "png":
+        if all(d.startswith(PNG_SIGNATURE) for d in data):
+            return data
+        return outputs.encode_images([PIL.Image.open(BytesIO(d)) for d in data], "png")
+    if output_type == "np":
+        if len(data) == 1:
+            return [decode_array(data[0])]
+        return list(outputs.get_executor().map(decode_array, data))
+    return [PIL.Image.open(BytesIO(d)) for d in data]
+
+
+def decode_array(data: bytes) -> np.ndarray:
+    with PIL.Image.open(BytesIO(data)) as image:
+        return np.asarray(image.convert("RGB"))
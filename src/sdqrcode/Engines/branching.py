@@ -0,0 +1,61 @@
+import copy
+
+
+def controlnet_scales(units: list[dict], n_steps: int) -> list[tuple]:
+    """
+    Conditioning scale of each controlnet unit at each denoising step: its weight between start and end, 0 outside,
+    computed like the diffusers controlnet pipelines do.
+    """
+    return [
+        tuple(
+            unit["weight"] * (1.0 - float(i / n_steps < unit["start"] or (i + 1) / n_steps > unit["end"]))
+            for unit in units
+        )
+        for i in range(n_steps)
+    ]
+
+
+def run_branches(schedules: list[list[tuple]], step, latents, scheduler, generator) -> tuple[list, int]:
+    """
+    Denoise several variants whose only difference is the controlnet scales of each step.
+    Steps are run once for all the variants sharing the same scales so far, the variants are forked
+    (latents, scheduler and generator state) at the first step where their scales differ.
+
+    Args:
+        schedules: controlnet scales of each step of each variant, see controlnet_scales
+        step: function (step index, latents, scales, scheduler) -> latents after the step
+        latents: initial noise
+        scheduler: scheduler with its timesteps set
+        generator: torch generator used by the scheduler steps (ancestral and sde schedulers), or one per image
+    Returns:
+        the final latents of each variant, and the number of steps run
+    """
+    n_steps = len(schedules[0])
+    results = [None] * len(schedules)
+    steps_run = 0
+
+    generators = generator if isinstance(generator, list) else [generator]
+    stack = [(list(range(len(schedules))), 0, latents, scheduler, [g.get_state() for g in generators])]
+    while stack:
+        group, i, latents, scheduler, generator_states = stack.pop()
+        for g, state in zip(generators, generator_states):
+            g.set_state(state)
+        while i < n_steps and len({schedules[v][i] for v in group}) == 1:
+            latents = step(i, latents, schedules[group[0]][i], scheduler)
+            steps_run += 1
+            i += 1
+
+        if i == n_steps:
+            for v in group:
+                results[v] = latents
+            continue
+
+        # each set of variants agreeing on this step continues from its own copy of the state
+        subgroups = {}
+        for v in group:
+            subgroups.setdefault(schedules[v][i], []).append(v)
+        generator_states = [g.get_state() for g in generators]
+        for subgroup in reversed(list(subgroups.values())):
+            stack.append((subgroup, i, latents.clone(), copy.deepcopy(scheduler), generator_states))
+
+    return results, steps_run
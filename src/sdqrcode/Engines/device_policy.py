@@ -0,0 +1,164 @@
+import importlib.util
+import os
+import threading
+import time
+
+import torch
+
+import sdqrcode.tracing as tracing
+
+OFFLOADS = ("none", "model", "sequential")
+ATTENTION_BACKENDS = ("auto", "xformers", "sdpa", "default")
+
+DEFAULT_DEVICE_CONFIG = {
+    "name": "auto",
+    "offload": "none",
+    "attention": "auto",
+    "attention_slicing": False,
+    "vae_slicing": False,
+}
+
+
+def get_device_config(config: dict) -> dict:
+    """
+    Device section of a config completed with the defaults, with the device and attention backend resolved.
+    The section can also be given as a plain device name (device: cpu).
+    """
+    section = config.get("device") or {}
+    if isinstance(section, str):
+        section = {"name": section}
+    unknown = set(section) - set(DEFAULT_DEVICE_CONFIG)
+    if unknown:
+        raise ValueError(f"Unknown device settings {sorted(unknown)}, should be in {list(DEFAULT_DEVICE_CONFIG)}")
+
+    device_config = dict(DEFAULT_DEVICE_CONFIG, **section)
+    device_config["name"] = resolve_device(device_config["name"])
+    if device_config["offload"] not in OFFLOADS:
+        raise ValueError(f"Offload {device_config['offload']} not found, should be one of {list(OFFLOADS)}")
+    if device_config["offload"] != "none" and not device_config["name"].startswith("cuda"):
+        raise ValueError("Offload moves the models between the cpu and a gpu, it needs a cuda device")
+    device_config["attention"] = resolve_attention_backend(device_config["attention"], device_config["name"])
+    return device_config
+
+
+def resolve_device(name: str) -> str:
+    if name == "auto":
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    if name.startswith("cuda") and not torch.cuda.is_available():
+        raise ValueError(f"Device {name} requested but cuda is not available")
+    return name
+
+
+def available_attention_backends(device: str) -> list[str]:
+    """Attention backends usable on the device, fastest first"""
+    backends = []
+    if device.startswith("cuda") and importlib.util.find_spec("xformers") is not None:
+        backends.append("xformers")
+    if hasattr(torch.nn.functional, "scaled_dot_product_attention"):
+        backends.append("sdpa")
+    backends.append("default")
+    return backends
+
+
+def resolve_attention_backend(attention: str, device: str) -> str:
+    if attention not in ATTENTION_BACKENDS:
+        raise ValueError(f"Attention backend {attention} not found, should be one of {list(ATTENTION_BACKENDS)}")
+    backends = available_attention_backends(device)
+    if attention == "auto":
+        return backends[0]
+    if attention not in backends:
+        raise ValueError(f"Attention backend {attention} is not available on {device}, available: {backends}")
+    return attention
+
+
+def apply_device_config(pipeline, device_config: dict):
+    """Set the attention backend, slicing and placement (device or offload) of a pipeline"""
+    from diffusers.models.attention_processor import AttnProcessor, AttnProcessor2_0
+
+    if device_config["attention"] == "xformers":
+        pipeline.enable_xformers_memory_efficient_attention()
+    else:
+        processor_class = AttnProcessor2_0 if device_config["attention"] == "sdpa" else AttnProcessor
+        for component in pipeline.components.values():
+            # a multi controlnet is a plain container of controlnets
+            for module in getattr(component, "nets", [component]):
+                if hasattr(module, "set_attn_processor"):
+                    module.set_attn_processor(processor_class())
+
+    # slicing replaces the attention processors, it goes after the backend
+    if device_config["attention_slicing"]:
+        pipeline.enable_attention_slicing()
+    if device_config["vae_slicing"]:
+        pipeline.vae.enable_slicing()
+
+    gpu_id = torch.device(device_config["name"]).index or 0
+    if device_config["offload"] == "model":
+        pipeline.enable_model_cpu_offload(gpu_id=gpu_id)
+    elif device_config["offload"] == "sequential":
+        pipeline.enable_sequential_cpu_offload(gpu_id=gpu_id)
+    else:
+        pipeline = pipeline.to(device_config["name"])
+    return pipeline
+
+
+def get_rss() -> int:
+    """Resident set size of the process in bytes, None where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+class PeakMemoryMonitor:
+    def __init__(self, device: str, interval: float = 0.01):
+        """
+        Peak memory while the context is open: memory allocated by torch on a cuda device,
+        and resident memory of the process (sampled every interval seconds) for the models kept on the cpu.
+        The peaks are also set on the tracing span the context was opened in, if any.
+        """
+        self.device = device
+        self.interval = interval
+        self.seconds = None
+        self.peak_device_bytes = None
+        self.peak_rss_bytes = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._span = None
+
+    def __enter__(self):
+        if self.device.startswith("cuda"):
+            torch.cuda.synchronize(self.device)
+            torch.cuda.reset_peak_memory_stats(self.device)
+        self.peak_rss_bytes = get_rss()
+        if self.peak_rss_bytes is not None:
+            self._thread = threading.Thread(target=self._sample_rss, daemon=True)
+            self._thread.start()
+        self._span = tracing.current_span()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.device.startswith("cuda"):
+            torch.cuda.synchronize(self.device)
+            self.peak_device_bytes = torch.cuda.max_memory_allocated(self.device)
+        self.seconds = time.perf_counter() - self._start
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak_rss_bytes = max(self.peak_rss_bytes, get_rss())
+        self._span.set(peak_device_bytes=self.peak_device_bytes, peak_rss_bytes=self.peak_rss_bytes)
+        return False
+
+    def _sample_rss(self):
+        while not self._stop.wait(self.interval):
+            self.peak_rss_bytes = max(self.peak_rss_bytes, get_rss())
+
+    def stats(self, device_config: dict) -> dict:
+        """Device settings of the call along with its duration and peak memory"""
+        return dict(
+            device_config,
+            seconds=self.seconds,
+            peak_device_bytes=self.peak_device_bytes,
+            peak_rss_bytes=self.peak_rss_bytes,
+        )
@@ -1,19 +1,88 @@
-def init_engine(**engine_kwargs):
-    if (
-        "hostname" in engine_kwargs
-        and engine_kwargs["hostname"] is not None
-        and engine_kwargs["hostname"] != ""
-    ):
-        from . import AutoEngine
-        
-        if "torch_dtype" in engine_kwargs:
-            del engine_kwargs["torch_dtype"]
-
-        return AutoEngine.AutomaticEngine(**engine_kwargs)
-    else:
-        from . import DiffusersEngine
-
-        config = engine_kwargs["config"]
-        torch_dtype = engine_kwargs["torch_dtype"]
-
-        return DiffusersEngine.DiffusersEngine(config=config, torch_dtype=torch_dtype)
+import importlib
+import importlib.metadata
+import inspect
+import threading
+
+# entry point group of the engines of other packages, ex in a pyproject.toml:
+# [project.entry-points."sdqrcode.engines"]
+# my_engine = "my_package.engine:MyEngine"
+ENTRY_POINT_GROUP = "sdqrcode.engines"
+
+# engine name -> engine class, or "module:attribute" imported on first use
+ENGINES = {
+    "diffusers": "sdqrcode.Engines.DiffusersEngine:DiffusersEngine",
+    "auto": "sdqrcode.Engines.AutoEngine:AutomaticEngine",
+    "auto_async": "sdqrcode.Engines.AsyncAutoEngine:AsyncAutomaticEngine",
+}
+
+_entry_points_loaded = False
+_lock = threading.Lock()
+
+
+def register_engine(name: str, engine):
+    """Register an engine class (or a "module:attribute" path to it) under a name usable with init_engine"""
+    with _lock:
+        ENGINES[name] = engine
+
+
+def available_engines() -> list[str]:
+    _load_entry_points()
+    return list(ENGINES)
+
+
+def get_engine(name: str):
+    """Engine class of a name, its module is only imported now"""
+    _load_entry_points()
+    with _lock:
+        if name not in ENGINES:
+            raise ValueError(f"Engine {name} not found, should be one of {list(ENGINES)}")
+        engine = ENGINES[name]
+        if isinstance(engine, str):
+            module_name, _, attribute = engine.partition(":")
+            engine = getattr(importlib.import_module(module_name), attribute)
+            ENGINES[name] = engine
+        return engine
+
+
+def _load_entry_points():
+    global _entry_points_loaded
+    with _lock:
+        if _entry_points_loaded:
+            return
+        _entry_points_loaded = True
+        entry_points = importlib.metadata.entry_points()
+        if hasattr(entry_points, "select"):
+            entry_points = entry_points.select(group=ENTRY_POINT_GROUP)
+        else:  # python < 3.10
+            entry_points = entry_points.get(ENTRY_POINT_GROUP, [])
+        for entry_point in entry_points:
+            # engines registered in code take precedence, entry points are only imported when used
+            ENGINES.setdefault(entry_point.name, entry_point.value)
+
+
+def default_engine_name(hostname=None) -> str:
+    """diffusers without a hostname, the Automatic1111 engine with one, the async one for a list of hosts"""
+    if hostname is None or hostname == "":
+        return "diffusers"
+    # a list of hosts is served by the async engine, balancing the jobs between the servers
+    if isinstance(hostname, (list, tuple)):
+        return "auto_async"
+    return "auto"
+
+
+def init_engine(engine: str = None, **engine_kwargs):
+    """
+    Create an engine by name (default: see default_engine_name). Each engine gets the kwargs of its signature
+    among config, hostname, port, https, username, password and torch_dtype; None values leave the engine defaults.
+    """
+    engine_class = get_engine(engine or default_engine_name(engine_kwargs.get("hostname")))
+
+    parameters = inspect.signature(engine_class).parameters
+    if any(p.kind == inspect.Parameter.VAR_KEYWORD for p in parameters.values()):
+        return engine_class(**engine_kwargs)
+    kwargs = {
+        name: value
+        for name, value in engine_kwargs.items()
+        if name in parameters and (value is not None or parameters[name].default is inspect.Parameter.empty)
+    }
+    return engine_class(**kwargs)
@@ -0,0 +1,57 @@
+try:
+    from diffusers.models.controlnets.multicontrolnet import MultiControlNetModel
+except ImportError:
+    from diffusers.pipelines.controlnet.multicontrolnet import MultiControlNetModel
+
+
+class GatedMultiControlNetModel(MultiControlNetModel):
+    def __init__(self, controlnets):
+        """
+        Multi controlnet skipping the controlnets whose conditioning scale is 0 at the current step
+        (outside their start/end window, or with a weight of 0) instead of computing residuals scaled to nothing.
+        The residuals are the same as without gating. Also used with a single controlnet.
+        """
+        super().__init__(controlnets)
+        self.reset_stats()
+
+    def reset_stats(self):
+        # one tuple per forward pass (denoising step), with whether each controlnet was evaluated
+        self.active_steps = []
+
+    @property
+    def evaluated(self) -> int:
+        return sum(sum(active) for active in self.active_steps)
+
+    @property
+    def skipped(self) -> int:
+        return sum(len(active) - sum(active) for active in self.active_steps)
+
+    def forward(self, sample, timestep, encoder_hidden_states, controlnet_cond, conditioning_scale, **kwargs):
+        active = tuple(scale != 0 for scale in conditioning_scale)
+        self.active_steps.append(active)
+
+        down_block_res_samples, mid_block_res_sample = None, None
+        for image, scale, controlnet, is_active in zip(controlnet_cond, conditioning_scale, self.nets, active):
+            if not is_active:
+                continue
+            down_samples, mid_sample = controlnet(
+                sample=sample,
+                timestep=timestep,
+                encoder_hidden_states=encoder_hidden_states,
+                controlnet_cond=image,
+                conditioning_scale=scale,
+                **kwargs,
+            )
+
+            # merge samples
+            if down_block_res_samples is None:
+                down_block_res_samples, mid_block_res_sample = down_samples, mid_sample
+            else:
+                down_block_res_samples = [
+                    samples_prev + samples_curr
+                    for samples_prev, samples_curr in zip(down_block_res_samples, down_samples)
+                ]
+                mid_block_res_sample = mid_block_res_sample + mid_sample
+
+        # no controlnet active: the unet runs without residuals, same as adding zeros
+        return down_block_res_samples, mid_block_res_sample
@@ -0,0 +1,208 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class _Entry:
+    __slots__ = ("value", "nbytes", "refcount")
+
+    def __init__(self, value, nbytes):
+        self.value = value
+        self.nbytes = nbytes
+        self.refcount = 0
+
+
+class ModelRegistry:
+    def __init__(self, memory_budget: int = None):
+        """
+        Process-wide cache of loaded model components, shared between engines.
+
+        Entries are reference counted: an engine acquires what it needs and
+        releases it when it is done. Unreferenced entries stay loaded so the
+        next engine using the same weights gets them for free, and are only
+        evicted (least recently used first) once the total size of the cache
+        goes over the memory budget.
+
+        Args:
+            memory_budget: Maximum size in bytes of the cached models (default: unbounded)
+        """
+        self.memory_budget = memory_budget
+        self._entries = OrderedDict()
+        # key -> Future of the loads in progress, set once the entry is inserted
+        self._loading = {}
+        self._lock = threading.RLock()
+
+    def acquire(self, key, loader, nbytes: int = None):
+        """
+        Return the value cached under key, loading it with loader() if needed.
+        Every acquire must be paired with a release of the same key.
+        The loader runs without holding the registry lock: loads of other keys and releases go on meanwhile,
+        concurrent acquires of the same key wait for this load instead of loading it again.
+        """
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    entry.refcount += 1
+                    self._evict()
+                    return entry.value
+                loading = self._loading.get(key)
+                if loading is None:
+                    loading = self._loading[key] = Future()
+                    break
+            # loaded by another thread, raises its error if the load failed. The entry is looked up again:
+            # it can have been released and evicted in between
+            loading.result()
+
+        try:
+            value = loader()
+            entry = _Entry(value, estimate_nbytes(value) if nbytes is None else nbytes)
+        except BaseException as e:
+            with self._lock:
+                del self._loading[key]
+            loading.set_exception(e)
+            raise
+        with self._lock:
+            del self._loading[key]
+            self._entries[key] = entry
+            entry.refcount += 1
+            self._evict()
+        loading.set_result(None)
+        return value
+
+    def release(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.refcount == 0:
+                raise KeyError(f"{key} is not acquired")
+            entry.refcount -= 1
+            self._evict()
+
+    def set_memory_budget(self, memory_budget: int = None):
+        with self._lock:
+            self.memory_budget = memory_budget
+            self._evict()
+
+    def clear(self):
+        """Drop every entry that is not currently in use."""
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e.refcount == 0]:
+                del self._entries[key]
+
+    @property
+    def memory_usage(self) -> int:
+        with self._lock:
+            return sum(entry.nbytes for entry in self._entries.values())
+
+    def refcount(self, key) -> int:
+        with self._lock:
+            entry = self._entries.get(key)
+            return 0 if entry is None else entry.refcount
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _evict(self):
+        if self.memory_budget is None:
+            return
+        usage = sum(entry.nbytes for entry in self._entries.values())
+        # oldest first, entries still in use are never evicted
+        for key in list(self._entries.keys()):
+            if usage <= self.memory_budget:
+                break
+            entry = self._entries[key]
+            if entry.refcount == 0:
+                usage -= entry.nbytes
+                del self._entries[key]
+
+
+def estimate_nbytes(value) -> int:
+    """Size in bytes of the tensors held by value (torch modules, dicts or lists of them)."""
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(estimate_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(estimate_nbytes(v) for v in value)
+    if hasattr(value, "parameters") and hasattr(value, "buffers"):
+        tensors = list(value.parameters()) + list(value.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    return 0
+
+
+def _budget_from_env():
+    budget = os.getenv("SDQRCODE_MODEL_CACHE_BYTES")
+    return int(budget) if budget else None
+
+
+# shared by every engine of the process
+REGISTRY = ModelRegistry(memory_budget=_budget_from_env())
+
+
+def controlnet_key(
+    model_name_or_path: str,
+    torch_dtype,
+    device: str,
+    offload: str = "none",
+    attention: str = "default",
+    attention_slicing: bool = False,
+) -> tuple:
+    # the attention processors are set on the shared modules: engines with other settings get their own copy
+    return ("controlnet", model_name_or_path, str(torch_dtype), str(device), offload, attention, attention_slicing)
+
+
+def base_model_key(
+    model_name_or_path: str,
+    torch_dtype,
+    device: str,
+    offload: str = "none",
+    attention: str = "default",
+    attention_slicing: bool = False,
+    vae_slicing: bool = False,
+) -> tuple:
+    return (
+        "base", model_name_or_path, str(torch_dtype), str(device), offload, attention, attention_slicing, vae_slicing
+    )
+
+
+def acquire_controlnet(
+    model_name_or_path: str, torch_dtype, device: str, registry: ModelRegistry = None, offload: str = "none", **settings
+):
+    """settings: attention and attention_slicing the controlnet is set up with, see controlnet_key"""
+
+    def loader():
+        from diffusers import ControlNetModel
+
+        controlnet = ControlNetModel.from_pretrained(model_name_or_path, torch_dtype=torch_dtype)
+        # offloaded models stay on the cpu, the offload hooks move them to the device when used
+        return controlnet.to("cpu" if offload != "none" else device)
+
+    registry = REGISTRY if registry is None else registry
+    return registry.acquire(controlnet_key(model_name_or_path, torch_dtype, device, offload, **settings), loader)
+
+
+def acquire_base_components(
+    model_name_or_path: str, torch_dtype, device: str, registry: ModelRegistry = None, offload: str = "none", **settings
+) -> dict:
+    """
+    Components (unet, vae, text encoder, tokenizer, ...) of a stable diffusion checkpoint,
+    shared by every pipeline built on this checkpoint whatever its controlnets.
+    Offloaded components are kept apart from the others since they carry offload hooks,
+    and so are the ones set up with other attention or slicing settings (see base_model_key).
+    """
+
+    def loader():
+        from diffusers import StableDiffusionPipeline
+
+        pipeline = StableDiffusionPipeline.from_pretrained(model_name_or_path, torch_dtype=torch_dtype)
+        return dict(pipeline.to("cpu" if offload != "none" else device).components)
+
+    registry = REGISTRY if registry is None else registry
+    return registry.acquire(base_model_key(model_name_or_path, torch_dtype, device, offload, **settings), loader)
@@ -0,0 +1,61 @@
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+class PromptEmbeddingCache:
+    def __init__(self, max_entries: int = 64):
+        """
+        Text encoder outputs (prompt_embeds, negative_prompt_embeds) keyed by (base model, prompt, negative prompt),
+        so that generations changing only the qr code, the seed or the controlnet params don't encode the prompt again.
+
+        Args:
+            max_entries: number of prompts kept (least recently used are dropped first)
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._embeds = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, pipeline, model_name_or_path: str, prompt: str, negative_prompt: str) -> tuple:
+        """(prompt_embeds, negative_prompt_embeds) of one prompt, each of shape (1, tokens, hidden size)"""
+        key = (model_name_or_path, prompt, negative_prompt)
+        with self._lock:
+            embeds = self._embeds.get(key)
+            if embeds is not None:
+                self._embeds.move_to_end(key)
+                self.hits += 1
+                return embeds
+
+        with torch.no_grad():
+            embeds = pipeline.encode_prompt(
+                prompt,
+                pipeline._execution_device,
+                num_images_per_prompt=1,
+                do_classifier_free_guidance=True,
+                negative_prompt=negative_prompt,
+            )
+
+        with self._lock:
+            self.misses += 1
+            self._embeds[key] = embeds
+            while len(self._embeds) > self.max_entries:
+                self._embeds.popitem(last=False)
+        return embeds
+
+    def get_batch(self, pipeline, model_name_or_path: str, prompts: list[str], negative_prompts: list[str]) -> tuple:
+        """Embeddings of a list of prompts stacked in one (batch, tokens, hidden size) tensor each"""
+        embeds = [
+            self.get(pipeline, model_name_or_path, prompt, negative_prompt)
+            for prompt, negative_prompt in zip(prompts, negative_prompts)
+        ]
+        return torch.cat([e[0] for e in embeds]), torch.cat([e[1] for e in embeds])
+
+    def clear(self):
+        with self._lock:
+            self._embeds.clear()
+
+    def __len__(self):
+        return len(self._embeds)
@@ -0,0 +1,60 @@
+# scheduler name (automatic1111 naming) -> (diffusers scheduler class, config overrides)
+SCHEDULERS = {
+    "DDIM": ("DDIMScheduler", {}),
+    "Euler": ("EulerDiscreteScheduler", {}),
+    "Euler a": ("EulerAncestralDiscreteScheduler", {}),
+    "LMS": ("LMSDiscreteScheduler", {}),
+    "DPM2 Karras": ("KDPM2DiscreteScheduler", {}),
+    "DPM2 a Karras": ("KDPM2AncestralDiscreteScheduler", {}),
+    "Heun": ("HeunDiscreteScheduler", {}),
+    "DDPM": ("DDPMScheduler", {}),
+    "UniPC": ("UniPCMultistepScheduler", {}),
+    "PNDM": ("PNDMScheduler", {}),
+    "DEI": ("DEISMultistepScheduler", {}),
+    "DPM++ SDE": ("DPMSolverSDEScheduler", {}),
+    "DPM++ 2S a": ("DPMSolverSinglestepScheduler", {}),
+    "DPM++ 2M": ("DPMSolverMultistepScheduler", {}),
+    "DPM++ SDE Karras": ("DPMSolverSDEScheduler", {"use_karras_sigmas": True}),
+    "DPM++ 2S a Karras": ("DPMSolverSinglestepScheduler", {"use_karras_sigmas": True}),
+    "DPM++ 2M Karras": ("DPMSolverMultistepScheduler", {"use_karras_sigmas": True}),
+}
+
+
+def create_scheduler(scheduler_name: str, scheduler_config):
+    """Build a new scheduler from the config of the pipeline's scheduler"""
+    if scheduler_name not in SCHEDULERS:
+        raise ValueError(f"Scheduler {scheduler_name} not found")
+
+    # only the scheduler actually used gets imported
+    import diffusers
+
+    class_name, overrides = SCHEDULERS[scheduler_name]
+    return getattr(diffusers, class_name).from_config(scheduler_config, **overrides)
+
+
+def reset_scheduler(scheduler):
+    """Forget the position of the previous generation, set_timesteps resets the rest"""
+    for attribute in ("_step_index", "_begin_index"):
+        if hasattr(scheduler, attribute):
+            setattr(scheduler, attribute, None)
+    return scheduler
+
+
+class SchedulerCache:
+    def __init__(self, scheduler_config):
+        """
+        Schedulers of one pipeline, built once per name then reused across generations.
+
+        Args:
+            scheduler_config: config of the scheduler the pipeline was loaded with
+        """
+        self.scheduler_config = scheduler_config
+        self._schedulers = {}
+
+    def get(self, scheduler_name: str):
+        scheduler = self._schedulers.get(scheduler_name)
+        if scheduler is None:
+            scheduler = create_scheduler(scheduler_name, self.scheduler_config)
+            self._schedulers[scheduler_name] = scheduler
+            return scheduler
+        return reset_scheduler(scheduler)
@@ -1 +1,6 @@
 from sdqrcode.sdqrcode import *
+from sdqrcode.job_queue import CheckpointJobQueue
+from sdqrcode.process_workers import ProcessWorkers
+from sdqrcode.scan import DecodeResult, decode_qrcode
+from sdqrcode.workers import GenerationWorkers
+from sdqrcode.tracing import Tracer
@@ -0,0 +1,350 @@
+import dataclasses
+import os
+import threading
+from pathlib import Path
+from types import MappingProxyType
+from typing import Union
+
+import qrcode
+
+CONFIGS = {
+    "default_auto":           Path(__file__).parent / "configs" / "default_auto.yaml",
+    "default_diffusers":      Path(__file__).parent / "configs" / "default_diffusers.yaml",
+    "brightness_auto":        Path(__file__).parent / "configs" / "brightness_auto.yaml",
+    "brightness_diffusers":   Path(__file__).parent / "configs" / "brightness_diffusers.yaml",
+    "img2img_tile_auto":      Path(__file__).parent / "configs" / "img2img_tile_auto.yaml",
+    "img2img_tile_diffusers": Path(__file__).parent / "configs" / "img2img_tile_diffusers.yaml",
+}
+
+ERROR_CORRECTIONS = {
+    "low": qrcode.constants.ERROR_CORRECT_L,
+    "medium": qrcode.constants.ERROR_CORRECT_M,
+    "quartile": qrcode.constants.ERROR_CORRECT_Q,
+    "high": qrcode.constants.ERROR_CORRECT_H,
+}
+
+MODES = ("txt2img", "img2img")
+
+
+class _Section:
+    """Read-only mapping access to the fields, so that sections are read like the yaml dicts: config["global"]["seed"]"""
+
+    __slots__ = ()
+    # yaml keys of the optional fields, absent when None
+    _optional = ()
+
+    def __getitem__(self, key):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        if value is None and key not in self.keys():
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        return default if value is None and key not in self.keys() else value
+
+    def keys(self):
+        return [key for key in self.__slots__ if key not in self._optional or getattr(self, key) is not None]
+
+    def values(self):
+        return [getattr(self, key) for key in self.keys()]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def __len__(self):
+        return len(self.keys())
+
+    def to_dict(self) -> dict:
+        return dict(self.items())
+
+    def _replace(self, **changes):
+        """dataclasses.replace without going through the frozen __setattr__ of each field, validated the same"""
+        unknown = changes.keys() - set(self.__slots__)
+        if unknown:
+            raise TypeError(f"{type(self).__name__} has no fields {sorted(unknown)}")
+        new = object.__new__(type(self))
+        for key in self.__slots__:
+            object.__setattr__(new, key, changes[key] if key in changes else getattr(self, key))
+        if hasattr(new, "__post_init__"):
+            new.__post_init__()
+        return new
+
+    @classmethod
+    def from_dict(cls, section: dict, name: str):
+        if not isinstance(section, dict):
+            raise ValueError(f"Config section {name} should be a mapping, got {section!r}")
+        unknown = set(section) - set(cls.__slots__)
+        missing = set(cls.__slots__) - set(cls._optional) - set(section)
+        if unknown or missing:
+            raise ValueError(f"Config section {name}: unknown keys {sorted(unknown)}, missing keys {sorted(missing)}")
+        return cls(**{key: section.get(key) for key in cls.__slots__})
+
+
+@dataclasses.dataclass(frozen=True)
+class GlobalConfig(_Section):
+    __slots__ = (
+        "mode",
+        "prompt",
+        "negative_prompt",
+        "model_name_or_path",
+        "steps",
+        "scheduler_name",
+        "cfg_scale",
+        "width",
+        "height",
+        "seed",
+        "batch_size",
+        "input_image",
+        "denoising_strength",
+    )
+    _optional = ("input_image", "denoising_strength")
+
+    mode: str
+    prompt: str
+    negative_prompt: str
+    model_name_or_path: str
+    steps: int
+    scheduler_name: str
+    cfg_scale: float
+    width: int
+    height: int
+    seed: int
+    batch_size: int
+    input_image: object
+    denoising_strength: float
+
+    def __post_init__(self):
+        if self.mode not in MODES:
+            raise ValueError(f"Mode {self.mode} not found, should be one of {list(MODES)}")
+        for key in ("steps", "width", "height", "batch_size"):
+            if not isinstance(getattr(self, key), int) or getattr(self, key) <= 0:
+                raise ValueError(f"global.{key} should be a positive integer, got {getattr(self, key)!r}")
+        if self.mode == "img2img" and (self.input_image is None or self.denoising_strength is None):
+            raise ValueError("img2img needs global.input_image and global.denoising_strength")
+
+
+@dataclasses.dataclass(frozen=True)
+class ControlNetUnitConfig(_Section):
+    __slots__ = ("model", "cn_input_image", "module", "weight", "start", "end")
+    _optional = ("module",)
+
+    model: str
+    cn_input_image: object
+    module: str
+    weight: float
+    start: float
+    end: float
+
+    def __post_init__(self):
+        if not 0 <= self.start <= self.end <= 1:
+            raise ValueError(f"Controlnet unit start and end should verify 0 <= start <= end <= 1, got {self.start}, {self.end}")
+
+
+@dataclasses.dataclass(frozen=True)
+class QrcodeConfig(_Section):
+    __slots__ = ("text", "error_correction", "box_size", "border", "fill_color", "back_color")
+
+    text: str
+    error_correction: str
+    box_size: int
+    border: int
+    fill_color: str
+    back_color: str
+
+    def __post_init__(self):
+        if self.error_correction not in ERROR_CORRECTIONS:
+            raise ValueError(
+                f"Error correction {self.error_correction} not found, should be one of {list(ERROR_CORRECTIONS)}"
+            )
+
+
+_QRCODE_OVERRIDES = {
+    "qrcode_text": "text",
+    "qrcode_error_correction": "error_correction",
+    "qrcode_box_size": "box_size",
+    "qrcode_border": "border",
+    "qrcode_fill_color": "fill_color",
+    "qrcode_back_color": "back_color",
+}
+_UNIT_OVERRIDES = ("controlnet_model_names", "controlnet_input_images", "controlnet_weights", "controlnet_startstops")
+_GLOBAL_OVERRIDES = frozenset(GlobalConfig.__slots__)
+_OVERRIDES = _GLOBAL_OVERRIDES | set(_QRCODE_OVERRIDES) | set(_UNIT_OVERRIDES)
+
+
+@dataclasses.dataclass(frozen=True)
+class Config(_Section):
+    """
+    Validated, immutable generation config. It reads like the yaml dict (config["controlnet_units"]["tile"]["weight"])
+    and with_overrides returns a new config sharing the sections it doesn't change.
+    """
+
+    __slots__ = ("global_", "controlnet_units", "qrcode", "device")
+    _optional = ("device",)
+
+    global_: GlobalConfig
+    controlnet_units: MappingProxyType
+    qrcode: QrcodeConfig
+    device: object
+
+    def keys(self):
+        return ["global", "controlnet_units", "qrcode"] + (["device"] if self.device is not None else [])
+
+    def __getitem__(self, key):
+        if key not in self.keys():
+            raise KeyError(key)
+        return getattr(self, "global_" if key == "global" else key)
+
+    @classmethod
+    def from_dict(cls, config: dict) -> "Config":
+        if isinstance(config, Config):
+            return config
+        unknown = set(config) - {"global", "controlnet_units", "qrcode", "device"}
+        missing = {"global", "controlnet_units", "qrcode"} - set(config)
+        if unknown or missing:
+            raise ValueError(f"Config: unknown sections {sorted(unknown)}, missing sections {sorted(missing)}")
+        if not isinstance(config["controlnet_units"], dict):
+            raise ValueError("Config section controlnet_units should be a mapping of unit name to unit")
+        device = config.get("device")
+        return cls(
+            global_=GlobalConfig.from_dict(config["global"], "global"),
+            controlnet_units=MappingProxyType(
+                {
+                    name: ControlNetUnitConfig.from_dict(unit, f"controlnet_units.{name}")
+                    for name, unit in config["controlnet_units"].items()
+                }
+            ),
+            qrcode=QrcodeConfig.from_dict(config["qrcode"], "qrcode"),
+            device=MappingProxyType(dict(device)) if isinstance(device, dict) else device,
+        )
+
+    def to_dict(self) -> dict:
+        """Plain nested dict, as read from a yaml file"""
+        config = {
+            "global": self.global_.to_dict(),
+            "controlnet_units": {name: unit.to_dict() for name, unit in self.controlnet_units.items()},
+            "qrcode": self.qrcode.to_dict(),
+        }
+        if self.device is not None:
+            config["device"] = dict(self.device) if isinstance(self.device, MappingProxyType) else self.device
+        return config
+
+    def with_overrides(self, **overrides) -> "Config":
+        """
+        Config with some params changed, same params as generate_sd_qrcode (prompt, seed, controlnet_weights, ...).
+        Sections without changes are shared with this config, nothing is copied.
+        """
+        unknown = overrides.keys() - _OVERRIDES
+        if unknown:
+            raise TypeError(f"Unknown config params {sorted(unknown)}")
+
+        global_changes, qrcode_changes, unit_changes = {}, {}, {}
+        for key, value in overrides.items():
+            if value is None:
+                continue
+            if key in _GLOBAL_OVERRIDES:
+                global_changes[key] = value
+            elif key in _QRCODE_OVERRIDES:
+                qrcode_changes[_QRCODE_OVERRIDES[key]] = value
+            else:
+                unit_changes[key] = value
+        if not (global_changes or qrcode_changes or unit_changes):
+            return self
+
+        return self._replace(
+            global_=self.global_._replace(**global_changes) if global_changes else self.global_,
+            qrcode=self.qrcode._replace(**qrcode_changes) if qrcode_changes else self.qrcode,
+            controlnet_units=(
+                _override_units(self.controlnet_units, **unit_changes) if unit_changes else self.controlnet_units
+            ),
+        )
+
+
+def _override_units(
+    units: MappingProxyType,
+    controlnet_model_names: list = None,
+    controlnet_input_images: list = None,
+    controlnet_weights: list = None,
+    controlnet_startstops: list = None,
+) -> MappingProxyType:
+    units = list(units.items())
+    if controlnet_model_names is not None:
+        # new models keep the params of the unit they replace, new units start with defaults
+        units = [
+            (i, units[i][1]._replace(model=model) if i < len(units) else ControlNetUnitConfig(
+                model=model, cn_input_image="qrcode", module="none", weight=1.0, start=0.0, end=1.0
+            ))
+            for i, model in enumerate(controlnet_model_names)
+        ]
+
+    for name, values in (
+        ("controlnet_input_images", controlnet_input_images),
+        ("controlnet_weights", controlnet_weights),
+        ("controlnet_startstops", controlnet_startstops),
+    ):
+        if values is not None and len(values) != len(units):
+            raise ValueError(f"Number of {name} ({len(values)}) must match number of controlnet units ({len(units)})")
+
+    new_units = {}
+    for i, (name, unit) in enumerate(units):
+        changes = {}
+        if controlnet_input_images is not None:
+            changes["cn_input_image"] = controlnet_input_images[i]
+        if controlnet_weights is not None:
+            changes["weight"] = controlnet_weights[i]
+        if controlnet_startstops is not None:
+            changes["start"], changes["end"] = controlnet_startstops[i]
+        new_units[name] = unit._replace(**changes) if changes else unit
+    return MappingProxyType(new_units)
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def _resolve(config_name_or_path: Union[str, os.PathLike]) -> str:
+    path = CONFIGS.get(config_name_or_path, config_name_or_path)
+    return os.path.abspath(path)
+
+
+def read_config_file(config_name_or_path: Union[str, os.PathLike]) -> dict:
+    """
+    Parsed yaml of a config name or path, the file is only parsed again when it is modified.
+    The returned dict is shared: copy it before changing it.
+    """
+    return _read(config_name_or_path)[0]
+
+
+def load_config(config_name_or_path: Union[str, os.PathLike]) -> Config:
+    """Validated config of a config name or path, built once per version of the file"""
+    raw, config = _read(config_name_or_path)
+    if config is None:
+        config = Config.from_dict(raw)
+        path = _resolve(config_name_or_path)
+        with _cache_lock:
+            if path in _cache and _cache[path][1] is raw:
+                _cache[path] = (_cache[path][0], raw, config)
+    return config
+
+
+def _read(config_name_or_path) -> tuple:
+    path = _resolve(config_name_or_path)
+    mtime = os.stat(path).st_mtime_ns
+    with _cache_lock:
+        cached = _cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1], cached[2]
+
+    import yaml
+
+    with open(path, "r") as f:
+        raw = yaml.safe_load(f)
+    with _cache_lock:
+        _cache[path] = (mtime, raw, None)
+    return raw, None
@@ -0,0 +1,335 @@
+import contextvars
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+
+import PIL.Image
+
+import sdqrcode.tracing as tracing
+
+
+class _Validator:
+    __slots__ = ("digest", "etag", "last_modified", "expires")
+
+    def __init__(self, digest: str, etag: str = None, last_modified: str = None, expires: float = 0.0):
+        """Last content of a url (sha256 of the bytes) and what is needed to revalidate it"""
+        self.digest = digest
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = expires
+
+
+class ImageCache:
+    def __init__(
+        self,
+        max_memory_bytes: int = 128 * 1024**2,
+        cache_dir: str = None,
+        max_disk_bytes: int = 1024**3,
+        timeout: tuple[float, float] = (5.0, 30.0),
+        max_connections: int = 8,
+    ):
+        """
+        Images fetched from urls (input and controlnet images of the configs), so the same image isn't
+        downloaded again on every generation.
+
+        The downloaded bytes are content-addressed: stored under their sha256 in memory and on disk,
+        each tier evicting the least recently used images once over its size. Each url points to the digest
+        of its last content along with its ETag / Last-Modified: fetching it again is a conditional request,
+        answered by a 304 without the image when it didn't change. Responses with a Cache-Control max-age
+        are reused without any request until they expire.
+
+        Fetches share a pool of keep-alive connections, several urls are fetched concurrently (see read_many)
+        and concurrent fetches of the same url make a single request.
+
+        Args:
+            max_memory_bytes: size of the images kept in memory
+            cache_dir: directory of the disk cache, None to keep the images in memory only
+            max_disk_bytes: size of the images kept on disk
+            timeout: (connect, read) timeouts of the requests in seconds
+            max_connections: number of connections kept open per host, and of concurrent fetches
+        """
+        self.max_memory_bytes = max_memory_bytes
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.timeout = timeout
+        self.max_connections = max_connections
+        # fetches served without a request, images read back from disk, 304 answers and full downloads
+        self.hits = 0
+        self.disk_hits = 0
+        self.revalidations = 0
+        self.downloads = 0
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._validators = {}
+        self._inflight = {}
+        self._session = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def read(self, path_or_url) -> PIL.Image.Image:
+        """Image of a local path or a url, images are returned as is"""
+        if isinstance(path_or_url, PIL.Image.Image):
+            return path_or_url
+        with tracing.span("read_image") as span:
+            if not is_url(path_or_url):
+                try:
+                    # First, try to open the image assuming the input is a local file path.
+                    image = PIL.Image.open(path_or_url)
+                    span.set(source="file")
+                    return image
+                except (FileNotFoundError, IsADirectoryError, PermissionError):
+                    pass
+
+            # If that failed, try to open the PIL.image assuming the input is a URL.
+            import requests
+
+            try:
+                data = self.get_bytes(path_or_url)
+            except requests.RequestException as e:
+                # If the input was not a valid URL or the image could not be downloaded,
+                # raise an exception.
+                raise ValueError(f"Could not open {path_or_url} as a local file or a URL.") from e
+            span.set(source="url", content_length=len(data))
+            return PIL.Image.open(BytesIO(data))
+
+    def read_many(self, paths_or_urls: list) -> list[PIL.Image.Image]:
+        """Images of several paths or urls, the urls are fetched concurrently and each distinct one once"""
+        sources = {}
+        for path_or_url in paths_or_urls:
+            if is_url(path_or_url) and path_or_url not in sources:
+                sources[path_or_url] = None
+        if len(sources) > 1:
+            executor = self._get_executor()
+            # each fetch runs in the caller context, to be part of its trace
+            futures = {
+                url: executor.submit(contextvars.copy_context().run, self.read, url) for url in sources
+            }
+            sources = {url: future.result() for url, future in futures.items()}
+        else:
+            sources = {url: self.read(url) for url in sources}
+        return [sources[p] if is_url(p) else self.read(p) for p in paths_or_urls]
+
+    def get_bytes(self, url: str) -> bytes:
+        """Content of a url, from the cache while it is still valid"""
+        with self._lock:
+            future = self._inflight.get(url)
+            fetching = future is None
+            if fetching:
+                future = self._inflight[url] = Future()
+        if not fetching:
+            return future.result()
+
+        try:
+            data = self._fetch(url)
+            future.set_result(data)
+            return data
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[url]
+
+    def clear(self):
+        """Forget the images kept in memory, the disk cache is left as is"""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            self._validators.clear()
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    @property
+    def memory_usage(self) -> int:
+        with self._lock:
+            return self._memory_bytes
+
+    def _fetch(self, url: str) -> bytes:
+        validator = self._get_validator(url)
+        data = self._load(validator.digest) if validator is not None else None
+        if data is not None and validator.expires > time.time():
+            with self._lock:
+                self.hits += 1
+            return data
+
+        headers = {}
+        if data is not None:
+            if validator.etag:
+                headers["If-None-Match"] = validator.etag
+            if validator.last_modified:
+                headers["If-Modified-Since"] = validator.last_modified
+        response = self._get_session().get(url, headers=headers, timeout=self.timeout)
+
+        if response.status_code == 304 and data is not None:
+            validator.expires = time.time() + max_age(response.headers)
+            with self._lock:
+                self.revalidations += 1
+            self._save_validator(url, validator)
+            return data
+
+        response.raise_for_status()
+        data = response.content
+        with self._lock:
+            self.downloads += 1
+        if "no-store" in response.headers.get("Cache-Control", ""):
+            return data
+
+        validator = _Validator(
+            hashlib.sha256(data).hexdigest(),
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+            expires=time.time() + max_age(response.headers),
+        )
+        self._store(validator.digest, data)
+        self._save_validator(url, validator)
+        return data
+
+    def _get_validator(self, url: str):
+        with self._lock:
+            validator = self._validators.get(url)
+        if validator is not None or self.cache_dir is None:
+            return validator
+        try:
+            with open(self._validator_path(url)) as f:
+                validator = _Validator(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+        with self._lock:
+            self._validators[url] = validator
+        return validator
+
+    def _save_validator(self, url: str, validator: _Validator):
+        with self._lock:
+            self._validators[url] = validator
+        if self.cache_dir is not None:
+            path = self._validator_path(url)
+            _write_atomic(path, json.dumps({name: getattr(validator, name) for name in _Validator.__slots__}).encode())
+
+    def _load(self, digest: str):
+        with self._lock:
+            data = self._memory.get(digest)
+            if data is not None:
+                self._memory.move_to_end(digest)
+                return data
+        if self.cache_dir is None:
+            return None
+        path = self._object_path(digest)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # the modification time orders the disk eviction
+            os.utime(path)
+        except OSError:
+            return None
+        if hashlib.sha256(data).hexdigest() != digest:
+            return None
+        with self._lock:
+            self.disk_hits += 1
+        self._store_in_memory(digest, data)
+        return data
+
+    def _store(self, digest: str, data: bytes):
+        self._store_in_memory(digest, data)
+        if self.cache_dir is not None:
+            _write_atomic(self._object_path(digest), data)
+            self._evict_disk()
+
+    def _store_in_memory(self, digest: str, data: bytes):
+        with self._lock:
+            if digest in self._memory:
+                self._memory.move_to_end(digest)
+                return
+            self._memory[digest] = data
+            self._memory_bytes += len(data)
+            # oldest first, the image just stored is kept even when it is over the size on its own
+            while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def _evict_disk(self):
+        objects_dir = os.path.join(self.cache_dir, "objects")
+        try:
+            entries = [(e.stat().st_mtime, e.stat().st_size, e.path) for e in os.scandir(objects_dir) if e.is_file()]
+        except OSError:
+            return
+        usage = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries)[:-1]:
+            if usage <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            usage -= size
+
+    def _object_path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, "objects", digest)
+
+    def _validator_path(self, url: str) -> str:
+        return os.path.join(self.cache_dir, "urls", hashlib.sha256(url.encode()).hexdigest() + ".json")
+
+    def _get_session(self):
+        with self._lock:
+            if self._session is None:
+                import requests
+                import requests.adapters
+
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.max_connections)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self._session = session
+            return self._session
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(self.max_connections, thread_name_prefix="sdqrcode-fetch")
+            return self._executor
+
+
+def is_url(path_or_url) -> bool:
+    return isinstance(path_or_url, str) and path_or_url.startswith(("http://", "https://"))
+
+
+def max_age(headers) -> float:
+    """Seconds a response can be reused without revalidation, from its Cache-Control header"""
+    cache_control = headers.get("Cache-Control", "")
+    if "no-cache" in cache_control:
+        return 0.0
+    match = re.search(r"max-age=(\d+)", cache_control)
+    return float(match.group(1)) if match else 0.0
+
+
+def _write_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _cache_dir_from_env():
+    cache_dir = os.getenv("SDQRCODE_IMAGE_CACHE_DIR")
+    if cache_dir is not None:
+        # set to an empty string to keep the images in memory only
+        return cache_dir or None
+    cache_home = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "sdqrcode", "images")
+
+
+# shared by every generator of the process
+IMAGE_CACHE = ImageCache(cache_dir=_cache_dir_from_env())
@@ -0,0 +1,52 @@
+import asyncio
+
+import sdqrcode.sdqrcode as sdqrcode
+
+
+class CheckpointJobQueue:
+    def __init__(self):
+        """
+        Queue of pending generations, possibly from generators with different configs sharing
+        the same servers. Jobs are run grouped by checkpoint so that a mixed stream of configs
+        causes as few model swaps as possible; results keep the submission order.
+        """
+        self.jobs = []
+
+    def submit(self, generator: "sdqrcode.Sdqrcode", **config_kwargs) -> int:
+        """Queue a generator.generate_sd_qrcode(**config_kwargs) call, returns the job index"""
+        self.jobs.append((generator, config_kwargs))
+        return len(self.jobs) - 1
+
+    def groups(self) -> list[list[int]]:
+        """Job indices grouped by checkpoint, the checkpoint already loaded goes first"""
+        groups = {}
+        active_models = set()
+        for i, (generator, config_kwargs) in enumerate(self.jobs):
+            config = generator.request_config(**config_kwargs)
+            groups.setdefault(config["global"]["model_name_or_path"], []).append(i)
+            active_models.update(generator.engine.active_models)
+
+        # stable sort: loaded checkpoints first, the others in order of first submission
+        models = sorted(groups, key=lambda model: model not in active_models)
+        return [groups[model] for model in models]
+
+    def run(self) -> list:
+        results = [None] * len(self.jobs)
+        for group in self.groups():
+            for i in group:
+                generator, config_kwargs = self.jobs[i]
+                results[i] = generator.generate_sd_qrcode(**config_kwargs)
+        self.jobs = []
+        return results
+
+    async def arun(self) -> list:
+        """Run the jobs of each checkpoint concurrently, then move on to the next checkpoint"""
+        results = [None] * len(self.jobs)
+        for group in self.groups():
+            group_results = await asyncio.gather(
+                *[self.jobs[i][0].agenerate_sd_qrcode(**self.jobs[i][1]) for i in group]
+            )
+            for i, images in zip(group, group_results):
+                results[i] = images
+        self.jobs = []
+        return results
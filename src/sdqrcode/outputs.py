@@ -0,0 +1,118 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+import PIL.Image
+
+# pil: PIL images, np: (height, width, 3) uint8 arrays, or the bytes of encoded images
+OUTPUT_TYPES = ("pil", "np", "png", "webp", "jpeg")
+ENCODED_TYPES = ("png", "webp", "jpeg")
+
+# fast settings: png encoding time grows quickly with the compression level for a few % of size
+ENCODE_OPTIONS = {
+    "png": {"compress_level": 1},
+    "webp": {"quality": 90},
+    "jpeg": {"quality": 90},
+}
+
+FILE_EXTENSIONS = {"png": "png", "webp": "webp", "jpeg": "jpg"}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Threads encoding the images, pillow releases the gil while it compresses so they run in parallel"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(min(8, os.cpu_count() or 1), thread_name_prefix="sdqrcode-encode")
+        return _executor
+
+
+def check_output_type(output_type: str):
+    if output_type not in OUTPUT_TYPES:
+        raise ValueError(f"Output type {output_type} not found, should be one of {list(OUTPUT_TYPES)}")
+
+
+def encode_image(image: PIL.Image.Image, image_format: str = "png") -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, format=image_format.upper(), **ENCODE_OPTIONS.get(image_format, {}))
+    return buffer.getvalue()
+
+
+def encode_images(images: list, image_format: str = "png") -> list[bytes]:
+    """Encode several images in parallel"""
+    if len(images) == 1:
+        return [encode_image(to_pil(images[0]), image_format)]
+    executor = get_executor()
+    futures = [executor.submit(encode_image, to_pil(image), image_format) for image in images]
+    return [future.result() for future in futures]
+
+
+def to_pil(image) -> PIL.Image.Image:
+    return image if isinstance(image, PIL.Image.Image) else PIL.Image.fromarray(image)
+
+
+def convert(images: list, output_type: str) -> list:
+    """Images (PIL images or arrays) in an output type, the ones already in this type are returned as is"""
+    if output_type == "pil":
+        return [to_pil(image) for image in images]
+    if output_type == "np":
+        return [image if isinstance(image, np.ndarray) else np.asarray(image.convert("RGB")) for image in images]
+    return encode_images(images, output_type)
+
+
+class ImageSaver:
+    def __init__(self, directory: str, image_format: str = "png"):
+        """
+        Saves images to a directory in background threads, so the encoding of a batch overlaps
+        the generation of the next one.
+
+        Args:
+            directory: created if it doesn't exist
+            image_format: png, webp or jpeg
+        """
+        if image_format not in ENCODED_TYPES:
+            raise ValueError(f"Image format {image_format} not found, should be one of {list(ENCODED_TYPES)}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.image_format = image_format
+        self._futures = []
+        self._lock = threading.Lock()
+
+    def save(self, images: list, name: str) -> list[str]:
+        """
+        Queue the images to be saved as {name}_{i}.{extension}, returns their paths.
+        Errors are raised by wait.
+        """
+        extension = FILE_EXTENSIONS[self.image_format]
+        paths = [os.path.join(self.directory, f"{name}_{i}.{extension}") for i in range(len(images))]
+        executor = get_executor()
+        futures = [executor.submit(self._save, image, path) for image, path in zip(images, paths)]
+        with self._lock:
+            self._futures.extend(futures)
+        return paths
+
+    def wait(self):
+        """Wait until the queued images are saved"""
+        with self._lock:
+            futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def _save(self, image, path: str):
+        data = encode_image(to_pil(image), self.image_format)
+        # readers of the directory never see a partially written image
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.wait()
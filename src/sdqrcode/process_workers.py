@@ -0,0 +1,288 @@
+import itertools
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import PIL.Image
+
+import sdqrcode.sdqrcode as sdqrcode
+
+
+class _Worker:
+    def __init__(self, index: int, device: str, process, tasks):
+        self.index = index
+        self.device = device
+        self.process = process
+        self.tasks = tasks
+        # ids of the jobs sent to the worker and not answered yet
+        self.in_flight = set()
+        self.completed = 0
+
+
+class ProcessWorkers:
+    def __init__(
+        self,
+        config="default_diffusers",
+        devices: list[str] = None,
+        threads_per_worker: int = None,
+        torch_dtype=None,
+        start_method: str = "spawn",
+    ):
+        """
+        Pool of diffusers engines, one per process, each on its own device with its own loaded models.
+        Jobs go to the worker with the fewest jobs in flight, and the images come back through shared memory
+        instead of being pickled through a pipe. Workers load their models in parallel, the constructor
+        returns once they are all ready.
+
+        Args:
+            config: config name, path, dict or Config of the workers, its device section is set per worker
+            devices: device of each worker, ex: ["cuda:0", "cuda:1"] or ["cpu"] * 4
+                (default: one worker per gpu, or a single cpu worker)
+            threads_per_worker: torch cpu threads of each worker (default: the cpus shared between the cpu workers)
+            torch_dtype: dtype of the models, see Sdqrcode
+            start_method: multiprocessing start method, spawn is the one safe with cuda
+        """
+        config = sdqrcode.get_config(config) if not isinstance(config, dict) else config
+        self.devices = list(devices) if devices is not None else default_devices()
+        if threads_per_worker is None:
+            n_cpu_workers = sum(not device.startswith("cuda") for device in self.devices)
+            threads_per_worker = max(1, (os.cpu_count() or 1) // max(1, n_cpu_workers))
+        self.threads_per_worker = threads_per_worker
+
+        context = multiprocessing.get_context(start_method)
+        self._results = context.Queue()
+        self._workers = []
+        for index, device in enumerate(self.devices):
+            tasks = context.Queue()
+            process = context.Process(
+                target=_worker_main,
+                args=(index, with_device(config, device), threads_per_worker, torch_dtype, tasks, self._results),
+                name=f"sdqrcode-worker-{index}",
+                daemon=True,
+            )
+            process.start()
+            self._workers.append(_Worker(index, device, process, tasks))
+
+        self._jobs = {}
+        self._job_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+        try:
+            self._wait_ready()
+        except BaseException:
+            self._stop_workers()
+            raise
+        self._collector = threading.Thread(target=self._collect, name="sdqrcode-process-workers", daemon=True)
+        self._collector.start()
+
+    @property
+    def n_workers(self) -> int:
+        return len(self._workers)
+
+    def submit(self, qr_img: PIL.Image.Image = None, output_type: str = "pil", **config_kwargs) -> Future:
+        """Queue a generate_sd_qrcode(qr_img, **config_kwargs) call on a worker, the future gives its images"""
+        job = ("generate", {"qr_img": qr_img, **config_kwargs})
+        return self._submit(job, output_type, unwrap=True)
+
+    def map(self, items: list[dict], output_type: str = "pil") -> list[list]:
+        """Run one generate_sd_qrcode call per dict of config params, results keep the order of items"""
+        futures = [self.submit(output_type=output_type, **item) for item in items]
+        return [future.result() for future in futures]
+
+    def generate_sd_qrcode_batch(self, items: list[dict], max_batch_size: int = 8, output_type: str = "pil") -> list[list]:
+        """
+        Same as Sdqrcode.generate_sd_qrcode_batch, with the items sharded between the workers:
+        each gets a contiguous share of the items, in pipeline calls of up to max_batch_size images
+        """
+        shard_size = max(1, min(max_batch_size, -(-len(items) // self.n_workers)))
+        futures = [
+            self._submit(("batch", {"items": items[start : start + shard_size], "max_batch_size": max_batch_size}), output_type)
+            for start in range(0, len(items), shard_size)
+        ]
+        return [images for future in futures for images in future.result()]
+
+    def close(self):
+        """Finish the queued jobs and stop the worker processes"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._stop_workers()
+        self._results.put(None)
+        self._collector.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _submit(self, job: tuple, output_type: str, unwrap: bool = False) -> Future:
+        if output_type not in ("pil", "np"):
+            raise ValueError(f"Output type {output_type} not found, should be one of ['pil', 'np']")
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("The workers are closed")
+            alive = [worker for worker in self._workers if worker.process.is_alive()]
+            if not alive:
+                raise RuntimeError("Every worker process has exited")
+            # least loaded worker, then the one that did the least work
+            worker = min(alive, key=lambda w: (len(w.in_flight), w.completed))
+            job_id = next(self._job_ids)
+            worker.in_flight.add(job_id)
+            self._jobs[job_id] = (future, worker, output_type, unwrap)
+            worker.tasks.put((job_id,) + job)
+        return future
+
+    def _wait_ready(self):
+        ready = set()
+        while len(ready) < self.n_workers:
+            try:
+                message = self._results.get(timeout=1.0)
+            except queue.Empty:
+                for worker in self._workers:
+                    if worker.index not in ready and not worker.process.is_alive():
+                        raise RuntimeError(f"Worker {worker.index} ({worker.device}) exited while loading its models")
+                continue
+            _, index, error = message
+            if error is not None:
+                raise RuntimeError(f"Worker {index} ({self.devices[index]}) failed to load its models") from error
+            ready.add(index)
+
+    def _collect(self):
+        while True:
+            try:
+                message = self._results.get(timeout=1.0)
+            except queue.Empty:
+                self._fail_dead_workers()
+                continue
+            if message is None:
+                self._fail_dead_workers()
+                return
+
+            _, job_id, shared, error = message
+            with self._lock:
+                future, worker, output_type, unwrap = self._jobs.pop(job_id)
+                worker.in_flight.discard(job_id)
+                worker.completed += 1
+            if error is not None:
+                future.set_exception(error)
+                continue
+            try:
+                results = read_shared_images(*shared, output_type=output_type)
+            except BaseException as e:
+                future.set_exception(e)
+                continue
+            future.set_result(results[0] if unwrap else results)
+
+    def _fail_dead_workers(self):
+        with self._lock:
+            failed = []
+            for worker in self._workers:
+                if worker.in_flight and not worker.process.is_alive():
+                    failed += [self._jobs.pop(job_id)[0] for job_id in worker.in_flight]
+                    worker.in_flight.clear()
+        for future in failed:
+            future.set_exception(RuntimeError("The worker process running the job exited"))
+
+    def _stop_workers(self):
+        for worker in self._workers:
+            if worker.process.is_alive():
+                worker.tasks.put(None)
+        for worker in self._workers:
+            worker.process.join()
+
+
+def default_devices() -> list[str]:
+    import torch
+
+    if torch.cuda.is_available():
+        return [f"cuda:{i}" for i in range(torch.cuda.device_count())]
+    return ["cpu"]
+
+
+def with_device(config: dict, device: str) -> dict:
+    """Config whose device section is set to a device, keeping its other device settings"""
+    section = config.get("device") or {}
+    section = {"name": section} if isinstance(section, str) else dict(section)
+    return dict(config, device=dict(section, name=device))
+
+
+def write_shared_images(results: list[list]) -> tuple[str, list]:
+    """
+    Copy the images of each item into one shared memory block, returns its name and the (shape, offset)
+    of each image of each item. The reader unlinks the block.
+    """
+    arrays = [[np.asarray(image, dtype=np.uint8) for image in images] for images in results]
+    size = sum(array.nbytes for images in arrays for array in images)
+    shared = SharedMemory(create=True, size=max(1, size))
+    layout = []
+    offset = 0
+    for images in arrays:
+        item_layout = []
+        for array in images:
+            np.ndarray(array.shape, np.uint8, shared.buf, offset)[...] = array
+            item_layout.append((array.shape, offset))
+            offset += array.nbytes
+        layout.append(item_layout)
+    shared.close()
+    return shared.name, layout
+
+
+def read_shared_images(name: str, layout: list, output_type: str = "pil") -> list[list]:
+    """Images of each item written by write_shared_images, copied out of the shared memory block before unlinking it"""
+    shared = SharedMemory(name=name)
+    try:
+        results = []
+        for item_layout in layout:
+            images = []
+            for shape, offset in item_layout:
+                array = np.ndarray(shape, np.uint8, shared.buf, offset).copy()
+                images.append(array if output_type == "np" else PIL.Image.fromarray(array))
+            results.append(images)
+        return results
+    finally:
+        shared.close()
+        shared.unlink()
+
+
+def _worker_main(index: int, config: dict, threads: int, torch_dtype, tasks, results):
+    try:
+        import torch
+
+        torch.set_num_threads(threads)
+        generator = sdqrcode.Sdqrcode(config, torch_dtype=torch_dtype)
+    except BaseException as e:
+        results.put(("ready", index, _picklable(e)))
+        return
+    results.put(("ready", index, None))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        job_id, kind, kwargs = task
+        try:
+            if kind == "generate":
+                images = [generator.generate_sd_qrcode(output_type="np", **kwargs)]
+            else:
+                images = generator.generate_sd_qrcode_batch(**kwargs)
+            results.put(("done", job_id, write_shared_images(images), None))
+        except BaseException as e:
+            results.put(("done", job_id, None, _picklable(e)))
+    generator.release()
+
+
+def _picklable(error: BaseException) -> BaseException:
+    import pickle
+
+    try:
+        pickle.loads(pickle.dumps(error))
+        return error
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
@@ -0,0 +1,121 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+import numpy as np
+import PIL.Image
+
+
+class DecodeResult:
+    def __init__(
+        self,
+        batch: int,
+        index: int,
+        seed: int,
+        image: PIL.Image.Image,
+        data: Optional[str],
+        expected_text: Optional[str],
+    ):
+        """
+        Decoding of a generated candidate.
+
+        Args:
+            batch: index of the generation call that produced the image
+            index: index of the image among all the candidates
+            seed: seed of the generation call (-1 if random)
+            data: decoded text, None if no qr code was read
+            expected_text: text the qr code should contain, None to accept any text
+        """
+        self.batch = batch
+        self.index = index
+        self.seed = seed
+        self.image = image
+        self.data = data
+        self.expected_text = expected_text
+
+    @property
+    def scannable(self) -> bool:
+        if self.data is None:
+            return False
+        return self.expected_text is None or self.data == self.expected_text
+
+    def __repr__(self):
+        return (
+            f"DecodeResult(batch={self.batch}, index={self.index}, seed={self.seed}, "
+            f"data={self.data!r}, scannable={self.scannable})"
+        )
+
+
+def decode_qrcode(image: PIL.Image.Image) -> Optional[str]:
+    """Text of the qr code in the image with opencv, None if it can't be read"""
+    import cv2
+
+    # detectors hold state, one per call so that decoding can run on several threads
+    detector = cv2.QRCodeDetector()
+    data, points, _ = detector.detectAndDecode(np.asarray(image.convert("L")))
+    return data if points is not None and data else None
+
+
+def generate_until_scannable(
+    generator,
+    n_scannable: int = 1,
+    max_batches: int = 10,
+    max_seconds: float = None,
+    decoder: Callable[[PIL.Image.Image], Optional[str]] = None,
+    max_workers: int = 4,
+    qr_img: PIL.Image.Image = None,
+    expected_text: str = None,
+    **config_kwargs,
+) -> tuple[list[PIL.Image.Image], list[DecodeResult]]:
+    """
+    Call generator.generate_sd_qrcode until n_scannable images can be decoded, see Sdqrcode.generate_until_scannable.
+    Candidates are decoded on a thread pool while the next batch is generated: the decodes already finished are
+    checked before each new batch, one still running then can make the search generate one batch more than needed.
+    """
+    if max_batches is None and max_seconds is None:
+        raise ValueError("Set max_batches or max_seconds, a qr code may never become scannable")
+    decoder = decode_qrcode if decoder is None else decoder
+
+    config = generator.request_config(**config_kwargs)
+    seed = config["global"]["seed"]
+    config_kwargs.pop("seed", None)
+    if expected_text is None and qr_img is None:
+        expected_text = config["qrcode"]["text"]
+    start = time.perf_counter()
+    results, pending = [], []
+
+    def collect(futures):
+        for future in futures:
+            results.append(future.result())
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        batch = 0
+        while max_batches is None or batch < max_batches:
+            if max_seconds is not None and time.perf_counter() - start >= max_seconds:
+                break
+            # the decodes of the previous batch that are already finished can make a new batch unnecessary
+            decoded = [future.result() for future in pending if future.done()]
+            if sum(result.scannable for result in results + decoded) >= n_scannable:
+                break
+            # each batch explores new seeds
+            batch_seed = -1 if seed == -1 else seed + batch * config["global"]["batch_size"]
+            images = generator.generate_sd_qrcode(qr_img, seed=batch_seed, **config_kwargs)
+
+            # the previous batch was decoded while this one was generated, decoding lags one batch at most
+            collect(pending)
+            pending = [
+                pool.submit(_decode, decoder, batch, len(results) + i, batch_seed, image, expected_text)
+                for i, image in enumerate(images)
+            ]
+            batch += 1
+            if sum(result.scannable for result in results) >= n_scannable:
+                break
+
+        # the decodes still running when the search stops are waited for
+        collect(pending)
+
+    return [result.image for result in results if result.scannable][:n_scannable], results
+
+
+def _decode(decoder, batch, index, seed, image, expected_text) -> DecodeResult:
+    return DecodeResult(batch, index, seed, image, decoder(image), expected_text)
@@ -1,29 +1,19 @@
-import webuiapi
 import qrcode
-import yaml
 import PIL
+import PIL.Image
+import PIL.ImageColor
+import numpy as np
+import functools
 import os
-import urllib.request
-from pathlib import Path
-import requests
-from io import BytesIO
+import copy
+import random
 import sdqrcode.Engines.engine_util as engine_util
-from typing import Union
-
-try:
-    import torch
-except:
-    pass
-
-CONFIGS = {
-    "default_auto":           Path(__file__).parent / "configs" / "default_auto.yaml",
-    "default_diffusers":      Path(__file__).parent / "configs" / "default_diffusers.yaml",
-    "brightness_auto":        Path(__file__).parent / "configs" / "brightness_auto.yaml",
-    "brightness_diffusers":   Path(__file__).parent / "configs" / "brightness_diffusers.yaml",
-    "img2img_tile_auto":      Path(__file__).parent / "configs" / "img2img_tile_auto.yaml",
-    "img2img_tile_diffusers": Path(__file__).parent / "configs" / "img2img_tile_diffusers.yaml",
-}
-
+import sdqrcode.image_cache as image_cache
+import sdqrcode.outputs as outputs
+import sdqrcode.scan as scan
+import sdqrcode.tracing as tracing
+from sdqrcode.config import CONFIGS, ERROR_CORRECTIONS, Config, load_config, read_config_file
+from typing import AsyncIterator, Iterator, Union
 
 # Backend enum, one of auto_api, diffusers
 class constants:
@@ -35,25 +25,33 @@ class Sdqrcode:
     def __init__(
         self,
         config_name_or_path_or_dict: str,
-        auto_api_hostname: str = None,
+        auto_api_hostname: Union[str, list[str]] = None,
         auto_api_port: int = None,
         auto_api_https: bool = None,
         auto_api_username: str = None,
         auto_api_password: str = None,
         torch_dtype = None,
+        engine: str = None,
+        tracer: "tracing.Tracer" = None,
     ):
         """
         Args:
             backend: Backend enum, one of auto_api, diffusers
             model: Model name or path to a pretrained model
             config_name_or_path: Pretrained config name or path if not the same as model_name
-            auto_api_hostname: Hostname of the Automatic1111 server
+            auto_api_hostname: Hostname of the Automatic1111 server, or list of hostnames to balance the generations between servers
             auto_api_port: Port of the Automatic1111 server (default: 7860)
             auto_api_https: Use HTTPS for the Automatic1111 server
             auto_api_username: Username for the Automatic1111 server (if any)
             auto_api_password: Password for the Automatic1111 server (if any)
             torch_dtype: (only diffusers) Torch dtype to use for the model (default: torch.float32)
+            engine: Name of the engine, see Engines.engine_util.available_engines (default: diffusers without
+                auto_api_hostname, Automatic1111 with it). Its dependencies are only imported now
+            tracer: tracing.Tracer recording the duration (and peak memory) of each stage of the generations
         """
+        self.tracer = tracer
+        # (snapshot of self.config, its validated Config), see base_config
+        self._base_config = None
 
         # Load backend
         self.backend = (
@@ -63,6 +61,7 @@ class Sdqrcode:
             self.config = get_config(config_name_or_path_or_dict)
 
         self.engine = engine_util.init_engine(
+            engine=engine,
             hostname=auto_api_hostname,
             port=auto_api_port,
             https=auto_api_https,
@@ -78,87 +77,330 @@ class Sdqrcode:
         input_image: PIL.Image.Image = None, # for img2img
         controlnet_input_images: list[Union[PIL.Image.Image, str]] = None,
         return_cn_imgs: bool = False,
+        output_type: str = "pil",
         **config_kwargs,
     ) -> list[PIL.Image.Image]:
         """
         Args:
             qr_img: PIL image of QR code, if None will generate a QR code from config
-            return_cn_imgs: Return the controlnet images
+            return_cn_imgs: Also return the controlnet detect maps, after the images (Automatic1111 engines)
+            output_type: pil (PIL images), np ((height, width, 3) uint8 arrays, straight from the decoded
+                tensor with diffusers), or png, webp, jpeg for the bytes of the encoded images, encoded in parallel
+            **config_kwargs: config params of this call (prompt, seed, ...), the generator config is not changed.
+                Calls from several threads can share the generator, see workers.GenerationWorkers
         """
+        outputs.check_output_type(output_type)
+        if return_cn_imgs and not getattr(self.engine, "returns_cn_imgs", False):
+            raise ValueError(f"{type(self.engine).__name__} can't return the controlnet images")
+        with self._trace("generate_sd_qrcode"):
+            config = self.request_config(
+                input_image=input_image, controlnet_input_images=controlnet_input_images, **config_kwargs
+            )
+            input_image, controlnet_input_images = self._prepare_images(config, qr_img)
+            # the engine produces the output type when it can, the others are converted from its PIL images
+            engine_kwargs = {"return_cn_imgs": True} if return_cn_imgs else {}
+            if output_type != "pil" and output_type in getattr(self.engine, "output_types", ()):
+                engine_kwargs["output_type"] = output_type
+            sd_qr_imgs = self.engine.generate_sd_qrcode(
+                input_image, controlnet_input_images, config=config, **engine_kwargs
+            )
+            if output_type != engine_kwargs.get("output_type", "pil"):
+                with tracing.span("encode_outputs", output_type=output_type):
+                    sd_qr_imgs = outputs.convert(sd_qr_imgs, output_type)
+            return sd_qr_imgs
 
-        self.config = update_config_dict(
-            config=self.config,
+    def generate_sd_qrcode_to_directory(
+        self,
+        directory: str,
+        items: list[dict],
+        image_format: str = "png",
+        max_batch_size: int = 8,
+    ) -> list[list[str]]:
+        """
+        Generate items (see generate_sd_qrcode_batch) and save their images to a directory as {item index}_{i}.{ext}.
+        The images are encoded and written in background threads while the next batch is generated.
+
+        Returns:
+            the paths of the images of each item, in the same order as items
+        """
+        paths = []
+        with outputs.ImageSaver(directory, image_format) as saver:
+            for start in range(0, len(items), max_batch_size):
+                chunk = items[start : start + max_batch_size]
+                results = self.generate_sd_qrcode_batch(chunk, max_batch_size=max_batch_size)
+                for i, images in enumerate(results, start):
+                    paths.append(saver.save(images, str(i)))
+        return paths
+
+    async def agenerate_sd_qrcode(
+        self,
+        qr_img: PIL.Image.Image = None,
+        **config_kwargs,
+    ) -> list[PIL.Image.Image]:
+        """
+        Async version of generate_sd_qrcode. With a list of Automatic1111 hosts, concurrent calls
+        (ex: with asyncio.gather) are spread over the servers.
+        """
+        with self._trace("agenerate_sd_qrcode"):
+            config = self.request_config(**config_kwargs)
+            input_image, controlnet_input_images = self._prepare_images(config, qr_img)
+            return await self.engine.agenerate_sd_qrcode(input_image, controlnet_input_images, config=config)
+
+    def generate_sd_qrcode_stream(
+        self,
+        qr_img: PIL.Image.Image = None,
+        preview_callback=None,
+        **config_kwargs,
+    ) -> Iterator[PIL.Image.Image]:
+        """
+        Same as generate_sd_qrcode, but yields each image as soon as it is ready instead of returning the batch.
+
+        Args:
+            preview_callback: called with (step, list of preview images) while the images are generated.
+                diffusers: rough previews of the batch after each step, at the latent resolution (see Engines.previews).
+                Automatic1111: the live preview of the server, when enabled in its settings
+        Invalid params raise here, the generation starts with the iteration.
+        """
+        config = self.request_config(**config_kwargs)
+        input_image, controlnet_input_images = self._prepare_images(config, qr_img)
+        return self.engine.generate_sd_qrcode_stream(
+            input_image, controlnet_input_images, config=config, preview_callback=preview_callback
+        )
+
+    def agenerate_sd_qrcode_stream(
+        self,
+        qr_img: PIL.Image.Image = None,
+        preview_callback=None,
+        **config_kwargs,
+    ) -> AsyncIterator[PIL.Image.Image]:
+        """
+        Async version of generate_sd_qrcode_stream, to use with async for. With the diffusers engine,
+        the generation runs in a worker thread and preview_callback is called from it.
+        """
+        config = self.request_config(**config_kwargs)
+        input_image, controlnet_input_images = self._prepare_images(config, qr_img)
+        return self.engine.agenerate_sd_qrcode_stream(
+            input_image, controlnet_input_images, config=config, preview_callback=preview_callback
+        )
+
+    def generate_sd_qrcode_batch(
+        self,
+        items: list[dict],
+        max_batch_size: int = 8,
+    ) -> list[list[PIL.Image.Image]]:
+        """
+        Generate many qr codes, items sharing the same generation shape are run together in batched pipeline calls.
+
+        Args:
+            items: one dict of config params per qr code (qrcode_text, prompt, seed, ...), see generate_sd_qrcode
+            max_batch_size: maximum number of images generated by one pipeline call
+        Returns:
+            the generated images of each item, in the same order as items. Image i of an item is seeded with seed + i,
+            as in generate_sd_qrcode: with diffusers an item gives the images of generate_sd_qrcode(**item)
+        """
+        with self._trace("generate_sd_qrcode_batch", items=len(items)):
+            base_config = self.request_config()
+            configs = [base_config.with_overrides(**item) for item in items]
+
+            # group compatible items, keeping the order of their first appearance
+            groups = {}
+            for i, config in enumerate(configs):
+                groups.setdefault(get_batch_key(config), []).append(i)
+
+            results = [None] * len(items)
+            for indices in groups.values():
+                items_per_call = max(1, max_batch_size // configs[indices[0]]["global"]["batch_size"])
+                for start in range(0, len(indices), items_per_call):
+                    chunk = indices[start : start + items_per_call]
+                    input_images, controlnet_input_images = [], []
+                    for i in chunk:
+                        input_image, cn_input_images = self._prepare_images(configs[i])
+                        input_images.append(input_image)
+                        controlnet_input_images.append(cn_input_images)
+
+                    sd_qr_imgs = self.engine.generate_sd_qrcode_batch(
+                        [configs[i] for i in chunk], input_images, controlnet_input_images
+                    )
+                    for i, imgs in zip(chunk, sd_qr_imgs):
+                        results[i] = imgs
+            return results
+
+    def generate_sd_qrcode_variants(
+        self,
+        variants: list[dict],
+        qr_img: PIL.Image.Image = None,
+        **config_kwargs,
+    ) -> list[list[PIL.Image.Image]]:
+        """
+        Generate variants of the same qr code differing only by their controlnet params, all from the same seed.
+        With diffusers in txt2img, the denoising steps before the variants start to differ (ex: before the
+        start of the unit being swept) are run once and shared by all the variants.
+
+        Args:
+            variants: one dict per variant with controlnet_weights and/or controlnet_startstops
+            qr_img: PIL image of QR code, if None will generate a QR code from config
+            **config_kwargs: config params shared by the variants, see generate_sd_qrcode
+        Returns:
+            the generated images of each variant, in the same order as variants
+        """
+        with self._trace("generate_sd_qrcode_variants", variants=len(variants)):
+            config = self.request_config(**config_kwargs)
+            # variants only share their first steps when they start from the same noise
+            if config["global"]["seed"] == -1:
+                config = config.with_overrides(seed=random.randrange(2**32))
+
+            configs = []
+            for variant in variants:
+                unknown = set(variant) - {"controlnet_weights", "controlnet_startstops"}
+                if unknown:
+                    raise ValueError(f"Variants can only change controlnet_weights and controlnet_startstops, not {sorted(unknown)}")
+                configs.append(config.with_overrides(**variant))
+
+            input_image, controlnet_input_images = self._prepare_images(config, qr_img)
+            return self.engine.generate_sd_qrcode_variants(configs, input_image, controlnet_input_images)
+
+    def generate_until_scannable(
+        self,
+        n_scannable: int = 1,
+        max_batches: int = 10,
+        max_seconds: float = None,
+        decoder=None,
+        max_workers: int = 4,
+        qr_img: PIL.Image.Image = None,
+        expected_text: str = None,
+        **config_kwargs,
+    ) -> tuple[list[PIL.Image.Image], list["scan.DecodeResult"]]:
+        """
+        Generate batches until n_scannable images decode to the qr code text. Each batch is decoded on a
+        thread pool while the next one is generated, and a new batch starts from a new seed. A batch is only
+        skipped when the decodes of the previous one are finished: if they still run when it starts, the search
+        can generate one batch more than needed.
+
+        Args:
+            n_scannable: number of scannable images wanted
+            max_batches: maximum number of generate_sd_qrcode calls (None for no limit)
+            max_seconds: time budget, no new batch is started after it (None for no limit)
+            decoder: function returning the text decoded from an image or None (default: opencv, see scan.decode_qrcode)
+            max_workers: number of decoding threads
+            qr_img: PIL image of QR code, if None will generate a QR code from config
+            expected_text: text the images must decode to (default: the config qrcode text, any text with qr_img)
+            **config_kwargs: config params, see generate_sd_qrcode
+        Returns:
+            up to n_scannable scannable images, and the decode result of every candidate in generation order
+        """
+        return scan.generate_until_scannable(
+            self,
+            n_scannable=n_scannable,
+            max_batches=max_batches,
+            max_seconds=max_seconds,
+            decoder=decoder,
+            max_workers=max_workers,
+            qr_img=qr_img,
+            expected_text=expected_text,
             **config_kwargs,
         )
-        
-        # generate qr code if not provided
-
-        if qr_img is None:
-            error_name_to_enum = {
-                "low": qrcode.constants.ERROR_CORRECT_L,
-                "medium": qrcode.constants.ERROR_CORRECT_M,
-                "quartile": qrcode.constants.ERROR_CORRECT_Q,
-                "high": qrcode.constants.ERROR_CORRECT_H,
-            }
-
-            qr_img = generate_qrcode_img(
-                error_correction=error_name_to_enum[self.config["qrcode"]["error_correction"]],
-                box_size=self.config["qrcode"]["box_size"],
-                border=self.config["qrcode"]["border"],
-                fill_color=self.config["qrcode"]["fill_color"],
-                back_color=self.config["qrcode"]["back_color"],
-                text=self.config["qrcode"]["text"],
-            )
-        
-        # set img2img input image
-        input_image = None
-        if self.config["global"]["mode"] == "img2img":
-            if self.config["global"]["input_image"] == "qrcode":
-                input_image = qr_img
-            else:
-                input_image = read_image(self.config["global"]["input_image"])
-            
-        
-        
-        # set controlnet input images
-        controlnet_input_images = []
-        for _, unit in self.config["controlnet_units"].items():
-            if unit["cn_input_image"] == "qrcode":
-                cn_input_img = qr_img
-            else:
-                cn_input_img = read_image(unit["cn_input_image"])
-            controlnet_input_images.append(cn_input_img)
-            
-        sd_qr_imgs = self.engine.generate_sd_qrcode(input_image, controlnet_input_images)
-        return sd_qr_imgs
+
+    def request_config(self, **config_kwargs) -> Config:
+        """Config of one call: the generator config with the call params, the generator config is left untouched"""
+        with tracing.span("request_config"):
+            return self.base_config().with_overrides(**config_kwargs)
+
+    def base_config(self) -> Config:
+        """
+        The generator config validated, cached: it is only validated again when self.config is replaced or
+        changed in place, comparing it with a snapshot costs much less than validating it.
+        """
+        if isinstance(self.config, Config):
+            return self.config
+        cached = self._base_config
+        if cached is None or cached[0] != self.config:
+            snapshot = copy.deepcopy(self.config)
+            cached = (snapshot, Config.from_dict(snapshot))
+            self._base_config = cached
+        return cached[1]
+
+    def _trace(self, name: str, **attributes):
+        """Span of a generation: a new trace of the generator tracer, or a stage of the generation being traced"""
+        if self.tracer is not None:
+            return self.tracer.span(name, **attributes)
+        return tracing.span(name, **attributes)
+
+    def _prepare_images(self, config: dict, qr_img: PIL.Image.Image = None):
+        """img2img input image and controlnet input images of a config"""
+        with tracing.span("prepare_images"):
+            # generate qr code if not provided
+            if qr_img is None:
+                with tracing.span("render_qrcode"):
+                    qr_img = generate_qrcode_img(
+                        error_correction=ERROR_CORRECTIONS[config["qrcode"]["error_correction"]],
+                        box_size=config["qrcode"]["box_size"],
+                        border=config["qrcode"]["border"],
+                        fill_color=config["qrcode"]["fill_color"],
+                        back_color=config["qrcode"]["back_color"],
+                        text=config["qrcode"]["text"],
+                        # rendered at the generation size, so the engines don't have to resample it
+                        width=config["global"]["width"],
+                        height=config["global"]["height"],
+                    )
+
+            sources = [unit["cn_input_image"] for unit in config["controlnet_units"].values()]
+            if config["global"]["mode"] == "img2img":
+                sources.insert(0, config["global"]["input_image"])
+            # the images other than the qr code are read together, urls are fetched concurrently
+            images = iter(read_images([source for source in sources if source != "qrcode"]))
+            images = [qr_img if source == "qrcode" else next(images) for source in sources]
+
+            # img2img input image, then controlnet input images
+            input_image = images.pop(0) if config["global"]["mode"] == "img2img" else None
+            return input_image, images
+
+    def release(self):
+        """
+        Release the models used by the engine. Models shared with other generators stay loaded,
+        the others can be evicted from the model cache.
+        """
+        self.engine.release()
 
 
 def get_config(config_name_or_path: str = "default_diffusers") -> dict:
+    """
+    Config dict of a config name or path, the caller can modify it. Files are only parsed again when modified,
+    see load_config for the validated read-only config.
+    """
     if type(config_name_or_path) == type(dict()):
         return config_name_or_path
-    if config_name_or_path in CONFIGS:
-        with open(CONFIGS[config_name_or_path], "r") as f:
-            config = yaml.safe_load(f)
-    else:
-        with open(config_name_or_path, "r") as f:
-            config = yaml.safe_load(f)
+    if isinstance(config_name_or_path, Config):
+        return config_name_or_path.to_dict()
+    return copy.deepcopy(read_config_file(config_name_or_path))
+
+def get_batch_key(config: dict) -> tuple:
+    """Generation params that must be the same for items to be generated in the same batch"""
+    return (
+        config["global"]["model_name_or_path"],
+        config["global"]["mode"],
+        config["global"]["width"],
+        config["global"]["height"],
+        config["global"]["steps"],
+        config["global"]["scheduler_name"],
+        config["global"]["cfg_scale"],
+        config["global"]["batch_size"],
+        config["global"].get("denoising_strength"),
+        tuple(
+            (unit["model"], unit["weight"], unit["start"], unit["end"])
+            for unit in config["controlnet_units"].values()
+        ),
+    )
 
-    return config
 
-def read_image(path_or_url):
-    try:
-        # First, try to open the image assuming the input is a local file path.
-        return PIL.Image.open(path_or_url)
-    except (FileNotFoundError, IsADirectoryError, PermissionError):
-        # If that failed, try to open the PIL.image assuming the input is a URL.
-        try:
-            response = requests.get(path_or_url)
-            response.raise_for_status()  # Raise an exception if the GET request was not successful.
-            return PIL.Image.open(BytesIO(response.content))
-        except requests.RequestException as e:
-            # If the input was not a valid URL or the image could not be downloaded,
-            # raise an exception.
-            raise ValueError(f"Could not open {path_or_url} as a local file or a URL.") from e
+def read_image(path_or_url) -> PIL.Image.Image:
+    """Image of a local path or a url, urls are cached (see image_cache.ImageCache)"""
+    return image_cache.IMAGE_CACHE.read(path_or_url)
+
+
+def read_images(paths_or_urls: list) -> list[PIL.Image.Image]:
+    """Images of several local paths or urls, the urls are fetched concurrently"""
+    return image_cache.IMAGE_CACHE.read_many(paths_or_urls)
+
 
 def update_config_dict(
     config: dict,
@@ -167,7 +409,9 @@ def update_config_dict(
     negative_prompt: str = None,
     model_name_or_path: str = None,
     steps: int = None,
+    scheduler_name: str = None,
     cfg_scale: float = None,
+    denoising_strength: float = None,
     width: int = None,
     height: int = None,
     seed: int = None,
@@ -194,8 +438,12 @@ def update_config_dict(
         config["global"]["model_name_or_path"] = model_name_or_path
     if steps is not None:
         config["global"]["steps"] = steps
+    if scheduler_name is not None:
+        config["global"]["scheduler_name"] = scheduler_name
     if cfg_scale is not None:
         config["global"]["cfg_scale"] = cfg_scale
+    if denoising_strength is not None:
+        config["global"]["denoising_strength"] = denoising_strength
     if width is not None:
         config["global"]["width"] = width
     if height is not None:
@@ -206,6 +454,15 @@ def update_config_dict(
         config["global"]["batch_size"] = batch_size
     if input_image is not None:
         config["global"]["input_image"] = input_image
+    # TODO: add self.update_models
+    if controlnet_model_names is not None:
+        # new models keep the params of the unit they replace, new units start with defaults
+        units = list(config["controlnet_units"].values())
+        config["controlnet_units"] = {}
+        for i, controlnet_model_name in enumerate(controlnet_model_names):
+            unit = dict(units[i]) if i < len(units) else {"cn_input_image": "qrcode", "module": "none", "weight": 1.0, "start": 0.0, "end": 1.0}
+            unit["model"] = controlnet_model_name
+            config["controlnet_units"][i] = unit
     if controlnet_input_images is not None:
         assert len(controlnet_input_images) == len(config["controlnet_units"].keys()), "Number of controlnet input images must match number of controlnet units"
         for (i, cn_input_image), cn_name in zip(enumerate(controlnet_input_images), config["controlnet_units"].keys()):
@@ -219,17 +476,7 @@ def update_config_dict(
         for (i, cn_startstop), cn_name in zip(enumerate(controlnet_startstops), config["controlnet_units"].keys()):
             config["controlnet_units"][cn_name]["start"] = cn_startstop[0]
             config["controlnet_units"][cn_name]["end"] = cn_startstop[1]
-    
-    # TODO: add self.update_models
-    if controlnet_model_names is not None:
-        config["controlnet_units"] = {}
-        for i, controlnet_model_name in enumerate(controlnet_model_names):
-            config["controlnet_units"][i] = {}
-            config["controlnet_units"][i]["model"] = controlnet_model_name
-            config["controlnet_units"][i]["weight"] = controlnet_weights[i]
-            config["controlnet_units"][i]["start"] = controlnet_startstops[i][0]
-            config["controlnet_units"][i]["end"] = controlnet_startstops[i][1]
-    
+
     if qrcode_text is not None:
         config["qrcode"]["text"] = qrcode_text
     if qrcode_error_correction is not None:
@@ -248,19 +495,23 @@ def update_config_dict(
 
 def init(
     config: str = "default_diffusers",
-    auto_api_hostname: str = None,
+    auto_api_hostname: Union[str, list[str]] = None,
     auto_api_port: int = None,
     auto_api_https: bool = None,
     auto_api_username: str = None,
     auto_api_password: str = None,
     torch_dtype = None,
+    engine: str = None,
+    tracer: "tracing.Tracer" = None,
     **config_kwargs,
 ):
     """
     config_kwargs:
         model_name_or_path: str = None,
         steps: int = None,
+        scheduler_name: str = None,
         cfg_scale: float = None,
+        denoising_strength: float = None,
         width: int = None,
         height: int = None,
         seed: int = None,
@@ -290,7 +541,8 @@ def init(
         auto_api_username=auto_api_username,
         auto_api_password=auto_api_password,
         torch_dtype=torch_dtype,
-        
+        engine=engine,
+        tracer=tracer,
     )
 
 
@@ -343,6 +595,68 @@ def init_and_generate_sd_qrcode(
     return sd_qr_img, sd_qr_generator
 
 
+@functools.lru_cache(maxsize=1024)
+def get_qrcode_matrix(text: str, error_correction: int = qrcode.constants.ERROR_CORRECT_L) -> np.ndarray:
+    """
+    Modules of the smallest qr code encoding text, without border (True for dark modules).
+    Encoding is cached, the returned array is read only.
+    """
+    qr = qrcode.QRCode(version=1, error_correction=error_correction, border=0)
+    qr.add_data(text)
+    qr.make(fit=True)
+    matrix = np.array(qr.get_matrix(), dtype=bool)
+    matrix.flags.writeable = False
+    return matrix
+
+
+def render_qrcode_array(
+    matrix: np.ndarray,
+    width: int = None,
+    height: int = None,
+    box_size: int = 10,
+    border: int = 4,
+    fill_color: Union[str, tuple] = "black",
+    back_color: Union[str, tuple] = "white",
+) -> np.ndarray:
+    """
+    Render a qr code matrix to a (height, width, 3) uint8 rgb array.
+
+    Without width and height, each module is box_size pixels wide. Otherwise the qr code and its border
+    are scaled by the largest integer module size fitting in width x height, and centered on back_color.
+    """
+    n_modules = matrix.shape[0] + 2 * border
+    if width is None and height is None:
+        width = height = n_modules * box_size
+    else:
+        width = width or height
+        height = height or width
+        box_size = min(width, height) // n_modules
+        if box_size == 0:
+            raise ValueError(f"A qr code of {n_modules} modules does not fit in {width}x{height} pixels")
+
+    # color the modules first, then scale them up: a lookup per module instead of per pixel
+    colors = np.array([_to_rgb(back_color), _to_rgb(fill_color)], dtype=np.uint8)
+    modules = colors[np.pad(matrix, border, constant_values=False).view(np.uint8)]
+    # widen the rows first so that the second repeat only copies whole contiguous rows
+    modules = modules.repeat(box_size, axis=1).repeat(box_size, axis=0)
+
+    size = n_modules * box_size
+    if (width, height) == (size, size):
+        return modules
+    top, left = (height - size) // 2, (width - size) // 2
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[0] = colors[0]
+    img[1:] = img[0]
+    img[top : top + size, left : left + size] = modules
+    return img
+
+
+def _to_rgb(color: Union[str, tuple]) -> tuple:
+    if isinstance(color, str):
+        return PIL.ImageColor.getrgb(color)[:3]
+    return tuple(color)[:3]
+
+
 def generate_qrcode_img(
     error_correction: int = qrcode.constants.ERROR_CORRECT_L,
     box_size: int = 10,
@@ -350,21 +664,23 @@ def generate_qrcode_img(
     fill_color: str = "black",
     back_color: str = "white",
     text: str = "https://koll.ai",
+    width: int = None,
+    height: int = None,
 ) -> PIL.Image.Image:
-    qr = qrcode.QRCode(
-        version=1,
-        error_correction=error_correction,
+    """
+    Args:
+        box_size: size of a module in pixels, ignored when width or height is set
+        width: width of the image, the qr code is scaled to fit it with integer module sizes
+        height: height of the image (default: width)
+    """
+    matrix = get_qrcode_matrix(text, error_correction)
+    qr_img = render_qrcode_array(
+        matrix,
+        width=width,
+        height=height,
         box_size=box_size,
         border=border,
-    )
-    qr.add_data(text)
-    qr.make(fit=True)
-    qr_img = qr.make_image(
         fill_color=fill_color,
         back_color=back_color,
     )
-
-    # convert to pil
-    qr_img = qr_img.convert("RGB")
-
-    return qr_img
+    return PIL.Image.fromarray(qr_img)
@@ -0,0 +1,243 @@
+import argparse
+import base64
+import collections
+import json
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import sdqrcode.sdqrcode as sdqrcode
+
+
+class ServerMetrics:
+    def __init__(self, max_latencies: int = 10000):
+        """
+        Counters of a batching server: requests, errors, pipeline calls by number of requests batched together,
+        and the latency (queueing + generation) of the last max_latencies requests.
+        """
+        self.requests = 0
+        self.errors = 0
+        self.batch_sizes = collections.Counter()
+        self.latencies = collections.deque(maxlen=max_latencies)
+        self._lock = threading.Lock()
+
+    def record_batch(self, n_requests: int, latencies: list[float], failed: bool = False):
+        with self._lock:
+            self.requests += n_requests
+            self.errors += n_requests if failed else 0
+            self.batch_sizes[n_requests] += 1
+            self.latencies.extend(latencies)
+
+    def snapshot(self, queue_depth: int = 0) -> dict:
+        with self._lock:
+            latencies = sorted(self.latencies)
+            return {
+                "queue_depth": queue_depth,
+                "requests": self.requests,
+                "errors": self.errors,
+                "batches": sum(self.batch_sizes.values()),
+                "batch_size_histogram": {str(size): count for size, count in sorted(self.batch_sizes.items())},
+                "latency_p50": percentile(latencies, 50),
+                "latency_p99": percentile(latencies, 99),
+            }
+
+
+def percentile(sorted_values: list[float], p: float):
+    """Nearest-rank percentile of sorted values, None when there are none"""
+    if not sorted_values:
+        return None
+    rank = max(0, -(-len(sorted_values) * p // 100) - 1)
+    return sorted_values[int(rank)]
+
+
+class _Request:
+    def __init__(self, params: dict, key: tuple, batch_size: int):
+        self.params = params
+        self.key = key
+        self.batch_size = batch_size
+        self.future = Future()
+        self.arrival = time.perf_counter()
+
+
+class DynamicBatcher:
+    def __init__(self, generator: "sdqrcode.Sdqrcode", max_batch_size: int = 8, max_wait: float = 0.05):
+        """
+        Queue of generation requests, the ones arriving within max_wait of the oldest waiting request and sharing its
+        generation shape (model, mode, size, steps, scheduler, controlnet units, see sdqrcode.get_batch_key) are
+        generated by a single generate_sd_qrcode_batch call, the results are split back per request.
+        Batching doesn't change the images: image i of a request is seeded with seed + i whatever its batch.
+
+        Args:
+            generator: generator running the batches, from a single background thread
+            max_batch_size: maximum number of images generated by one pipeline call
+            max_wait: seconds a request waits for compatible requests before its batch starts
+        """
+        self.generator = generator
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.metrics = ServerMetrics()
+        self._pending = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="sdqrcode-batcher", daemon=True)
+        self._thread.start()
+
+    @property
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def submit(self, **config_kwargs) -> Future:
+        """
+        Queue a generation with its config params (prompt, qrcode_text, seed, ...), the future gives its images.
+        Invalid params raise here, before the request is queued.
+        """
+        config = self.generator.request_config(**config_kwargs)
+        request = _Request(config_kwargs, sdqrcode.get_batch_key(config), config["global"]["batch_size"])
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The batcher is closed")
+            self._pending.append(request)
+            self._cond.notify()
+        return request.future
+
+    def close(self):
+        """Stop accepting requests, the queued ones are still generated"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def _next_batch(self) -> list[_Request]:
+        with self._cond:
+            while not self._pending:
+                if self._closed:
+                    return []
+                self._cond.wait()
+
+            first = self._pending[0]
+            max_requests = max(1, self.max_batch_size // first.batch_size)
+            deadline = first.arrival + self.max_wait
+            while not self._closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 or sum(r.key == first.key for r in self._pending) >= max_requests:
+                    break
+                self._cond.wait(remaining)
+
+            batch = [r for r in self._pending if r.key == first.key][:max_requests]
+            self._pending = [r for r in self._pending if r not in batch]
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            try:
+                results = self.generator.generate_sd_qrcode_batch(
+                    [r.params for r in batch], max_batch_size=self.max_batch_size
+                )
+            except BaseException as e:
+                self._finish(batch, failed=True)
+                for r in batch:
+                    r.future.set_exception(e)
+                continue
+            self._finish(batch)
+            for r, images in zip(batch, results):
+                r.future.set_result(images)
+
+    def _finish(self, batch: list[_Request], failed: bool = False):
+        now = time.perf_counter()
+        self.metrics.record_batch(len(batch), [now - r.arrival for r in batch], failed=failed)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # set by make_server
+    batcher: DynamicBatcher = None
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            self._send(200, self.batcher.metrics.snapshot(self.batcher.queue_depth))
+        elif self.path == "/health":
+            self._send(200, {"status": "ok"})
+        else:
+            self._send(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/generate":
+            self._send(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            params = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            future = self.batcher.submit(**params)
+        except (ValueError, TypeError) as e:
+            self._send(400, {"error": str(e)})
+            return
+        try:
+            images = future.result()
+        except Exception as e:
+            self._send(500, {"error": str(e)})
+            return
+        self._send(200, {"images": [encode_png(image) for image in images]})
+
+    def _send(self, status: int, data: dict):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def encode_png(image) -> str:
+    buffer = BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    return base64.b64encode(buffer.getvalue()).decode()
+
+
+def make_server(batcher: DynamicBatcher, host: str = "127.0.0.1", port: int = 8000) -> ThreadingHTTPServer:
+    """
+    Http server in front of a batcher, one thread per connection:
+        POST /generate with a json object of config params, returns {"images": [base64 png, ...]}
+        GET /metrics: queue depth, batch size histogram, p50/p99 latency in seconds
+        GET /health
+    """
+    handler = type("Handler", (_Handler,), {"batcher": batcher})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m sdqrcode.serve",
+        description="Local generation server, compatible requests arriving together are generated in one batch.",
+    )
+    parser.add_argument("--config", default="default_diffusers", help="config name or path")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch-size", type=int, default=8, help="maximum number of images per pipeline call")
+    parser.add_argument("--max-wait-ms", type=float, default=50, help="time a request waits for others to batch with")
+    args = parser.parse_args(args)
+
+    generator = sdqrcode.init(config=args.config)
+    batcher = DynamicBatcher(generator, max_batch_size=args.max_batch_size, max_wait=args.max_wait_ms / 1000)
+    server = make_server(batcher, args.host, args.port)
+    print(f"Serving on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+        generator.release()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import random
+import sqlite3
+import time
+
+import yaml
+
+import sdqrcode.sdqrcode as sdqrcode
+
+
+def grid(**params: list) -> list[dict]:
+    """
+    Every combination of the params values, ex: grid(cfg_scale=[5, 7], steps=[20, 30]) gives 4 points.
+    Params are generate_sd_qrcode config params (controlnet_weights, controlnet_startstops, scheduler_name, ...)
+    """
+    names = list(params)
+    return [dict(zip(names, values)) for values in itertools.product(*params.values())]
+
+
+def random_search(n_points: int, seed: int = 0, **params) -> list[dict]:
+    """
+    n_points random points: a list is sampled uniformly among its values,
+    a (low, high) tuple uniformly in the range (integers if both bounds are integers).
+    """
+    rng = random.Random(seed)
+    points = []
+    for _ in range(n_points):
+        point = {}
+        for name, values in params.items():
+            if isinstance(values, tuple):
+                low, high = values
+                if isinstance(low, int) and isinstance(high, int):
+                    point[name] = rng.randint(low, high)
+                else:
+                    point[name] = rng.uniform(low, high)
+            else:
+                point[name] = rng.choice(values)
+        points.append(point)
+    return points
+
+
+def config_hash(config: dict) -> str:
+    """Hash identifying a generation config, two identical configs give the same images (for a fixed seed)"""
+    # controlnet unit names can be ints, keys are compared as strings
+    data = json.dumps(config, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class SweepStore:
+    def __init__(self, path: str):
+        """
+        Results of a sweep on disk: an sqlite index (index.sqlite) and the generated images (images/*.png).
+        Points already in the store are skipped, so an interrupted sweep resumes where it stopped.
+        """
+        self.path = path
+        os.makedirs(os.path.join(path, "images"), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(path, "index.sqlite"))
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS runs (
+                config_hash TEXT PRIMARY KEY,
+                params TEXT NOT NULL,
+                config TEXT NOT NULL,
+                images TEXT NOT NULL,
+                seconds REAL NOT NULL,
+                created REAL NOT NULL
+            )
+            """
+        )
+        self.db.commit()
+
+    def __contains__(self, config_hash: str) -> bool:
+        return self.db.execute("SELECT 1 FROM runs WHERE config_hash = ?", (config_hash,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+
+    def add(self, config_hash: str, params: dict, config: dict, images: list, seconds: float):
+        paths = []
+        for i, image in enumerate(images):
+            path = os.path.join("images", f"{config_hash[:16]}_{i}.png")
+            image.save(os.path.join(self.path, path))
+            paths.append(path)
+        self.db.execute(
+            "INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                config_hash,
+                json.dumps(params, default=str),
+                json.dumps(config, default=str),
+                json.dumps(paths),
+                seconds,
+                time.time(),
+            ),
+        )
+        self.db.commit()
+
+    def results(self) -> list[dict]:
+        """Stored runs in the order they were generated, image paths are relative to the store"""
+        rows = self.db.execute(
+            "SELECT config_hash, params, config, images, seconds FROM runs ORDER BY created"
+        ).fetchall()
+        return [
+            {
+                "config_hash": config_hash,
+                "params": json.loads(params),
+                "config": json.loads(config),
+                "images": json.loads(images),
+                "seconds": seconds,
+            }
+            for config_hash, params, config, images, seconds in rows
+        ]
+
+    def close(self):
+        self.db.close()
+
+
+def plan(generator: "sdqrcode.Sdqrcode", points: list[dict], max_batch_size: int = 8) -> list[list[int]]:
+    """
+    Point indices grouped in generation calls: points are ordered by checkpoint (the loaded ones first)
+    so that no model is loaded twice, then by batch key so that compatible points are generated together.
+    """
+    base_config = generator.request_config()
+    configs = [base_config.with_overrides(**point) for point in points]
+    active_models = set(generator.engine.active_models)
+
+    groups = {}
+    for i, config in enumerate(configs):
+        groups.setdefault(sdqrcode.get_batch_key(config), []).append(i)
+    # stable sort: loaded checkpoints first, then the order of first appearance (the batch key starts with the model)
+    models = list(dict.fromkeys(key[0] for key in groups))
+    keys = sorted(groups, key=lambda key: (key[0] not in active_models, models.index(key[0])))
+
+    calls = []
+    for key in keys:
+        indices = groups[key]
+        items_per_call = max(1, max_batch_size // configs[indices[0]]["global"]["batch_size"])
+        calls += [indices[start : start + items_per_call] for start in range(0, len(indices), items_per_call)]
+    return calls
+
+
+def run_sweep(
+    generator: "sdqrcode.Sdqrcode",
+    points: list[dict],
+    store: SweepStore,
+    max_batch_size: int = 8,
+    callback=None,
+) -> SweepStore:
+    """
+    Generate every point not already in the store. The generator config is left untouched.
+
+    Args:
+        points: config params of each run, see grid and random_search
+        store: where results are saved after each generation call
+        max_batch_size: maximum number of images generated by one pipeline call
+        callback: called with (number of runs done, number of runs) after each generation call
+    """
+    base_config = generator.request_config()
+    configs = [base_config.with_overrides(**point).to_dict() for point in points]
+    # before anything is generated: a sweep over models the engine can't load would store mislabeled images
+    for config in configs:
+        generator.engine.check_models(config)
+    hashes = [config_hash(config) for config in configs]
+
+    # a point given twice is only generated once
+    todo = {}
+    for i, h in enumerate(hashes):
+        if h not in store and h not in todo:
+            todo[h] = i
+    todo_indices = list(todo.values())
+    todo_points = [points[i] for i in todo_indices]
+
+    done = 0
+    for call in plan(generator, todo_points, max_batch_size):
+        start = time.perf_counter()
+        results = generator.generate_sd_qrcode_batch([todo_points[i] for i in call], max_batch_size=max_batch_size)
+        seconds = (time.perf_counter() - start) / len(call)
+        for i, images in zip(call, results):
+            point_index = todo_indices[i]
+            store.add(hashes[point_index], points[point_index], configs[point_index], images, seconds)
+        done += len(call)
+        if callback is not None:
+            callback(done, len(todo_points))
+    return store
+
+
+def parse_params(values: list[str]) -> dict:
+    """name=value args, values are yaml: cfg_scale=[5,7,9] or controlnet_weights=[[0.3,0.5],[0.4,0.6]]"""
+    params = {}
+    for value in values:
+        name, _, data = value.partition("=")
+        params[name] = yaml.safe_load(data)
+    return params
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m sdqrcode.sweep",
+        description="Sweep config params, results go to an sqlite index and png files. Run again to resume.",
+    )
+    parser.add_argument("--config", default="default_diffusers", help="config name or path")
+    parser.add_argument("--out", required=True, help="directory of the sweep results")
+    parser.add_argument("--param", action="append", default=[], help="name=[values], swept over")
+    parser.add_argument("--range", action="append", default=[], help="name=[low, high], random search only")
+    parser.add_argument("--random", type=int, default=None, help="number of random points instead of the grid")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random search")
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--auto-api-hostname", action="append", default=None, help="Automatic1111 host(s)")
+    parser.add_argument("--auto-api-port", type=int, default=7860)
+    args = parser.parse_args(args)
+
+    params = parse_params(args.param)
+    ranges = {name: tuple(bounds) for name, bounds in parse_params(args.range).items()}
+    if args.random is None:
+        if ranges:
+            parser.error("--range needs --random")
+        points = grid(**params)
+    else:
+        points = random_search(args.random, seed=args.seed, **params, **ranges)
+
+    hostname = args.auto_api_hostname
+    if hostname is not None and len(hostname) == 1:
+        hostname = hostname[0]
+    generator = sdqrcode.init(config=args.config, auto_api_hostname=hostname, auto_api_port=args.auto_api_port)
+
+    store = SweepStore(args.out)
+    print(f"{len(points)} points, {len(store)} runs already in {args.out}")
+    run_sweep(
+        generator,
+        points,
+        store,
+        max_batch_size=args.max_batch_size,
+        callback=lambda done, total: print(f"{done}/{total}"),
+    )
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
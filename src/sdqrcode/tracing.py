@@ -0,0 +1,205 @@
+import collections
+import contextvars
+import json
+import threading
+import time
+
+# span of the code running now, spans opened inside it become its children
+_current = contextvars.ContextVar("sdqrcode_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "tracer", "parent", "attributes", "children", "start", "seconds", "_token")
+
+    def __init__(self, name: str, tracer: "Tracer", parent: "Span" = None, attributes: dict = None):
+        """A timed stage of a generation, with its attributes (sizes, peak memory, step durations, ...) and sub-stages"""
+        self.name = name
+        self.tracer = tracer
+        self.parent = parent
+        self.attributes = attributes or {}
+        self.children = []
+        self.start = None
+        self.seconds = None
+        if parent is not None:
+            parent.children.append(self)
+
+    def __enter__(self):
+        self._token = _current.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self.start
+        _current.reset(self._token)
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.tracer._finish(self)
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, name: str, seconds: float, **attributes) -> "Span":
+        """Record a sub-stage measured by other means (ex: from pipeline step callbacks)"""
+        span = Span(name, self.tracer, self, attributes)
+        span.seconds = seconds
+        self.tracer._finish(span)
+        return span
+
+    def find(self, name: str):
+        """First span with this name in this span and its sub-stages, None if there is none"""
+        if self.name == name:
+            return self
+        for child in self.children:
+            span = child.find(name)
+            if span is not None:
+                return span
+        return None
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "seconds": self.seconds,
+            "attributes": self.attributes,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+    def __bool__(self):
+        return True
+
+    def __repr__(self):
+        return f"Span({self.name!r}, seconds={self.seconds}, attributes={self.attributes}, children={len(self.children)})"
+
+
+class _NoopSpan:
+    """Returned when nothing is traced, instrumentation then costs a context variable lookup"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def set(self, **attributes):
+        pass
+
+    def add(self, name: str, seconds: float, **attributes):
+        return self
+
+    def __bool__(self):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str, **attributes):
+    """Context manager timing a stage of the traced generation running in this context, a no-op when none is"""
+    parent = _current.get()
+    if parent is None:
+        return _NOOP
+    return Span(name, parent.tracer, parent, attributes)
+
+
+def current_span():
+    return _current.get() or _NOOP
+
+
+def attach(parent):
+    """Context manager making a span (see current_span) the parent of the spans opened in another thread or task"""
+    return _Attach(parent)
+
+
+class _Attach:
+    def __init__(self, parent):
+        self.parent = parent if parent else None
+
+    def __enter__(self):
+        self._token = _current.set(self.parent)
+        return self.parent
+
+    def __exit__(self, *exc):
+        _current.reset(self._token)
+
+
+class Tracer:
+    def __init__(self, hooks: list = None, max_traces: int = 100):
+        """
+        Collects the spans of the generations, aggregated per stage name for the exporters.
+
+        Args:
+            hooks: functions called with each finished span (stages first, then the generation containing them)
+            max_traces: number of finished generations (root spans) kept in traces
+        """
+        self.hooks = list(hooks or [])
+        self.traces = collections.deque(maxlen=max_traces)
+        self._stages = {}
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    def span(self, name: str, **attributes) -> Span:
+        """Span of a stage, a new trace when nothing is traced in this context"""
+        return Span(name, self, _current.get(), attributes)
+
+    @property
+    def last_trace(self) -> Span:
+        return self.traces[-1] if self.traces else None
+
+    def _finish(self, span: Span):
+        with self._lock:
+            stage = self._stages.get(span.name)
+            if stage is None:
+                stage = self._stages[span.name] = {"count": 0, "seconds_sum": 0.0, "seconds_max": 0.0}
+            stage["count"] += 1
+            stage["seconds_sum"] += span.seconds
+            stage["seconds_max"] = max(stage["seconds_max"], span.seconds)
+            for key, value in span.attributes.items():
+                if key.endswith("_bytes") and isinstance(value, (int, float)):
+                    memory_key = (span.name, key)
+                    self._memory[memory_key] = max(self._memory.get(memory_key, 0), value)
+            if span.parent is None:
+                self.traces.append(span)
+        for hook in self.hooks:
+            hook(span)
+
+    def stats(self) -> dict:
+        """Per stage name: count, seconds_sum, seconds_max, seconds_mean, and the max of its memory attributes"""
+        with self._lock:
+            stats = {}
+            for name, stage in self._stages.items():
+                stats[name] = dict(stage, seconds_mean=stage["seconds_sum"] / stage["count"])
+            for (name, key), value in self._memory.items():
+                stats[name][key] = value
+            return stats
+
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+            self._memory = {}
+            self.traces.clear()
+
+    def to_json(self) -> str:
+        last_trace = self.last_trace
+        return json.dumps(
+            {"stages": self.stats(), "last_trace": last_trace.to_dict() if last_trace is not None else None},
+            default=str,
+        )
+
+    def prometheus_text(self, prefix: str = "sdqrcode") -> str:
+        """Stage durations and peak memory in the Prometheus text exposition format"""
+        stats = self.stats()
+        lines = [
+            f"# HELP {prefix}_stage_seconds Time spent in each generation stage",
+            f"# TYPE {prefix}_stage_seconds summary",
+        ]
+        for name, stage in stats.items():
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {stage["seconds_sum"]}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+        lines += [f"# TYPE {prefix}_stage_seconds_max gauge"]
+        for name, stage in stats.items():
+            lines.append(f'{prefix}_stage_seconds_max{{stage="{name}"}} {stage["seconds_max"]}')
+        lines += [f"# TYPE {prefix}_stage_memory_bytes gauge"]
+        for name, stage in stats.items():
+            for key, value in stage.items():
+                if key.endswith("_bytes"):
+                    lines.append(f'{prefix}_stage_memory_bytes{{stage="{name}",measure="{key[:-len("_bytes")]}"}} {value}')
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,53 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import PIL.Image
+
+import sdqrcode.sdqrcode as sdqrcode
+
+
+class GenerationWorkers:
+    def __init__(self, generator: "sdqrcode.Sdqrcode", concurrency: int = None, max_pending: int = None):
+        """
+        Worker threads running generate_sd_qrcode calls on one shared generator, for example from the request
+        threads of a web server. Each call gets its own config, the generator config is never changed.
+
+        Args:
+            generator: generator whose loaded models are shared by all the calls
+            concurrency: number of calls running at once (default: generator.engine.max_concurrency). A diffusers
+                engine runs one pipeline call at a time, a higher concurrency overlaps the qr code rendering and
+                image preparation of the next calls with the running one
+            max_pending: maximum number of calls queued or running, submit blocks beyond it (None for no limit)
+        """
+        self.generator = generator
+        self.concurrency = generator.engine.max_concurrency if concurrency is None else concurrency
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="sdqrcode-worker")
+        self._pending = threading.BoundedSemaphore(max_pending) if max_pending is not None else None
+
+    def submit(self, qr_img: PIL.Image.Image = None, **config_kwargs) -> Future:
+        """Queue a generate_sd_qrcode(qr_img, **config_kwargs) call, the future gives its images"""
+        if self._pending is not None:
+            self._pending.acquire()
+        try:
+            future = self._pool.submit(self.generator.generate_sd_qrcode, qr_img, **config_kwargs)
+        except BaseException:
+            if self._pending is not None:
+                self._pending.release()
+            raise
+        if self._pending is not None:
+            future.add_done_callback(lambda _: self._pending.release())
+        return future
+
+    def map(self, items: list[dict]) -> list[list[PIL.Image.Image]]:
+        """Run one call per dict of config params, results keep the order of items"""
+        futures = [self.submit(**item) for item in items]
+        return [future.result() for future in futures]
+
+    def close(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,147 @@
+import base64
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+
+class A1111Stub:
+    """
+    Local http server mimicking the Automatic1111 api endpoints used by the engines:
+    txt2img and img2img return batch_size images followed by one detect map per controlnet unit,
+    unless the request asks for no detect maps (old_controlnet: like a controlnet version that always sends them).
+    With noise, the images are noisy instead of plain, about the size of real generations once compressed.
+    """
+
+    def __init__(self, delay: float = 0.0, image_size: int = 64, old_controlnet: bool = False, noise: bool = False):
+        self.delay = delay
+        self.image_size = image_size
+        self.old_controlnet = old_controlnet
+        self.noise = noise
+        self._encoded = {}
+        self.requests = []
+        self.connections = 0
+        self.model = "model_a"
+        self.switches = 0
+        # start time and steps of the generation running, for the progress endpoint
+        self.running = None
+        self.lock = threading.Lock()
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with stub.lock:
+                    stub.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                self.handle_request(None)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                self.handle_request(json.loads(self.rfile.read(length) or b"{}"))
+
+            def handle_request(self, payload):
+                with stub.lock:
+                    stub.requests.append((self.command, self.path, payload))
+                status, body = stub.route(self.command, self.path, payload)
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def hostname(self) -> str:
+        return f"127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def generation_requests(self) -> list:
+        return [r for r in self.requests if r[1].endswith("/txt2img") or r[1].endswith("/img2img")]
+
+    def route(self, command, path, payload):
+        path = path.split("?")[0]
+        if path == "/sdapi/v1/options":
+            if command == "POST":
+                self.set_model(payload["sd_model_checkpoint"])
+                return 200, None
+            return 200, {"sd_model_checkpoint": self.model}
+        if path == "/sdapi/v1/sd-models":
+            return 200, [{"title": "model_a", "model_name": "model_a"}, {"title": "model_b", "model_name": "model_b"}]
+        if path == "/sdapi/v1/scripts":
+            return 200, {"txt2img": ["controlnet m2m"], "img2img": ["controlnet m2m"]}
+        if path in ("/sdapi/v1/txt2img", "/sdapi/v1/img2img"):
+            if "sd_model_checkpoint" in (payload.get("override_settings") or {}):
+                self.set_model(payload["override_settings"]["sd_model_checkpoint"])
+            with self.lock:
+                self.running = (time.perf_counter(), payload.get("steps", 20))
+            time.sleep(self.delay)
+            with self.lock:
+                self.running = None
+            units = payload.get("alwayson_scripts", {}).get("ControlNet", {}).get("args", [])
+            no_detectmap = (payload.get("override_settings") or {}).get("control_net_no_detectmap", False)
+            images = [self.encode_image((255, 0, 0)) for _ in range(payload.get("batch_size", 1))]
+            if self.old_controlnet:
+                n_maps = len(units)
+            else:
+                n_maps = 0 if no_detectmap else sum(unit.get("save_detected_map", True) for unit in units)
+            images += [self.encode_image((0, 0, 255)) for _ in range(n_maps)]
+            info = json.dumps({"seed": payload.get("seed"), "sd_model": self.model})
+            return 200, {"images": images, "parameters": {}, "info": info}
+        if path == "/sdapi/v1/progress":
+            return 200, self.progress()
+        return 404, {"detail": "Not Found"}
+
+    def progress(self) -> dict:
+        """The live preview is green, and changes every step"""
+        with self.lock:
+            running = self.running
+        if running is None:
+            return {"progress": 0.0, "state": {"sampling_step": 0, "sampling_steps": 0}, "current_image": None}
+        start, steps = running
+        progress = min(1.0, (time.perf_counter() - start) / self.delay) if self.delay else 1.0
+        return {
+            "progress": progress,
+            "state": {"sampling_step": int(progress * steps), "sampling_steps": steps},
+            "current_image": self.encode_image((0, 255, 0)),
+        }
+
+    def set_model(self, model):
+        with self.lock:
+            if model != self.model:
+                self.switches += 1
+                self.model = model
+
+    def encode_image(self, color) -> str:
+        if color not in self._encoded:
+            image = np.full((self.image_size, self.image_size, 3), color, dtype=np.uint8)
+            if self.noise:
+                rng = np.random.default_rng(sum(color))
+                noise = rng.integers(-32, 33, image.shape)
+                image = np.clip(image.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+            buffer = BytesIO()
+            Image.fromarray(image).save(buffer, format="PNG")
+            self._encoded[color] = base64.b64encode(buffer.getvalue()).decode()
+        return self._encoded[color]
@@ -0,0 +1,131 @@
+import base64
+import unittest
+
+import sys
+from io import BytesIO
+
+import numpy as np
+import PIL.Image
+
+sys.path.append("./src/")
+sys.path.append("./tests/")
+import sdqrcode.sdqrcode as sdqrcode
+from sdqrcode.Engines import auto_payload
+from a1111_stub import A1111Stub
+
+
+class TestAutoPayload(unittest.TestCase):
+    def setUp(self):
+        self.qr_img = sdqrcode.generate_qrcode_img(text="https://koll.ai")
+
+    def test_image_shared_by_units_is_encoded_once(self):
+        cache = auto_payload.ImagePayloadCache()
+        config = sdqrcode.get_config("default_auto")
+
+        endpoint, payload = auto_payload.build_payload(config, None, [self.qr_img, self.qr_img], cache)
+
+        units = payload["alwayson_scripts"]["ControlNet"]["args"]
+        self.assertEqual(endpoint, "txt2img")
+        self.assertEqual(units[0]["image"], units[1]["image"])
+        self.assertEqual(cache.misses, 1)
+
+    def test_img2img_units_fall_back_on_input_image(self):
+        cache = auto_payload.ImagePayloadCache()
+        config = sdqrcode.get_config("img2img_tile_auto")
+
+        endpoint, payload = auto_payload.build_payload(config, self.qr_img, [self.qr_img], cache)
+
+        self.assertEqual(endpoint, "img2img")
+        self.assertEqual(len(payload["init_images"]), 1)
+        self.assertEqual(payload["alwayson_scripts"]["ControlNet"]["args"][0]["image"], "")
+        self.assertEqual(cache.misses, 1)
+
+    def test_equal_images_hit_the_cache(self):
+        cache = auto_payload.ImagePayloadCache()
+
+        first = cache.encode(self.qr_img)
+        second = cache.encode(self.qr_img.copy())
+
+        self.assertEqual(first, second)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_compress_level(self):
+        fast = auto_payload.ImagePayloadCache(compress_level=0).encode(self.qr_img)
+        small = auto_payload.ImagePayloadCache(compress_level=9).encode(self.qr_img)
+
+        self.assertGreater(len(fast), len(small))
+
+
+class TestAutomaticEngine(unittest.TestCase):
+    def setUp(self):
+        self.stub = A1111Stub().start()
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def test_generate_sd_qrcode(self):
+        host, port = self.stub.hostname.split(":")
+        generator = sdqrcode.init(config="default_auto", auto_api_hostname=host, auto_api_port=int(port))
+
+        images = generator.generate_sd_qrcode()
+
+        self.assertEqual(len(images), 1)
+        payload = self.stub.generation_requests()[0][2]
+        self.assertEqual(len(payload["alwayson_scripts"]["ControlNet"]["args"]), 2)
+
+    def test_detect_maps_only_when_asked(self):
+        old_stub = A1111Stub(old_controlnet=True).start()
+        try:
+            for stub in (self.stub, old_stub):
+                host, port = stub.hostname.split(":")
+                generator = sdqrcode.init(config="default_auto", auto_api_hostname=host, auto_api_port=int(port))
+                config = generator.request_config(batch_size=2)
+                _, cn_images = generator._prepare_images(config, None)
+
+                images = generator.engine.generate_sd_qrcode(None, cn_images, config=config)
+                self.assertEqual([image.convert("RGB").getpixel((0, 0)) for image in images], [(255, 0, 0)] * 2)
+                payload = stub.generation_requests()[-1][2]
+                self.assertTrue(payload["override_settings"]["control_net_no_detectmap"])
+                self.assertFalse(payload["alwayson_scripts"]["ControlNet"]["args"][0]["save_detected_map"])
+
+                images = generator.engine.generate_sd_qrcode(None, cn_images, return_cn_imgs=True, config=config)
+                colors = [image.convert("RGB").getpixel((0, 0)) for image in images]
+                self.assertEqual(colors, [(255, 0, 0)] * 2 + [(0, 0, 255)] * 2)
+        finally:
+            old_stub.stop()
+
+    def test_return_cn_imgs_from_the_generator(self):
+        host, port = self.stub.hostname.split(":")
+        generator = sdqrcode.init(config="default_auto", auto_api_hostname=host, auto_api_port=int(port))
+
+        images = generator.generate_sd_qrcode(batch_size=2, return_cn_imgs=True)
+
+        colors = [image.convert("RGB").getpixel((0, 0)) for image in images]
+        self.assertEqual(colors, [(255, 0, 0)] * 2 + [(0, 0, 255)] * 2)
+        payload = self.stub.generation_requests()[-1][2]
+        self.assertFalse(payload["override_settings"]["control_net_no_detectmap"])
+        self.assertEqual(len(generator.generate_sd_qrcode(batch_size=2)), 2)
+
+    def test_output_types_from_the_response(self):
+        host, port = self.stub.hostname.split(":")
+        generator = sdqrcode.init(config="default_auto", auto_api_hostname=host, auto_api_port=int(port))
+
+        encoded = generator.generate_sd_qrcode(batch_size=2, output_type="png")
+        arrays = generator.generate_sd_qrcode(batch_size=2, output_type="np")
+
+        # the png sent by the server, as is
+        self.assertEqual(encoded[0], base64.b64decode(self.stub.encode_image((255, 0, 0))))
+        self.assertEqual(len(arrays), 2)
+        for data, array in zip(encoded, arrays):
+            np.testing.assert_array_equal(np.asarray(PIL.Image.open(BytesIO(data)).convert("RGB")), array)
+        self.assertEqual(arrays[0].shape, (self.stub.image_size, self.stub.image_size, 3))
+
+    def test_non_png_responses_are_reencoded(self):
+        jpeg = BytesIO()
+        PIL.Image.new("RGB", (8, 8), (255, 0, 0)).save(jpeg, format="JPEG")
+        encoded = auto_payload.decode_images([base64.b64encode(jpeg.getvalue()).decode()], output_type="png")
+        self.assertTrue(encoded[0].startswith(auto_payload.PNG_SIGNATURE))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+import sys
+
+import numpy as np
+
+sys.path.append("./src/")
+sys.path.append("./tests/")
+
+try:
+    import torch
+    import diffusers
+except ImportError:
+    torch = None
+
+
+@unittest.skipIf(torch is None, "diffusers is not installed")
+class TestSharedPrefixBranching(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from sdqrcode.sdqrcode import Sdqrcode
+        from tiny_models import get_tiny_config
+
+        config = get_tiny_config("txt2img", n_units=2, device="cpu")
+        config["global"]["steps"] = 10
+        config["controlnet_units"]["unit_1"]["start"] = 0.4
+        cls.generator = Sdqrcode(config)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.generator.release()
+
+    def assert_same_as_unbranched(self, variants, **config_kwargs):
+        results = self.generator.generate_sd_qrcode_variants(variants, **config_kwargs)
+        steps_run = self.generator.engine.last_stats["denoising_steps"]
+
+        for variant, images in zip(variants, results):
+            expected = self.generator.generate_sd_qrcode(**config_kwargs, **variant)
+            self.assertEqual(len(images), len(expected))
+            for image, expected_image in zip(images, expected):
+                diff = np.abs(np.asarray(image, dtype=int) - np.asarray(expected_image, dtype=int))
+                self.assertLessEqual(diff.max(), 1)
+        return steps_run
+
+    def test_weights_of_a_late_unit(self):
+        # unit_1 starts at step 4 of 10: 4 shared steps, then 6 steps per variant
+        variants = [{"controlnet_weights": [0.5, w]} for w in (0.2, 0.5, 0.8)]
+        steps_run = self.assert_same_as_unbranched(variants, seed=1, scheduler_name="DDIM")
+        self.assertEqual(steps_run, 4 + 3 * 6)
+
+    def test_ancestral_scheduler_and_batch(self):
+        variants = [
+            {"controlnet_startstops": [(0.0, 1.0), (0.4, 1.0)]},
+            {"controlnet_startstops": [(0.0, 1.0), (0.4, 0.7)]},
+        ]
+        # the variants differ from step 7 on
+        steps_run = self.assert_same_as_unbranched(variants, seed=2, scheduler_name="Euler a", batch_size=2)
+        self.assertEqual(steps_run, 7 + 2 * 3)
+
+    def test_only_controlnet_params(self):
+        with self.assertRaises(ValueError):
+            self.generator.generate_sd_qrcode_variants([{"prompt": "a cat"}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+import asyncio
+import importlib.util
+
+import sys
+
+sys.path.append("./src/")
+sys.path.append("./tests/")
+import sdqrcode.sdqrcode as sdqrcode
+from sdqrcode.job_queue import CheckpointJobQueue
+from a1111_stub import A1111Stub
+
+
+class TestAutomaticEngineSetModel(unittest.TestCase):
+    def setUp(self):
+        self.stub = A1111Stub().start()
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def test_no_op_switches_are_skipped(self):
+        from sdqrcode.Engines.AutoEngine import AutomaticEngine
+
+        host, port = self.stub.hostname.split(":")
+        engine = AutomaticEngine(sdqrcode.get_config("default_auto"), hostname=host, port=int(port))
+
+        for model in ["model_a", "model_a", "model_b", "model_b"]:
+            engine.set_model(model)
+
+        switches = [r for r in self.stub.requests if r[:2] == ("POST", "/sdapi/v1/options")]
+        self.assertEqual(len(switches), 1)
+        self.assertEqual(self.stub.model, "model_b")
+
+
+@unittest.skipUnless(importlib.util.find_spec("aiohttp"), "aiohttp is not installed")
+class TestCheckpointJobQueue(unittest.TestCase):
+    def setUp(self):
+        self.stubs = [A1111Stub(delay=0.05).start(), A1111Stub(delay=0.05).start()]
+        hostnames = [stub.hostname for stub in self.stubs]
+        self.generator = sdqrcode.init(config="default_auto", auto_api_hostname=hostnames)
+        self.generator_tile = sdqrcode.init(config="img2img_tile_auto", auto_api_hostname=hostnames)
+
+    def tearDown(self):
+        self.generator.release()
+        self.generator_tile.release()
+        for stub in self.stubs:
+            stub.stop()
+
+    def test_jobs_are_grouped_by_checkpoint(self):
+        queue = CheckpointJobQueue()
+        for i in range(4):
+            model = ["model_a", "model_b"][i % 2]
+            generator = [self.generator, self.generator_tile][i % 2]
+            queue.submit(generator, model_name_or_path=model, seed=i)
+
+        self.assertEqual(queue.groups(), [[0, 2], [1, 3]])
+
+        results = asyncio.run(queue.arun())
+
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(len(images) == 1 for images in results))
+        # each server loads model_b once, model_a being already loaded
+        self.assertEqual(sum(stub.switches for stub in self.stubs), 2)
+        for stub in self.stubs:
+            models = [r[2]["override_settings"]["sd_model_checkpoint"] for r in stub.generation_requests()]
+            self.assertEqual(models, ["model_a", "model_b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+import dataclasses
+import os
+import shutil
+import tempfile
+import unittest
+
+import sys
+
+sys.path.append("./src/")
+import sdqrcode.sdqrcode as sdqrcode
+from sdqrcode.config import Config, load_config
+
+
+class TestConfig(unittest.TestCase):
+    def test_all_configs_load(self):
+        for name in sdqrcode.CONFIGS:
+            config = load_config(name)
+            self.assertEqual(config.to_dict(), sdqrcode.get_config(name))
+
+    def test_reads_like_a_dict(self):
+        config = load_config("default_diffusers")
+        self.assertEqual(config["global"]["steps"], 20)
+        self.assertEqual(config["controlnet_units"]["tile"]["weight"], 0.5)
+        self.assertEqual(config["qrcode"]["error_correction"], "high")
+        self.assertIsNone(config["global"].get("denoising_strength"))
+        self.assertNotIn("denoising_strength", config["global"])
+        self.assertEqual(list(config["controlnet_units"]), ["brightness", "tile"])
+
+    def test_immutable(self):
+        config = load_config("default_diffusers")
+        with self.assertRaises(dataclasses.FrozenInstanceError):
+            config["global"].steps = 30
+        with self.assertRaises(TypeError):
+            config["controlnet_units"]["tile"] = None
+        with self.assertRaises(TypeError):
+            config["global"]["steps"] = 30
+
+    def test_load_is_memoized_until_modified(self):
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, "config.yaml")
+        shutil.copy(sdqrcode.CONFIGS["default_auto"], path)
+
+        config = load_config(path)
+        self.assertIs(load_config(path), config)
+
+        with open(path, "a") as f:
+            f.write("\n")
+        os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+        self.assertIsNot(load_config(path), config)
+        self.assertEqual(load_config(path), config)
+
+    def test_get_config_returns_a_copy(self):
+        config = sdqrcode.get_config("default_auto")
+        config["global"]["steps"] = 1
+        self.assertNotEqual(sdqrcode.get_config("default_auto")["global"]["steps"], 1)
+
+    def test_with_overrides_shares_unchanged_sections(self):
+        config = load_config("default_diffusers")
+        new_config = config.with_overrides(seed=3, qrcode_text="hello")
+        self.assertEqual(new_config["global"]["seed"], 3)
+        self.assertEqual(new_config["qrcode"]["text"], "hello")
+        self.assertIs(new_config["controlnet_units"], config["controlnet_units"])
+        self.assertEqual(config["global"]["seed"], -1)
+        self.assertIs(config.with_overrides(), config)
+
+        new_config = config.with_overrides(controlnet_weights=[0.1, 0.2])
+        self.assertIs(new_config["global"], config["global"])
+        self.assertEqual([unit["weight"] for unit in new_config["controlnet_units"].values()], [0.1, 0.2])
+
+    def test_with_overrides_matches_update_config_dict(self):
+        overrides = dict(
+            prompt="a cat",
+            steps=12,
+            controlnet_weights=[0.1, 0.2],
+            controlnet_startstops=[(0.0, 0.5), (0.2, 1.0)],
+            qrcode_border=2,
+        )
+        config = load_config("default_diffusers").with_overrides(**overrides)
+        config_dict = sdqrcode.update_config_dict(sdqrcode.get_config("default_diffusers"), **overrides)
+        self.assertEqual(config.to_dict(), config_dict)
+
+    def test_controlnet_model_names_without_weights(self):
+        config = load_config("default_diffusers").with_overrides(controlnet_model_names=["a", "b", "c"])
+        units = list(config["controlnet_units"].values())
+        self.assertEqual([unit["model"] for unit in units], ["a", "b", "c"])
+        # the replaced units keep their params, the new one gets defaults
+        self.assertEqual([unit["weight"] for unit in units], [0.35, 0.5, 1.0])
+        self.assertEqual((units[2]["start"], units[2]["end"]), (0.0, 1.0))
+
+        config_dict = sdqrcode.update_config_dict(
+            sdqrcode.get_config("default_diffusers"), controlnet_model_names=["a", "b", "c"]
+        )
+        self.assertEqual(config.to_dict(), config_dict)
+
+    def test_validation(self):
+        config_dict = sdqrcode.get_config("default_diffusers")
+        config_dict["global"]["steps"] = 0
+        with self.assertRaises(ValueError):
+            Config.from_dict(config_dict)
+
+        config_dict = sdqrcode.get_config("default_diffusers")
+        del config_dict["qrcode"]["text"]
+        with self.assertRaises(ValueError):
+            Config.from_dict(config_dict)
+
+        config = load_config("default_diffusers")
+        with self.assertRaises(ValueError):
+            config.with_overrides(qrcode_error_correction="quart")
+        with self.assertRaises(ValueError):
+            config.with_overrides(controlnet_startstops=[(0.5, 0.2), (0.0, 1.0)])
+        with self.assertRaises(ValueError):
+            config.with_overrides(controlnet_weights=[0.5])
+        with self.assertRaises(ValueError):
+            config.with_overrides(mode="img2img")
+        with self.assertRaises(TypeError):
+            config.with_overrides(stpes=20)
+
+    def test_request_config_reuses_the_validated_base(self):
+        # no server is contacted before the first generation
+        generator = sdqrcode.Sdqrcode("default_auto", auto_api_hostname=["127.0.0.1:1"])
+        base = generator.base_config()
+        self.assertIs(generator.base_config(), base)
+        self.assertIs(generator.request_config(seed=3)["qrcode"], base["qrcode"])
+
+        # changed in place
+        generator.config["global"]["steps"] = 33
+        self.assertEqual(generator.request_config()["global"]["steps"], 33)
+        generator.config["global"]["steps"] = 0
+        with self.assertRaises(ValueError):
+            generator.request_config()
+
+        # replaced
+        generator.config = sdqrcode.get_config("img2img_tile_auto")
+        self.assertEqual(generator.request_config()["global"]["mode"], "img2img")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+import sys
+
+sys.path.append("./src/")
+sys.path.append("./tests/")
+
+try:
+    import torch
+    import diffusers
+except ImportError:
+    torch = None
+
+
+@unittest.skipIf(torch is None, "diffusers is not installed")
+class TestDeviceConfig(unittest.TestCase):
+    def test_defaults(self):
+        from sdqrcode.Engines.device_policy import get_device_config
+
+        device_config = get_device_config({"device": "cpu"})
+        self.assertEqual(device_config["name"], "cpu")
+        self.assertEqual(device_config["offload"], "none")
+        # xformers needs cuda, torch 2 attention is used on cpu
+        self.assertEqual(device_config["attention"], "sdpa")
+
+        # configs without a device section run wherever cuda is available
+        self.assertEqual(get_device_config({})["name"], "cuda" if torch.cuda.is_available() else "cpu")
+
+    def test_invalid_settings(self):
+        from sdqrcode.Engines.device_policy import get_device_config
+
+        with self.assertRaises(ValueError):
+            get_device_config({"device": {"name": "cpu", "offload": "model"}})
+        with self.assertRaises(ValueError):
+            get_device_config({"device": {"name": "cpu", "attention": "xformers"}})
+        with self.assertRaises(ValueError):
+            get_device_config({"device": {"name": "cpu", "offload": "disk"}})
+        with self.assertRaises(ValueError):
+            get_device_config({"device": {"name": "cpu", "slicing": True}})
+
+
+@unittest.skipIf(torch is None, "diffusers is not installed")
+class TestDiffusersEngineOnCpu(unittest.TestCase):
+    def test_generate_on_cpu(self):
+        from sdqrcode.sdqrcode import Sdqrcode
+        from tiny_models import get_tiny_config
+
+        config = get_tiny_config(
+            "txt2img", n_units=2, device={"name": "cpu", "attention": "default", "attention_slicing": True, "vae_slicing": True}
+        )
+        sd_qr_code = Sdqrcode(config)
+        try:
+            images = sd_qr_code.generate_sd_qrcode()
+            self.assertEqual(images[0].size, (64, 64))
+
+            stats = sd_qr_code.engine.last_stats
+            self.assertEqual(stats["name"], "cpu")
+            self.assertEqual(stats["attention"], "default")
+            self.assertTrue(stats["attention_slicing"] and stats["vae_slicing"])
+            self.assertIsNone(stats["peak_device_bytes"])
+            self.assertGreater(stats["peak_rss_bytes"], 0)
+            self.assertGreater(stats["seconds"], 0)
+
+            # the img2img pipeline is built with the same device settings
+            images = sd_qr_code.generate_sd_qrcode(mode="img2img")
+            self.assertEqual(images[0].size, (64, 64))
+            self.assertEqual(sd_qr_code.engine.pipeline.device.type, "cpu")
+        finally:
+            sd_qr_code.release()
+
+    def test_engines_with_other_attention_settings_get_their_own_models(self):
+        from sdqrcode.sdqrcode import Sdqrcode
+        from tiny_models import get_tiny_config
+
+        sliced = Sdqrcode(get_tiny_config(device={"name": "cpu", "attention": "default", "attention_slicing": True}))
+        same = Sdqrcode(get_tiny_config(device={"name": "cpu", "attention": "default", "attention_slicing": True}))
+        sdpa = Sdqrcode(get_tiny_config(device={"name": "cpu", "attention": "sdpa"}))
+        try:
+            self.assertIs(sliced.engine.components["unet"], same.engine.components["unet"])
+            self.assertIsNot(sliced.engine.components["unet"], sdpa.engine.components["unet"])
+            self.assertIsNot(sliced.engine.controlnet_units[0], sdpa.engine.controlnet_units[0])
+            # the processors of the first engine are left as it set them
+            processors = set(type(p).__name__ for p in sliced.engine.components["unet"].attn_processors.values())
+            self.assertNotIn("AttnProcessor2_0", processors)
+        finally:
+            for generator in (sliced, same, sdpa):
+                generator.release()
+
+
+if __name__ == "__main__":
+    unittest.main()
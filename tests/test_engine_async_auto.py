@@ -0,0 +1,93 @@
+import unittest
+import asyncio
+import importlib.util
+
+import sys
+
+sys.path.append("./src/")
+sys.path.append("./tests/")
+import sdqrcode.sdqrcode as sdqrcode
+from a1111_stub import A1111Stub
+
+
+@unittest.skipUnless(importlib.util.find_spec("aiohttp"), "aiohttp is not installed")
+class TestEngineAsyncAuto(unittest.TestCase):
+    def setUp(self):
+        self.stubs = [A1111Stub(delay=0.2).start(), A1111Stub(delay=0.2).start()]
+        self.generator = sdqrcode.init(
+            config="default_auto",
+            auto_api_hostname=[stub.hostname for stub in self.stubs],
+        )
+
+    def tearDown(self):
+        self.generator.release()
+        for stub in self.stubs:
+            stub.stop()
+
+    def test_concurrent_generations_are_balanced(self):
+        async def generate_all():
+            return await asyncio.gather(
+                *[self.generator.agenerate_sd_qrcode(seed=seed) for seed in range(4)]
+            )
+
+        results = asyncio.run(generate_all())
+
+        self.assertEqual(len(results), 4)
+        for images in results:
+            self.assertEqual(len(images), 1)
+            self.assertEqual(images[0].convert("RGB").getpixel((0, 0)), (255, 0, 0))
+        for stub in self.stubs:
+            self.assertEqual(len(stub.generation_requests()), 2)
+
+    def test_blocking_calls_reuse_connections(self):
+        for _ in range(3):
+            images = self.generator.generate_sd_qrcode()
+            self.assertEqual(len(images), 1)
+
+        for stub in self.stubs:
+            self.assertLessEqual(stub.connections, 1)
+
+    def test_event_loops_share_the_connections(self):
+        engine = self.generator.engine
+        for _ in range(3):
+            asyncio.run(self.generator.agenerate_sd_qrcode())
+
+        for stub in self.stubs:
+            self.assertLessEqual(stub.connections, 1)
+        session, loop = engine._session, engine._loop
+        self.generator.release()
+        self.assertTrue(session.closed)
+        self.assertTrue(loop.is_closed())
+        # a released engine starts again on the next call
+        self.assertEqual(len(self.generator.generate_sd_qrcode()), 1)
+
+    def test_img2img(self):
+        generator = sdqrcode.init(
+            config="img2img_tile_auto",
+            auto_api_hostname=[stub.hostname for stub in self.stubs],
+        )
+        images = generator.generate_sd_qrcode()
+        generator.release()
+
+        requests = self.stubs[0].generation_requests() + self.stubs[1].generation_requests()
+        self.assertEqual(requests[0][1], "/sdapi/v1/img2img")
+        self.assertEqual(len(requests[0][2]["init_images"]), 1)
+        self.assertEqual(len(images), 1)
+
+    def test_detect_maps_are_dropped_before_decoding(self):
+        stub = A1111Stub(old_controlnet=True).start()
+        generator = sdqrcode.init(config="default_auto", auto_api_hostname=[stub.hostname])
+        try:
+            arrays = generator.generate_sd_qrcode(batch_size=2, output_type="np")
+        finally:
+            generator.release()
+            stub.stop()
+
+        self.assertEqual([tuple(array[0, 0]) for array in arrays], [(255, 0, 0)] * 2)
+        payload = stub.generation_requests()[0][2]
+        self.assertEqual(payload["override_settings"]["sd_model_checkpoint"], generator.config["global"]["model_name_or_path"])
+        self.assertTrue(payload["override_settings"]["control_net_no_detectmap"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+import sys
+
+import numpy as np
+
+sys.path.append("./src/")
+sys.path.append("./tests/")
+
+try:
+    import torch
+    import diffusers
+except ImportError:
+    torch = None
+
+
+@unittest.skipIf(torch is None, "diffusers is not installed")
+class TestGatedControlNet(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from sdqrcode.sdqrcode import Sdqrcode
+        from tiny_models import get_tiny_config
+
+        config = get_tiny_config("txt2img", n_units=2, device="cpu")
+        config["global"]["steps"] = 10
+        config["controlnet_units"]["unit_1"]["start"] = 0.4
+        cls.generator = Sdqrcode(config)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.generator.release()
+
+    def ungated_images(self, weights, seed):
+        from diffusers import StableDiffusionControlNetPipeline
+        from sdqrcode.Engines.DiffusersEngine import build_pipeline
+
+        engine = self.generator.engine
+        # plain diffusers multi controlnet around the same models
+        pipeline = build_pipeline(StableDiffusionControlNetPipeline, engine.components, engine.controlnet_units)
+        pipeline.scheduler = engine.pipeline.scheduler
+        return pipeline(
+            prompt="a dog",
+            negative_prompt="",
+            image=self.generator._prepare_images(self.generator.config)[1],
+            width=64,
+            height=64,
+            num_inference_steps=10,
+            guidance_scale=7,
+            controlnet_conditioning_scale=weights,
+            control_guidance_start=[0.0, 0.4],
+            control_guidance_end=[1.0, 1.0],
+            generator=torch.Generator().manual_seed(seed),
+        ).images
+
+    def test_same_images_as_ungated(self):
+        for weights in ([0.5, 0.5], [0.0, 0.5]):
+            images = self.generator.generate_sd_qrcode(seed=1, controlnet_weights=weights)
+            expected = self.ungated_images(weights, seed=1)
+            np.testing.assert_array_equal(np.asarray(images[0]), np.asarray(expected[0]))
+
+    def test_inactive_units_are_skipped(self):
+        self.generator.generate_sd_qrcode(seed=1)
+        stats = self.generator.engine.last_stats
+        # unit_1 starts at step 4 of 10
+        self.assertEqual(stats["controlnet_active_steps"], [(True, False)] * 4 + [(True, True)] * 6)
+        self.assertEqual((stats["controlnet_evaluated"], stats["controlnet_skipped"]), (16, 4))
+
+        # a weight of 0 never runs its controlnet
+        self.generator.generate_sd_qrcode(seed=1, controlnet_weights=[0.0, 0.5])
+        stats = self.generator.engine.last_stats
+        self.assertEqual((stats["controlnet_evaluated"], stats["controlnet_skipped"]), (6, 14))
+
+
+if __name__ == "__main__":
+    unittest.main()
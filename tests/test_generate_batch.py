@@ -0,0 +1,64 @@
+import unittest
+import copy
+
+import sys
+
+import numpy as np
+
+sys.path.append("./src/")
+sys.path.append("./tests/")
+import sdqrcode.sdqrcode as sdqrcode
+
+try:
+    import torch
+    import diffusers
+except ImportError:
+    torch = None
+
+
+class TestBatchKey(unittest.TestCase):
+    def setUp(self):
+        self.config = sdqrcode.get_config("default_diffusers")
+
+    def test_items_differing_by_text_prompt_seed_share_key(self):
+        other = sdqrcode.update_config_dict(
+            copy.deepcopy(self.config), qrcode_text="https://github.com", prompt="a cat", seed=42
+        )
+
+        self.assertEqual(sdqrcode.get_batch_key(self.config), sdqrcode.get_batch_key(other))
+
+    def test_items_differing_by_shape_have_different_keys(self):
+        other = sdqrcode.update_config_dict(copy.deepcopy(self.config), steps=30)
+        self.assertNotEqual(sdqrcode.get_batch_key(self.config), sdqrcode.get_batch_key(other))
+
+        other = sdqrcode.update_config_dict(copy.deepcopy(self.config), controlnet_weights=[0.1, 0.2])
+        self.assertNotEqual(sdqrcode.get_batch_key(self.config), sdqrcode.get_batch_key(other))
+
+        other = sdqrcode.update_config_dict(copy.deepcopy(self.config), model_name_or_path="other/model")
+        self.assertNotEqual(sdqrcode.get_batch_key(self.config), sdqrcode.get_batch_key(other))
+
+
+@unittest.skipIf(torch is None, "diffusers is not installed")
+class TestBatchReproducibility(unittest.TestCase):
+    def test_items_are_reproducible_from_their_seed(self):
+        from tiny_models import get_tiny_config
+
+        generator = sdqrcode.Sdqrcode(get_tiny_config("txt2img", n_units=2, device="cpu"))
+        try:
+            items = [{"seed": 5, "prompt": "a dog", "batch_size": 2}, {"seed": 9, "prompt": "a cat", "batch_size": 2}]
+            results = generator.generate_sd_qrcode_batch(items, max_batch_size=4)
+
+            for item, images in zip(items, results):
+                expected = generator.generate_sd_qrcode(**item)
+                for image, expected_image in zip(images, expected):
+                    np.testing.assert_array_equal(np.asarray(image), np.asarray(expected_image))
+                # image i is the image of seed + i
+                for i, image in enumerate(images):
+                    alone = generator.generate_sd_qrcode(seed=item["seed"] + i, prompt=item["prompt"])[0]
+                    np.testing.assert_allclose(np.asarray(image, dtype=np.int16), np.asarray(alone, dtype=np.int16), atol=1)
+        finally:
+            generator.release()
+
+
+if __name__ == "__main__":
+    unittest.main()
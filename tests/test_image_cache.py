@@ -0,0 +1,187 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import unittest
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+import PIL.Image
+
+sys.path.append("./src/")
+sys.path.append("./tests/")
+import sdqrcode.sdqrcode as sdqrcode
+import sdqrcode.image_cache as image_cache
+from sdqrcode.image_cache import ImageCache
+
+
+def png_bytes(color: str, size: int = 16) -> bytes:
+    buffer = BytesIO()
+    PIL.Image.new("RGB", (size, size), color).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+class ImageServer:
+    def __init__(self, delay: float = 0.0):
+        """Serves png images with an ETag, answering 304 to matching If-None-Match, and records the requests"""
+        self.images = {}
+        self.cache_control = {}
+        self.requests = []
+        self.delay = delay
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                time.sleep(server.delay)
+                data = server.images.get(self.path)
+                if data is None:
+                    status = 404
+                else:
+                    etag = '"' + hashlib.md5(data).hexdigest() + '"'
+                    status = 304 if self.headers.get("If-None-Match") == etag else 200
+                with server._lock:
+                    server.requests.append((self.path, status))
+                self.send_response(status)
+                if data is not None:
+                    self.send_header("ETag", etag)
+                if self.path in server.cache_control:
+                    self.send_header("Cache-Control", server.cache_control[self.path])
+                body = data if status == 200 else b""
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def statuses(self, path: str) -> list[int]:
+        with self._lock:
+            return [status for p, status in self.requests if p == path]
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestImageCache(unittest.TestCase):
+    def setUp(self):
+        self.server = ImageServer()
+        self.server.images["/style.png"] = png_bytes("red")
+        self.url = f"{self.server.url}/style.png"
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = ImageCache(cache_dir=self.cache_dir)
+
+    def tearDown(self):
+        self.cache.close()
+        self.server.stop()
+
+    def test_revalidation(self):
+        for _ in range(3):
+            self.assertEqual(self.cache.read(self.url).convert("RGB").getpixel((0, 0)), (255, 0, 0))
+        self.assertEqual(self.server.statuses("/style.png"), [200, 304, 304])
+        self.assertEqual((self.cache.downloads, self.cache.revalidations), (1, 2))
+
+        # the new content is downloaded once it changes
+        self.server.images["/style.png"] = png_bytes("blue")
+        self.assertEqual(self.cache.read(self.url).convert("RGB").getpixel((0, 0)), (0, 0, 255))
+        self.assertEqual(self.server.statuses("/style.png")[-1], 200)
+
+    def test_max_age(self):
+        self.server.cache_control["/style.png"] = "max-age=60"
+        for _ in range(3):
+            self.cache.read(self.url)
+        self.assertEqual(self.server.statuses("/style.png"), [200])
+        self.assertEqual(self.cache.hits, 2)
+
+    def test_disk_cache(self):
+        self.cache.read(self.url)
+        # a new process only revalidates the image downloaded by the previous one
+        cache = ImageCache(cache_dir=self.cache_dir)
+        cache.read(self.url).load()
+        self.assertEqual(self.server.statuses("/style.png"), [200, 304])
+        self.assertEqual(cache.disk_hits, 1)
+        cache.close()
+
+    def test_eviction(self):
+        paths = [f"/{i}.png" for i in range(4)]
+        for i, path in enumerate(paths):
+            # uncompressed, all the images have the same size
+            buffer = BytesIO()
+            PIL.Image.new("RGB", (64, 64), (i, 0, 0)).save(buffer, format="BMP")
+            self.server.images[path] = buffer.getvalue()
+        size = len(self.server.images[paths[0]])
+        cache = ImageCache(max_memory_bytes=2 * size, cache_dir=self.cache_dir, max_disk_bytes=3 * size)
+        for path in paths:
+            cache.read(self.server.url + path)
+        self.assertLessEqual(cache.memory_usage, 2 * size)
+        self.assertEqual(len(os.listdir(os.path.join(self.cache_dir, "objects"))), 3)
+
+        # evicted from memory and disk: downloaded again
+        cache.read(self.server.url + paths[0])
+        self.assertEqual(self.server.statuses(paths[0]), [200, 200])
+        # still on disk: revalidated
+        cache.read(self.server.url + paths[2])
+        self.assertEqual(self.server.statuses(paths[2]), [200, 304])
+        cache.close()
+
+    def test_concurrent_fetches(self):
+        self.server.delay = 0.2
+        for i in range(4):
+            self.server.images[f"/{i}.png"] = png_bytes("green")
+        urls = [f"{self.server.url}/{i}.png" for i in range(4)]
+
+        start = time.perf_counter()
+        images = self.cache.read_many(urls + [urls[0]])
+        self.assertLess(time.perf_counter() - start, 0.6)
+        self.assertEqual(len(images), 5)
+        self.assertIs(images[0], images[4])
+        self.assertEqual(self.server.statuses("/0.png"), [200])
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            self.cache.read(f"{self.server.url}/missing.png")
+        with self.assertRaises(ValueError):
+            self.cache.read("missing.png")
+
+
+class TestGenerateWithUrls(unittest.TestCase):
+    def setUp(self):
+        self.default_cache = image_cache.IMAGE_CACHE
+        image_cache.IMAGE_CACHE = ImageCache()
+
+    def tearDown(self):
+        image_cache.IMAGE_CACHE.close()
+        image_cache.IMAGE_CACHE = self.default_cache
+
+    def test_controlnet_images_from_urls(self):
+        server = ImageServer()
+        server.images["/style.png"] = png_bytes("red")
+        url = f"{server.url}/style.png"
+        try:
+            # no server is contacted before the first generation
+            generator = sdqrcode.Sdqrcode("default_auto", auto_api_hostname=["127.0.0.1:1"])
+            config = generator.request_config(
+                mode="img2img", input_image=url, denoising_strength=0.5, controlnet_input_images=["qrcode", url]
+            )
+            input_image, controlnet_input_images = generator._prepare_images(config)
+        finally:
+            server.stop()
+
+        self.assertEqual(input_image.convert("RGB").getpixel((0, 0)), (255, 0, 0))
+        self.assertEqual(controlnet_input_images[0].size, (config["global"]["width"], config["global"]["height"]))
+        self.assertIs(controlnet_input_images[1], input_image)
+        self.assertEqual(server.statuses("/style.png"), [200])
+
+
+if __name__ == "__main__":
+    unittest.main()
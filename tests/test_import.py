@@ -1,4 +1,8 @@
+import subprocess
 import unittest
+import sys
+
+sys.path.append("./src/")
 
 
 class TestImport(unittest.TestCase):
@@ -17,6 +21,50 @@ class TestImport(unittest.TestCase):
 
         self.assertTrue(True)
 
+    def test_heavy_dependencies_are_lazy(self):
+        code = (
+            "import sys; sys.path.insert(0, './src/'); import sdqrcode; "
+            "sdqrcode.generate_qrcode_img(text='https://koll.ai'); "
+            "print(','.join(m for m in ('torch', 'diffusers', 'transformers', 'webuiapi', 'requests', 'yaml') if m in sys.modules))"
+        )
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(out.strip(), "")
+
+
+class TestEngineRegistry(unittest.TestCase):
+    def test_builtin_engines(self):
+        import sdqrcode.Engines.engine_util as engine_util
+
+        self.assertTrue({"diffusers", "auto", "auto_async"} <= set(engine_util.available_engines()))
+        self.assertEqual(engine_util.default_engine_name(None), "diffusers")
+        self.assertEqual(engine_util.default_engine_name("127.0.0.1"), "auto")
+        self.assertEqual(engine_util.default_engine_name(["127.0.0.1", "127.0.0.2"]), "auto_async")
+        with self.assertRaises(ValueError):
+            engine_util.get_engine("unknown")
+
+    def test_registered_engine(self):
+        import sdqrcode.sdqrcode as sdqrcode
+        import sdqrcode.Engines.Engine as Engine
+        import sdqrcode.Engines.engine_util as engine_util
+
+        class BlankEngine(Engine.Engine):
+            def __init__(self, config, hostname=None, size: int = 8):
+                super().__init__(config)
+                self.hostname = hostname
+                self.size = size
+
+            def generate_sd_qrcode(self, input_image=None, controlnet_input_images=None, config=None):
+                return [controlnet_input_images[0].resize((self.size, self.size))]
+
+        engine_util.register_engine("blank", BlankEngine)
+        self.addCleanup(engine_util.ENGINES.pop, "blank")
+
+        # kwargs outside of the engine signature are not passed, None leaves the defaults
+        generator = sdqrcode.init(config="default_auto", engine="blank", auto_api_hostname="host", torch_dtype=None)
+        self.assertIsInstance(generator.engine, BlankEngine)
+        self.assertEqual(generator.engine.hostname, "host")
+        self.assertEqual(generator.generate_sd_qrcode(width=256, height=256)[0].size, (8, 8))
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,104 @@
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import sys
+
+sys.path.append("./src/")
+from sdqrcode.Engines.model_registry import ModelRegistry
+
+
+class TestModelRegistry(unittest.TestCase):
+    def setUp(self):
+        self.loads = []
+
+    def loader(self, name, size):
+        def load():
+            self.loads.append(name)
+            return bytes(size)
+
+        return load
+
+    def test_acquire_shares_loaded_value(self):
+        registry = ModelRegistry()
+
+        first = registry.acquire("unet", self.loader("unet", 10))
+        second = registry.acquire("unet", self.loader("unet", 10))
+
+        self.assertIs(first, second)
+        self.assertEqual(self.loads, ["unet"])
+        self.assertEqual(registry.refcount("unet"), 2)
+        self.assertEqual(registry.memory_usage, 10)
+
+    def test_lru_eviction_over_budget(self):
+        registry = ModelRegistry(memory_budget=25)
+
+        for name in ["a", "b"]:
+            registry.acquire(name, self.loader(name, 10))
+            registry.release(name)
+        # touch "a" so "b" is the least recently used
+        registry.acquire("a", self.loader("a", 10))
+        registry.release("a")
+        registry.acquire("c", self.loader("c", 10))
+
+        self.assertIn("a", registry)
+        self.assertNotIn("b", registry)
+        self.assertIn("c", registry)
+
+    def test_entries_in_use_are_never_evicted(self):
+        registry = ModelRegistry(memory_budget=5)
+
+        registry.acquire("a", self.loader("a", 10))
+        registry.acquire("b", self.loader("b", 10))
+        self.assertEqual(len(registry), 2)
+
+        registry.release("a")
+        self.assertNotIn("a", registry)
+        self.assertIn("b", registry)
+
+    def test_release_without_acquire_raises(self):
+        registry = ModelRegistry()
+
+        with self.assertRaises(KeyError):
+            registry.release("a")
+
+    def test_loads_run_outside_of_the_lock(self):
+        registry = ModelRegistry()
+        started, finish = threading.Event(), threading.Event()
+
+        def slow_load():
+            started.set()
+            finish.wait(5)
+            self.loads.append("unet")
+            return bytes(10)
+
+        with ThreadPoolExecutor(3) as pool:
+            first = pool.submit(registry.acquire, "unet", slow_load)
+            self.assertTrue(started.wait(5))
+            second = pool.submit(registry.acquire, "unet", slow_load)
+            # other keys don't wait for the load in progress
+            registry.acquire("vae", self.loader("vae", 5))
+            registry.release("vae")
+            self.assertFalse(second.done())
+            finish.set()
+            self.assertIs(first.result(), second.result())
+
+        self.assertEqual(self.loads, ["vae", "unet"])
+        self.assertEqual(registry.refcount("unet"), 2)
+
+    def test_failed_load_is_not_cached(self):
+        registry = ModelRegistry()
+
+        def failing_load():
+            raise OSError("no weights")
+
+        with self.assertRaises(OSError):
+            registry.acquire("unet", failing_load)
+        self.assertNotIn("unet", registry)
+        # a later acquire loads again
+        registry.acquire("unet", self.loader("unet", 10))
+        self.assertEqual(self.loads, ["unet"])
+
+
+if __name__ == "__main__":
+    unittest.main()
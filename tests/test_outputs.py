@@ -0,0 +1,102 @@
+import os
+import tempfile
+import unittest
+import sys
+from io import BytesIO
+
+import numpy as np
+import PIL.Image
+
+sys.path.append("./src/")
+sys.path.append("./tests/")
+import sdqrcode.sdqrcode as sdqrcode
+import sdqrcode.Engines.Engine as Engine
+from sdqrcode import outputs
+
+try:
+    import torch
+    import diffusers
+except ImportError:
+    torch = None
+
+
+class NoiseEngine(Engine.Engine):
+    """Random images, one per batch item"""
+
+    def generate_sd_qrcode(self, input_image=None, controlnet_input_images=None, config=None):
+        rng = np.random.default_rng(config["global"]["seed"])
+        shape = (config["global"]["height"], config["global"]["width"], 3)
+        return [
+            PIL.Image.fromarray(rng.integers(0, 256, shape, dtype=np.uint8)) for _ in range(config["global"]["batch_size"])
+        ]
+
+
+class TestOutputs(unittest.TestCase):
+    def setUp(self):
+        # no server is contacted before the first generation
+        self.generator = sdqrcode.Sdqrcode("default_auto", auto_api_hostname=["127.0.0.1:1"])
+        self.generator.engine = NoiseEngine(self.generator.config)
+        self.params = {"seed": 1, "batch_size": 3, "width": 64, "height": 64}
+
+    def test_output_types(self):
+        expected = [np.asarray(image) for image in self.generator.generate_sd_qrcode(**self.params)]
+
+        arrays = self.generator.generate_sd_qrcode(output_type="np", **self.params)
+        for array, expected_array in zip(arrays, expected):
+            self.assertEqual(array.dtype, np.uint8)
+            np.testing.assert_array_equal(array, expected_array)
+
+        encoded = self.generator.generate_sd_qrcode(output_type="png", **self.params)
+        for data, expected_array in zip(encoded, expected):
+            np.testing.assert_array_equal(np.asarray(PIL.Image.open(BytesIO(data))), expected_array)
+        self.assertEqual(self.generator.generate_sd_qrcode(output_type="jpeg", **self.params)[0][:2], b"\xff\xd8")
+        self.assertEqual(self.generator.generate_sd_qrcode(output_type="webp", **self.params)[0][:4], b"RIFF")
+
+        with self.assertRaises(ValueError):
+            self.generator.generate_sd_qrcode(output_type="gif")
+        # the engine has no controlnet detect maps to return
+        with self.assertRaises(ValueError):
+            self.generator.generate_sd_qrcode(return_cn_imgs=True)
+
+    def test_save_to_directory(self):
+        directory = os.path.join(tempfile.mkdtemp(), "images")
+        items = [{"seed": i, "width": 64, "height": 64, "batch_size": 2} for i in range(3)]
+        paths = self.generator.generate_sd_qrcode_to_directory(directory, items, image_format="webp", max_batch_size=4)
+
+        self.assertEqual(len(paths), 3)
+        self.assertEqual(os.path.basename(paths[2][1]), "2_1.webp")
+        self.assertEqual(sorted(os.listdir(directory)), sorted(os.path.basename(p) for item in paths for p in item))
+        expected = self.generator.generate_sd_qrcode(output_type="webp", **items[1])
+        with open(paths[1][0], "rb") as f:
+            self.assertEqual(f.read(), expected[0])
+
+    def test_image_saver_errors(self):
+        with self.assertRaises(ValueError):
+            outputs.ImageSaver(tempfile.mkdtemp(), image_format="bmp")
+        saver = outputs.ImageSaver(tempfile.mkdtemp())
+        saver.save(["not an image"], "broken")
+        with self.assertRaises(Exception):
+            saver.wait()
+
+
+@unittest.skipIf(torch is None, "diffusers is not installed")
+class TestDiffusersArrays(unittest.TestCase):
+    def test_arrays_from_the_decoded_tensor(self):
+        from tiny_models import get_tiny_config
+
+        generator = sdqrcode.Sdqrcode(get_tiny_config("txt2img", n_units=2, device="cpu"))
+        try:
+            images = generator.generate_sd_qrcode(seed=3, batch_size=2)
+            arrays = generator.generate_sd_qrcode(seed=3, batch_size=2, output_type="np")
+        finally:
+            generator.release()
+
+        for image, array in zip(images, arrays):
+            np.testing.assert_array_equal(np.asarray(image), array)
+        # views of the batch array, not one copy per image
+        self.assertIsNotNone(arrays[0].base)
+        self.assertIs(arrays[0].base, arrays[1].base)
+
+
+if __name__ == "__main__":
+    unittest.main()
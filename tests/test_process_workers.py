@@ -0,0 +1,87 @@
+import unittest
+import sys
+
+import numpy as np
+
+sys.path.append("./src/")
+sys.path.append("./tests/")
+import sdqrcode.sdqrcode as sdqrcode
+from sdqrcode.process_workers import ProcessWorkers, read_shared_images, with_device, write_shared_images
+
+try:
+    import torch
+    import diffusers
+except ImportError:
+    torch = None
+
+
+class TestSharedImages(unittest.TestCase):
+    def test_round_trip(self):
+        rng = np.random.default_rng(0)
+        results = [[rng.integers(0, 256, (8, 6, 3), dtype=np.uint8) for _ in range(n)] for n in (2, 0, 1)]
+        name, layout = write_shared_images(results)
+
+        arrays = read_shared_images(name, layout, output_type="np")
+        self.assertEqual([len(images) for images in arrays], [2, 0, 1])
+        for images, expected in zip(arrays, results):
+            for array, expected_array in zip(images, expected):
+                np.testing.assert_array_equal(array, expected_array)
+        # the block is unlinked once read
+        with self.assertRaises(FileNotFoundError):
+            read_shared_images(name, layout)
+
+    def test_with_device(self):
+        config = {"global": {}, "device": {"name": "auto", "offload": "none"}}
+        self.assertEqual(with_device(config, "cuda:1")["device"], {"name": "cuda:1", "offload": "none"})
+        self.assertEqual(with_device({"device": "cpu"}, "cuda:0")["device"], {"name": "cuda:0"})
+        self.assertEqual(config["device"]["name"], "auto")
+
+
+@unittest.skipIf(torch is None, "diffusers is not installed")
+class TestProcessWorkers(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from tiny_models import get_tiny_config
+
+        cls.config = get_tiny_config("txt2img", n_units=2, device="cpu")
+        cls.workers = ProcessWorkers(cls.config, devices=["cpu", "cpu"], threads_per_worker=1)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.workers.close()
+
+    def test_same_images_as_in_process(self):
+        items = [{"seed": i, "prompt": f"prompt {i % 2}", "batch_size": 2} for i in range(4)]
+        results = self.workers.map(items)
+        batch_results = self.workers.generate_sd_qrcode_batch(items, max_batch_size=4, output_type="np")
+
+        generator = sdqrcode.Sdqrcode(self.config)
+        try:
+            expected = [generator.generate_sd_qrcode(**item) for item in items]
+            expected_batch = generator.generate_sd_qrcode_batch(items, max_batch_size=4)
+        finally:
+            generator.release()
+
+        for images, expected_images in zip(results, expected):
+            self.assertEqual(len(images), 2)
+            for image, expected_image in zip(images, expected_images):
+                # workers run with a single torch thread
+                np.testing.assert_allclose(np.asarray(image, dtype=np.int16), np.asarray(expected_image, dtype=np.int16), atol=1)
+        # the shards are smaller batches than the in-process call, float rounding can differ by one level
+        for arrays, expected_images in zip(batch_results, expected_batch):
+            for array, expected_image in zip(arrays, expected_images):
+                np.testing.assert_allclose(array.astype(np.int16), np.asarray(expected_image, dtype=np.int16), atol=1)
+
+        # the jobs were spread over both workers
+        self.assertTrue(all(worker.completed > 0 for worker in self.workers._workers))
+
+    def test_errors_are_raised_by_the_future(self):
+        future = self.workers.submit(scheduler_name="unknown scheduler")
+        with self.assertRaises(Exception):
+            future.result()
+        # the worker keeps running
+        self.assertEqual(len(self.workers.submit(seed=1).result()), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+import sys
+
+import numpy as np
+
+sys.path.append("./src/")
+sys.path.append("./tests/")
+
+try:
+    import torch
+    import diffusers
+except ImportError:
+    torch = None
+
+
+@unittest.skipIf(torch is None, "diffusers is not installed")
+class TestPromptEmbeddingCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        from sdqrcode.sdqrcode import Sdqrcode
+        from tiny_models import get_tiny_config
+
+        cls.generator = Sdqrcode(get_tiny_config("txt2img", device="cpu"))
+        cls.engine = cls.generator.engine
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.generator.release()
+
+    def setUp(self):
+        self.engine.prompt_cache.clear()
+        self.engine.prompt_cache.hits = self.engine.prompt_cache.misses = 0
+
+    def test_prompt_encoded_once(self):
+        self.generator.generate_sd_qrcode(prompt="a dog", qrcode_text="https://koll.ai")
+        self.generator.generate_sd_qrcode(prompt="a dog", qrcode_text="https://github.com", seed=3)
+        self.assertEqual((self.engine.prompt_cache.misses, self.engine.prompt_cache.hits), (1, 1))
+
+        self.generator.generate_sd_qrcode(prompt="a cat")
+        self.assertEqual(self.engine.prompt_cache.misses, 2)
+
+    def test_same_images_as_raw_prompts(self):
+        images = self.generator.generate_sd_qrcode(prompt="a dog", negative_prompt="ugly", seed=1)
+
+        pipeline = self.engine.pipeline
+        expected = pipeline(
+            prompt="a dog",
+            negative_prompt="ugly",
+            image=self.generator._prepare_images(self.generator.config)[1],
+            width=64,
+            height=64,
+            num_inference_steps=2,
+            controlnet_conditioning_scale=[0.5],
+            guidance_scale=7,
+            generator=torch.Generator().manual_seed(1),
+        ).images
+        np.testing.assert_array_equal(np.asarray(images[0]), np.asarray(expected[0]))
+
+    def test_batch(self):
+        items = [{"prompt": "a dog", "seed": 1}, {"prompt": "a cat", "seed": 2}, {"prompt": "a dog", "seed": 3}]
+        results = self.generator.generate_sd_qrcode_batch(items)
+        self.assertEqual(len(results), 3)
+        self.assertEqual((self.engine.prompt_cache.misses, self.engine.prompt_cache.hits), (2, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,6 @@
 import unittest
-from sdqrcode.sdqrcode import generate_qrcode_img
+from sdqrcode.sdqrcode import generate_qrcode_img, get_qrcode_matrix, render_qrcode_array
+import numpy as np
 import qrcode
 
 
@@ -24,6 +25,48 @@ class TestGenerateQRCodeImg(unittest.TestCase):
         self.assertIsNotNone(qr_img)
         qr_img.save("./tests/imgs_test_results/test_qr_code.png")
 
+    def test_same_pixels_as_qrcode(self):
+        text = "https://koll.ai"
+        for error_correction in (qrcode.constants.ERROR_CORRECT_L, qrcode.constants.ERROR_CORRECT_H):
+            qr = qrcode.QRCode(version=1, error_correction=error_correction, box_size=7, border=3)
+            qr.add_data(text)
+            qr.make(fit=True)
+            expected = qr.make_image(fill_color="red", back_color="yellow").convert("RGB")
+
+            qr_img = generate_qrcode_img(
+                error_correction=error_correction,
+                box_size=7,
+                border=3,
+                fill_color="red",
+                back_color="yellow",
+                text=text,
+            )
+            self.assertEqual(qr_img.size, expected.size)
+            np.testing.assert_array_equal(np.asarray(qr_img), np.asarray(expected))
+
+    def test_render_at_target_size(self):
+        matrix = get_qrcode_matrix("https://koll.ai", qrcode.constants.ERROR_CORRECT_H)
+        img = render_qrcode_array(matrix, width=768, height=512, border=4)
+        self.assertEqual(img.shape, (512, 768, 3))
+
+        # whole pixels per module, the qr code centered on the background
+        box_size = 512 // (matrix.shape[0] + 8)
+        size = (matrix.shape[0] + 8) * box_size
+        top, left = (512 - size) // 2, (768 - size) // 2
+        modules = img[top + 4 * box_size : top + size - 4 * box_size : box_size, left + 4 * box_size :: box_size, 0]
+        np.testing.assert_array_equal(modules[:, : matrix.shape[1]] == 0, matrix)
+        self.assertTrue((img[:top] == 255).all() and (img[:, :left] == 255).all())
+
+        with self.assertRaises(ValueError):
+            render_qrcode_array(matrix, width=16, height=16)
+
+    def test_matrix_cache(self):
+        get_qrcode_matrix.cache_clear()
+        get_qrcode_matrix("https://koll.ai", qrcode.constants.ERROR_CORRECT_H)
+        matrix = get_qrcode_matrix("https://koll.ai", qrcode.constants.ERROR_CORRECT_H)
+        self.assertEqual(get_qrcode_matrix.cache_info().hits, 1)
+        self.assertFalse(matrix.flags.writeable)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+import time
+import sys
+
+import PIL.Image
+
+sys.path.append("./src/")
+import sdqrcode.sdqrcode as sdqrcode
+import sdqrcode.Engines.Engine as Engine
+from sdqrcode.scan import decode_qrcode
+
+
+class QrEchoEngine(Engine.Engine):
+    """Returns the qr code itself for seeds multiple of 3 and blank images otherwise"""
+
+    def __init__(self, config, delay=0.0):
+        super().__init__(config)
+        self.delay = delay
+        self.seeds = []
+
+    def generate_sd_qrcode(self, input_image=None, controlnet_input_images=None, config=None):
+        time.sleep(self.delay)
+        seed = config["global"]["seed"]
+        self.seeds.append(seed)
+        if seed % 3 == 0:
+            return [controlnet_input_images[0].copy()]
+        return [PIL.Image.new("RGB", controlnet_input_images[0].size, "gray")]
+
+
+class TestGenerateUntilScannable(unittest.TestCase):
+    def setUp(self):
+        # no server is contacted before the first generation
+        self.generator = sdqrcode.Sdqrcode("default_auto", auto_api_hostname=["127.0.0.1:1"])
+        self.generator.config["global"]["seed"] = 1
+        self.engine = QrEchoEngine(self.generator.config)
+        self.generator.engine = self.engine
+
+    def test_decode_qrcode(self):
+        qr_img = sdqrcode.generate_qrcode_img(text="https://koll.ai", width=256, height=256)
+        self.assertEqual(decode_qrcode(qr_img), "https://koll.ai")
+        self.assertIsNone(decode_qrcode(PIL.Image.new("RGB", (256, 256), "white")))
+
+    def test_stops_when_enough_are_scannable(self):
+        images, results = self.generator.generate_until_scannable(n_scannable=2, max_batches=20, width=256, height=256)
+
+        self.assertEqual(len(images), 2)
+        # seeds 1..6 hold the two scannable candidates (3 and 6), decoding may lag one batch behind
+        self.assertLessEqual(len(self.engine.seeds), 7)
+        self.assertEqual(self.engine.seeds[:6], [1, 2, 3, 4, 5, 6])
+        self.assertEqual([r.index for r in results], list(range(len(results))))
+        self.assertEqual([r.seed for r in results if r.scannable][:2], [3, 6])
+        self.assertTrue(all(r.data == "https://koll.ai" for r in results if r.scannable))
+        # the seed of the config is left as it was
+        self.assertEqual(self.generator.config["global"]["seed"], 1)
+
+    def test_scannable_first_batch(self):
+        self.generator.config["global"]["seed"] = 3
+        images, results = self.generator.generate_until_scannable(n_scannable=1, max_batches=10, width=256, height=256)
+
+        self.assertEqual(len(images), 1)
+        # at most the batch generated while the first one was decoded
+        self.assertLessEqual(len(self.engine.seeds), 2)
+        self.assertEqual(len(results), len(self.engine.seeds))
+
+    def test_batch_budget(self):
+        images, results = self.generator.generate_until_scannable(n_scannable=1, max_batches=2, width=256, height=256)
+
+        self.assertEqual(images, [])
+        self.assertEqual(len(results), 2)
+        self.assertFalse(any(r.scannable for r in results))
+
+    def test_seconds_budget(self):
+        self.engine.delay = 0.05
+        images, results = self.generator.generate_until_scannable(
+            n_scannable=10, max_batches=None, max_seconds=0.2, width=256, height=256
+        )
+
+        self.assertLessEqual(len(results), 5)
+        self.assertEqual(len(results), len(self.engine.seeds))
+
+    def test_expected_text(self):
+        images, results = self.generator.generate_until_scannable(
+            n_scannable=1, max_batches=3, expected_text="https://github.com", width=256, height=256
+        )
+
+        self.assertEqual(images, [])
+        self.assertEqual(results[2].data, "https://koll.ai")
+        self.assertFalse(results[2].scannable)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+import importlib.util
+
+import sys
+
+sys.path.append("./src/")
+from sdqrcode.Engines import schedulers
+
+
+@unittest.skipUnless(importlib.util.find_spec("diffusers"), "diffusers is not installed")
+class TestSchedulers(unittest.TestCase):
+    def setUp(self):
+        from diffusers import DDIMScheduler
+
+        self.scheduler_config = DDIMScheduler().config
+
+    def test_every_scheduler_exists_in_diffusers(self):
+        import diffusers
+
+        for name, (class_name, _) in schedulers.SCHEDULERS.items():
+            self.assertTrue(hasattr(diffusers, class_name), name)
+
+    def test_karras_variant(self):
+        scheduler = schedulers.create_scheduler("DPM++ 2M Karras", self.scheduler_config)
+
+        self.assertEqual(type(scheduler).__name__, "DPMSolverMultistepScheduler")
+        self.assertTrue(scheduler.config.use_karras_sigmas)
+
+    def test_unknown_scheduler(self):
+        with self.assertRaises(ValueError):
+            schedulers.create_scheduler("unknown", self.scheduler_config)
+
+    def test_cache_reuses_and_resets_scheduler(self):
+        cache = schedulers.SchedulerCache(self.scheduler_config)
+
+        scheduler = cache.get("Euler a")
+        scheduler.set_timesteps(10)
+        scheduler._step_index = 5
+
+        self.assertIs(cache.get("Euler a"), scheduler)
+        self.assertIsNone(scheduler._step_index)
+        self.assertIsNot(cache.get("Euler"), scheduler)
+
+
+if __name__ == "__main__":
+    unittest.main()
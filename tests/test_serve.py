@@ -0,0 +1,134 @@
+import base64
+import json
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+import sys
+from io import BytesIO
+
+import numpy as np
+import PIL.Image
+
+sys.path.append("./src/")
+sys.path.append("./tests/")
+import sdqrcode.sdqrcode as sdqrcode
+import sdqrcode.Engines.Engine as Engine
+from sdqrcode.serve import DynamicBatcher, make_server, percentile
+
+try:
+    import torch
+    import diffusers
+except ImportError:
+    torch = None
+
+
+class RecordingEngine(Engine.Engine):
+    """Records the seeds of each batch call"""
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.calls = []
+
+    def generate_sd_qrcode_batch(self, configs, input_images, controlnet_input_images):
+        self.calls.append([c["global"]["seed"] for c in configs])
+        time.sleep(0.01)
+        return [[PIL.Image.new("RGB", (8, 8), "red")] for _ in configs]
+
+
+class TestDynamicBatcher(unittest.TestCase):
+    def setUp(self):
+        # no server is contacted before the first generation
+        self.generator = sdqrcode.Sdqrcode("default_auto", auto_api_hostname=["127.0.0.1:1"])
+        self.engine = RecordingEngine(self.generator.config)
+        self.generator.engine = self.engine
+
+    def test_compatible_requests_are_batched(self):
+        batcher = DynamicBatcher(self.generator, max_batch_size=4, max_wait=0.2)
+        futures = [batcher.submit(seed=i, prompt=f"prompt {i}", width=256, height=256) for i in range(6)]
+        # a different shape is never batched with the others
+        other = batcher.submit(seed=10, steps=5, width=256, height=256)
+        for future in futures + [other]:
+            self.assertEqual(len(future.result()), 1)
+        batcher.close()
+
+        self.assertEqual(self.engine.calls, [[0, 1, 2, 3], [4, 5], [10]])
+        metrics = batcher.metrics.snapshot(batcher.queue_depth)
+        self.assertEqual(metrics["requests"], 7)
+        self.assertEqual(metrics["batch_size_histogram"], {"1": 1, "2": 1, "4": 1})
+        self.assertEqual(metrics["queue_depth"], 0)
+        self.assertGreater(metrics["latency_p99"], 0)
+
+    def test_invalid_params_raise_on_submit(self):
+        batcher = DynamicBatcher(self.generator)
+        with self.assertRaises(TypeError):
+            batcher.submit(stpes=5)
+        with self.assertRaises(ValueError):
+            batcher.submit(steps=0)
+        batcher.close()
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([3.0], 99), 3.0)
+        self.assertIsNone(percentile([], 50))
+
+
+@unittest.skipIf(torch is None, "diffusers is not installed")
+class TestServeTinyModel(unittest.TestCase):
+    def setUp(self):
+        from tiny_models import get_tiny_config
+
+        self.generator = sdqrcode.Sdqrcode(get_tiny_config("txt2img", n_units=2, device="cpu"))
+        self.batcher = DynamicBatcher(self.generator, max_batch_size=4, max_wait=0.5)
+        self.server = make_server(self.batcher, port=0)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.batcher.close()
+        self.generator.release()
+
+    def post(self, params: dict):
+        request = urllib.request.Request(
+            f"{self.url}/generate", data=json.dumps(params).encode(), headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+    def test_concurrent_requests_share_a_batch(self):
+        items = [{"seed": i, "qrcode_text": f"https://koll.ai/{i}"} for i in range(4)]
+        responses = [None] * len(items)
+
+        def post(i):
+            responses[i] = self.post(items[i])
+
+        threads = [threading.Thread(target=post, args=(i,)) for i in range(len(items))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        expected = self.generator.generate_sd_qrcode_batch(items)
+        for response, images in zip(responses, expected):
+            image = PIL.Image.open(BytesIO(base64.b64decode(response["images"][0])))
+            np.testing.assert_array_equal(np.asarray(image), np.asarray(images[0]))
+
+        with urllib.request.urlopen(f"{self.url}/metrics") as response:
+            metrics = json.loads(response.read())
+        self.assertEqual(metrics["requests"], 4)
+        self.assertEqual(metrics["batch_size_histogram"], {"4": 1})
+        self.assertIsNotNone(metrics["latency_p50"])
+
+    def test_bad_request(self):
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            self.post({"stpes": 3})
+        self.assertEqual(cm.exception.code, 400)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,98 @@
+import asyncio
+import types
+import unittest
+import sys
+
+import numpy as np
+
+sys.path.append("./src/")
+sys.path.append("./tests/")
+import sdqrcode.sdqrcode as sdqrcode
+from a1111_stub import A1111Stub
+
+try:
+    import torch
+    import diffusers
+except ImportError:
+    torch = None
+
+
+class TestAutoStream(unittest.TestCase):
+    def setUp(self):
+        self.stub = A1111Stub(delay=0.5).start()
+        host, port = self.stub.hostname.split(":")
+        self.generator = sdqrcode.init(config="default_auto", auto_api_hostname=host, auto_api_port=int(port), engine="auto")
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def test_previews_from_the_progress_endpoint(self):
+        previews = []
+        stream = self.generator.generate_sd_qrcode_stream(
+            preview_callback=lambda step, images: previews.append((step, images)), steps=10
+        )
+        self.assertIsInstance(stream, types.GeneratorType)
+        # the generation starts with the iteration
+        self.assertEqual(self.stub.generation_requests(), [])
+
+        images = list(stream)
+        self.assertEqual(len(images), 1)
+        self.assertEqual(images[0].convert("RGB").getpixel((0, 0)), (255, 0, 0))
+        self.assertGreater(len(previews), 0)
+        steps = [step for step, _ in previews]
+        self.assertEqual(steps, sorted(set(steps)))
+        self.assertEqual(previews[0][1][0].convert("RGB").getpixel((0, 0)), (0, 255, 0))
+
+    def test_async_stream(self):
+        async def collect():
+            return [image async for image in self.generator.agenerate_sd_qrcode_stream(batch_size=2)]
+
+        images = asyncio.run(collect())
+        self.assertEqual(len(images), 2)
+
+    def test_invalid_params_raise_on_call(self):
+        with self.assertRaises(ValueError):
+            self.generator.generate_sd_qrcode_stream(steps=0)
+
+
+@unittest.skipIf(torch is None, "diffusers is not installed")
+class TestDiffusersStream(unittest.TestCase):
+    def setUp(self):
+        from tiny_models import get_tiny_config
+
+        self.generator = sdqrcode.Sdqrcode(get_tiny_config("txt2img", n_units=2, device="cpu"))
+
+    def tearDown(self):
+        self.generator.release()
+
+    def test_same_images_as_generate(self):
+        previews = []
+        streamed = list(
+            self.generator.generate_sd_qrcode_stream(
+                preview_callback=lambda step, images: previews.append((step, images)), seed=1, batch_size=2, steps=3
+            )
+        )
+        expected = self.generator.generate_sd_qrcode(seed=1, batch_size=2, steps=3)
+
+        self.assertEqual(len(streamed), 2)
+        for image, expected_image in zip(streamed, expected):
+            np.testing.assert_allclose(np.asarray(image, dtype=np.int16), np.asarray(expected_image, dtype=np.int16), atol=1)
+
+        self.assertEqual([step for step, _ in previews], [0, 1, 2])
+        # previews are at the latent resolution
+        scale = self.generator.engine.pipeline.vae_scale_factor
+        width, height = self.generator.config["global"]["width"], self.generator.config["global"]["height"]
+        for _, images in previews:
+            self.assertEqual(len(images), 2)
+            self.assertEqual(images[0].size, (width // scale, height // scale))
+
+    def test_async_stream(self):
+        async def collect():
+            return [image async for image in self.generator.agenerate_sd_qrcode_stream(seed=1, batch_size=2)]
+
+        images = asyncio.run(collect())
+        self.assertEqual(len(images), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
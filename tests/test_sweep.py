@@ -0,0 +1,134 @@
+import unittest
+import tempfile
+import os
+import sys
+
+import PIL.Image
+import yaml
+
+sys.path.append("./src/")
+sys.path.append("./tests/")
+import sdqrcode.sdqrcode as sdqrcode
+import sdqrcode.sweep as sweep
+import sdqrcode.Engines.Engine as Engine
+
+try:
+    import torch
+    import diffusers
+except ImportError:
+    torch = None
+
+
+class RecordingEngine(Engine.Engine):
+    """Records the configs of each generation call"""
+
+    def __init__(self, config, active_model=None):
+        super().__init__(config)
+        self.calls = []
+        self.active_model = active_model
+
+    @property
+    def active_models(self):
+        return [self.active_model] if self.active_model else []
+
+    def generate_sd_qrcode_batch(self, configs, input_images, controlnet_input_images):
+        self.calls.append([(c["global"]["model_name_or_path"], c["global"]["cfg_scale"]) for c in configs])
+        return [[PIL.Image.new("RGB", (8, 8), "red")] for _ in configs]
+
+
+class TestSweep(unittest.TestCase):
+    def setUp(self):
+        # no server is contacted before the first generation
+        self.generator = sdqrcode.Sdqrcode("default_auto", auto_api_hostname=["127.0.0.1:1"])
+        self.generator.engine = RecordingEngine(self.generator.config, active_model="model_b")
+        self.out = tempfile.mkdtemp()
+
+    def test_grid_and_random_search(self):
+        points = sweep.grid(cfg_scale=[5, 7], steps=[20, 30, 40])
+        self.assertEqual(len(points), 6)
+        self.assertIn({"cfg_scale": 7, "steps": 30}, points)
+
+        points = sweep.random_search(20, seed=1, cfg_scale=(4.0, 10.0), steps=(10, 30), prompt=["a", "b"])
+        self.assertEqual(points, sweep.random_search(20, seed=1, cfg_scale=(4.0, 10.0), steps=(10, 30), prompt=["a", "b"]))
+        self.assertTrue(all(4 <= p["cfg_scale"] <= 10 and isinstance(p["steps"], int) for p in points))
+
+    def test_runs_ordered_by_model_and_batched(self):
+        points = sweep.grid(model_name_or_path=["model_a", "model_b"], cfg_scale=[5, 7], qrcode_text=["x", "y", "z"])
+        store = sweep.run_sweep(self.generator, points, sweep.SweepStore(self.out), max_batch_size=8)
+
+        # the loaded model goes first, each (model, cfg_scale) is generated in one call
+        calls = self.generator.engine.calls
+        self.assertEqual([call[0] for call in calls], [("model_b", 5), ("model_b", 7), ("model_a", 5), ("model_a", 7)])
+        self.assertTrue(all(len(call) == 3 and len(set(call)) == 1 for call in calls))
+        self.assertEqual(len(store), 12)
+        # the generator config is not modified by the sweep
+        self.assertEqual(self.generator.config, sdqrcode.get_config("default_auto"))
+
+        result = store.results()[0]
+        self.assertEqual(result["params"]["model_name_or_path"], "model_b")
+        self.assertTrue(os.path.exists(os.path.join(self.out, result["images"][0])))
+
+    def test_resume(self):
+        points = sweep.grid(cfg_scale=[5, 7, 9])
+
+        def interrupt(done, total):
+            raise KeyboardInterrupt
+
+        with self.assertRaises(KeyboardInterrupt):
+            sweep.run_sweep(self.generator, points, sweep.SweepStore(self.out), max_batch_size=1, callback=interrupt)
+        self.assertEqual(len(sweep.SweepStore(self.out)), 1)
+
+        self.generator.engine.calls = []
+        store = sweep.run_sweep(self.generator, points, sweep.SweepStore(self.out), max_batch_size=1)
+        self.assertEqual(len(self.generator.engine.calls), 2)
+        self.assertEqual(len(store), 3)
+
+        # nothing left to do
+        self.generator.engine.calls = []
+        sweep.run_sweep(self.generator, points, store)
+        self.assertEqual(self.generator.engine.calls, [])
+
+
+try:
+    import diffusers
+except ImportError:
+    diffusers = None
+
+
+@unittest.skipIf(diffusers is None, "diffusers is not installed")
+class TestSweepCli(unittest.TestCase):
+    def test_cli(self):
+        from tiny_models import get_tiny_config
+
+        out = tempfile.mkdtemp()
+        config_path = os.path.join(out, "config.yaml")
+        with open(config_path, "w") as f:
+            yaml.safe_dump(get_tiny_config(device="cpu"), f)
+
+        args = ["--config", config_path, "--out", out, "--param", "cfg_scale=[5, 7]", "--param", "controlnet_weights=[[0.3], [0.6]]"]
+        sweep.main(args)
+        store = sweep.SweepStore(out)
+        self.assertEqual(len(store), 4)
+        self.assertEqual(store.results()[0]["config"]["device"], "cpu")
+
+
+@unittest.skipIf(torch is None, "diffusers is not installed")
+class TestSweepDiffusers(unittest.TestCase):
+    def test_models_the_engine_did_not_load_are_rejected(self):
+        from tiny_models import get_tiny_config
+
+        generator = sdqrcode.Sdqrcode(get_tiny_config("txt2img", device="cpu"))
+        out = tempfile.mkdtemp()
+        try:
+            points = sweep.grid(model_name_or_path=["other/model"], cfg_scale=[5, 7])
+            with self.assertRaises(ValueError):
+                sweep.run_sweep(generator, points, sweep.SweepStore(out))
+            self.assertEqual(len(sweep.SweepStore(out)), 0)
+            with self.assertRaises(ValueError):
+                generator.generate_sd_qrcode(model_name_or_path="other/model")
+        finally:
+            generator.release()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import asyncio
+import importlib.util
+import json
+import unittest
+import sys
+
+sys.path.append("./src/")
+sys.path.append("./tests/")
+import sdqrcode.sdqrcode as sdqrcode
+import sdqrcode.tracing as tracing
+from a1111_stub import A1111Stub
+
+try:
+    import torch
+    import diffusers
+except ImportError:
+    torch = None
+
+
+class TestTracer(unittest.TestCase):
+    def test_nested_spans(self):
+        finished = []
+        tracer = tracing.Tracer(hooks=[lambda span: finished.append(span.name)])
+        with tracer.span("generation") as root:
+            with tracing.span("stage", size=3):
+                pass
+            root.add("measured", 0.5, steps=2)
+            with self.assertRaises(KeyError):
+                with tracing.span("failing"):
+                    raise KeyError()
+
+        self.assertEqual(finished, ["stage", "measured", "failing", "generation"])
+        self.assertIs(tracer.last_trace, root)
+        self.assertEqual([child.name for child in root.children], ["stage", "measured", "failing"])
+        self.assertEqual(root.find("stage").attributes, {"size": 3})
+        self.assertEqual(root.find("failing").attributes, {"error": "KeyError"})
+        self.assertEqual(tracer.stats()["measured"]["seconds_sum"], 0.5)
+
+    def test_untraced_spans_are_no_ops(self):
+        span = tracing.span("stage")
+        self.assertFalse(span)
+        with span:
+            span.set(size=3)
+        self.assertFalse(tracing.current_span())
+
+    def test_exporters(self):
+        tracer = tracing.Tracer()
+        for _ in range(2):
+            with tracer.span("pipeline", peak_rss_bytes=100):
+                pass
+        text = tracer.prometheus_text()
+        self.assertIn('sdqrcode_stage_seconds_count{stage="pipeline"} 2', text)
+        self.assertIn('sdqrcode_stage_memory_bytes{stage="pipeline",measure="peak_rss"} 100', text)
+
+        exported = json.loads(tracer.to_json())
+        self.assertEqual(exported["stages"]["pipeline"]["count"], 2)
+        self.assertEqual(exported["last_trace"]["name"], "pipeline")
+
+
+class TestAutoTracing(unittest.TestCase):
+    def setUp(self):
+        self.stub = A1111Stub().start()
+        self.tracer = tracing.Tracer()
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def test_auto_stages(self):
+        host, port = self.stub.hostname.split(":")
+        generator = sdqrcode.init(
+            config="default_auto", auto_api_hostname=host, auto_api_port=int(port), engine="auto", tracer=self.tracer
+        )
+        generator.generate_sd_qrcode()
+
+        trace = self.tracer.last_trace
+        self.assertEqual(trace.name, "generate_sd_qrcode")
+        for name in ["request_config", "prepare_images", "render_qrcode", "set_model", "encode_payload", "request"]:
+            self.assertIsNotNone(trace.find(name), name)
+
+    @unittest.skipUnless(importlib.util.find_spec("aiohttp"), "aiohttp is not installed")
+    def test_async_stages_follow_the_caller(self):
+        generator = sdqrcode.init(config="default_auto", auto_api_hostname=[self.stub.hostname], tracer=self.tracer)
+        try:
+            # blocking calls run in a background event loop
+            generator.generate_sd_qrcode()
+            self.assertIsNotNone(self.tracer.last_trace.find("decode_images"))
+
+            async def generate_all():
+                return await asyncio.gather(*[generator.agenerate_sd_qrcode(seed=seed) for seed in range(2)])
+
+            asyncio.run(generate_all())
+        finally:
+            generator.release()
+
+        traces = list(self.tracer.traces)[-2:]
+        self.assertEqual([trace.name for trace in traces], ["agenerate_sd_qrcode"] * 2)
+        for trace in traces:
+            self.assertEqual(len([child for child in trace.children if child.name == "request_config"]), 1)
+            self.assertIsNotNone(trace.find("request"))
+
+
+@unittest.skipIf(torch is None, "diffusers is not installed")
+class TestDiffusersTracing(unittest.TestCase):
+    def test_pipeline_stages(self):
+        from tiny_models import get_tiny_config
+
+        tracer = tracing.Tracer()
+        generator = sdqrcode.Sdqrcode(get_tiny_config("txt2img", n_units=2, device="cpu"), tracer=tracer)
+        try:
+            generator.generate_sd_qrcode(steps=3)
+            generator.generate_sd_qrcode_batch([{"seed": 0}, {"seed": 1}])
+            generator.generate_sd_qrcode_variants([{"controlnet_weights": [0.5, 0.5]}, {"controlnet_weights": [1, 0]}])
+        finally:
+            generator.release()
+
+        generation, batch, variants = tracer.traces
+        pipeline = generation.find("pipeline")
+        self.assertEqual(pipeline.attributes["mode"], "txt2img")
+        self.assertIsNotNone(pipeline.attributes["peak_rss_bytes"])
+        self.assertEqual(len(generation.find("denoising").attributes["step_seconds"]), 3)
+        self.assertIsNotNone(generation.find("decode"))
+        self.assertIsNotNone(generation.find("encode_prompt"))
+        self.assertIsNotNone(generation.find("scheduler"))
+        self.assertEqual(batch.find("pipeline").attributes["images"], 2)
+        self.assertIsNotNone(batch.find("denoising"))
+        self.assertIsNotNone(variants.find("denoising"))
+        self.assertIn("pipeline", tracer.stats())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import threading
+import time
+import unittest
+import sys
+
+import numpy as np
+
+sys.path.append("./src/")
+sys.path.append("./tests/")
+import sdqrcode.sdqrcode as sdqrcode
+import sdqrcode.Engines.Engine as Engine
+from sdqrcode.workers import GenerationWorkers
+
+try:
+    import torch
+    import diffusers
+except ImportError:
+    torch = None
+
+
+class SlowEchoEngine(Engine.Engine):
+    """Returns the prompt and seed it generated with, sleeping in between to interleave concurrent calls"""
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.max_concurrency = 4
+        self.running = 0
+        self.max_running = 0
+        self._count_lock = threading.Lock()
+
+    def generate_sd_qrcode(self, input_image=None, controlnet_input_images=None, config=None):
+        with self._count_lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        prompt = config["global"]["prompt"]
+        time.sleep(0.02)
+        seed = config["global"]["seed"]
+        with self._count_lock:
+            self.running -= 1
+        return [(prompt, seed)]
+
+
+class TestConcurrentCalls(unittest.TestCase):
+    def setUp(self):
+        # no server is contacted before the first generation
+        self.generator = sdqrcode.Sdqrcode("default_auto", auto_api_hostname=["127.0.0.1:1"])
+        self.engine = SlowEchoEngine(self.generator.config)
+        self.generator.engine = self.engine
+
+    def test_calls_do_not_share_params(self):
+        items = [{"prompt": f"prompt {i}", "seed": i, "width": 256, "height": 256} for i in range(16)]
+        with GenerationWorkers(self.generator) as workers:
+            results = workers.map(items)
+
+        self.assertEqual(results, [[(f"prompt {i}", i)] for i in range(16)])
+        self.assertEqual(self.engine.max_running, 4)
+
+    def test_overrides_do_not_leak(self):
+        prompt = self.generator.config["global"]["prompt"]
+        self.generator.generate_sd_qrcode(prompt="a cat", seed=3, width=256, height=256)
+        self.assertEqual(self.generator.config["global"]["prompt"], prompt)
+        self.assertEqual(self.generator.generate_sd_qrcode(width=256, height=256), [(prompt, -1)])
+
+    def test_max_pending(self):
+        workers = GenerationWorkers(self.generator, concurrency=1, max_pending=2)
+        start = time.perf_counter()
+        futures = [workers.submit(prompt="a", seed=i, width=256, height=256) for i in range(4)]
+        # the last two submits waited for a call to finish
+        self.assertGreaterEqual(time.perf_counter() - start, 0.03)
+        self.assertEqual([f.result()[0][1] for f in futures], [0, 1, 2, 3])
+        workers.close()
+
+
+@unittest.skipIf(torch is None, "diffusers is not installed")
+class TestConcurrentDiffusers(unittest.TestCase):
+    def test_same_images_as_sequential_calls(self):
+        from tiny_models import get_tiny_config
+
+        generator = sdqrcode.Sdqrcode(get_tiny_config("txt2img", n_units=2, device="cpu"))
+        items = [{"prompt": f"prompt {i % 2}", "seed": i, "controlnet_weights": [0.2 * i, 0.5]} for i in range(4)]
+        try:
+            sequential = [generator.generate_sd_qrcode(**item) for item in items]
+            with GenerationWorkers(generator, concurrency=4) as workers:
+                concurrent = workers.map(items)
+        finally:
+            generator.release()
+
+        for expected, images in zip(sequential, concurrent):
+            np.testing.assert_array_equal(np.asarray(expected[0]), np.asarray(images[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
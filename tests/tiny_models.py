@@ -0,0 +1,145 @@
+import json
+import os
+import tempfile
+
+_PATHS = None
+
+
+def get_tiny_models() -> tuple[str, str]:
+    """
+    Paths of a randomly initialised stable diffusion checkpoint and controlnet, small enough to run
+    the diffusers engine on cpu in tests. They are saved once per process.
+    """
+    global _PATHS
+    if _PATHS is None:
+        _PATHS = save_tiny_models(tempfile.mkdtemp(prefix="sdqrcode_tiny_"))
+    return _PATHS
+
+
+def save_tiny_models(path: str) -> tuple[str, str]:
+    import torch
+    from diffusers import AutoencoderKL, ControlNetModel, DDIMScheduler, StableDiffusionPipeline, UNet2DConditionModel
+    from transformers import CLIPTextConfig, CLIPTextModel, CLIPTokenizer
+
+    torch.manual_seed(0)
+    blocks = dict(block_out_channels=(8, 16), layers_per_block=1, norm_num_groups=4)
+    unet = UNet2DConditionModel(
+        **blocks,
+        sample_size=16,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=("CrossAttnDownBlock2D", "DownBlock2D"),
+        up_block_types=("UpBlock2D", "CrossAttnUpBlock2D"),
+        cross_attention_dim=16,
+        attention_head_dim=2,
+    )
+    controlnet = ControlNetModel(
+        **blocks,
+        in_channels=4,
+        down_block_types=("CrossAttnDownBlock2D", "DownBlock2D"),
+        cross_attention_dim=16,
+        conditioning_embedding_out_channels=(8, 16),
+        attention_head_dim=2,
+    )
+    vae = AutoencoderKL(
+        **blocks,
+        in_channels=3,
+        out_channels=3,
+        down_block_types=("DownEncoderBlock2D", "DownEncoderBlock2D"),
+        up_block_types=("UpDecoderBlock2D", "UpDecoderBlock2D"),
+        latent_channels=4,
+    )
+    text_encoder = CLIPTextModel(
+        CLIPTextConfig(
+            bos_token_id=0,
+            eos_token_id=2,
+            pad_token_id=1,
+            hidden_size=16,
+            intermediate_size=32,
+            num_attention_heads=2,
+            num_hidden_layers=2,
+            vocab_size=1000,
+        )
+    )
+
+    # character level tokenizer: no merges, one token per letter
+    tokenizer_path = os.path.join(path, "tokenizer")
+    os.makedirs(tokenizer_path, exist_ok=True)
+    vocab = {"<|startoftext|>": 0, "!": 1, "<|endoftext|>": 2}
+    for c in "abcdefghijklmnopqrstuvwxyz":
+        vocab[c] = len(vocab)
+        vocab[c + "</w>"] = len(vocab)
+    with open(os.path.join(tokenizer_path, "vocab.json"), "w") as f:
+        json.dump(vocab, f)
+    with open(os.path.join(tokenizer_path, "merges.txt"), "w") as f:
+        f.write("#version: 0.2\n")
+    tokenizer = CLIPTokenizer(
+        os.path.join(tokenizer_path, "vocab.json"), os.path.join(tokenizer_path, "merges.txt"), model_max_length=77
+    )
+
+    scheduler = DDIMScheduler(
+        beta_start=0.00085,
+        beta_end=0.012,
+        beta_schedule="scaled_linear",
+        clip_sample=False,
+        set_alpha_to_one=False,
+        steps_offset=1,
+    )
+    pipeline = StableDiffusionPipeline(
+        unet=unet,
+        vae=vae,
+        text_encoder=text_encoder,
+        tokenizer=tokenizer,
+        scheduler=scheduler,
+        safety_checker=None,
+        feature_extractor=None,
+        requires_safety_checker=False,
+    )
+    sd_path, controlnet_path = os.path.join(path, "sd"), os.path.join(path, "controlnet")
+    pipeline.save_pretrained(sd_path)
+    controlnet.save_pretrained(controlnet_path)
+    return sd_path, controlnet_path
+
+
+def get_tiny_config(mode: str = "txt2img", n_units: int = 1, device=None) -> dict:
+    """Diffusers config generating 64x64 images in 2 steps with the tiny models"""
+    sd_path, controlnet_path = get_tiny_models()
+    config = {
+        "global": {
+            "mode": mode,
+            "prompt": "a dog",
+            "negative_prompt": "",
+            "model_name_or_path": sd_path,
+            "steps": 2,
+            "scheduler_name": "Euler a",
+            "cfg_scale": 7,
+            "width": 64,
+            "height": 64,
+            "seed": 0,
+            "batch_size": 1,
+            "denoising_strength": 0.8,
+            "input_image": "qrcode",
+        },
+        "controlnet_units": {
+            f"unit_{i}": {
+                "model": controlnet_path,
+                "cn_input_image": "qrcode",
+                "module": "none",
+                "weight": 0.5,
+                "start": 0.0,
+                "end": 1.0,
+            }
+            for i in range(n_units)
+        },
+        "qrcode": {
+            "text": "https://koll.ai",
+            "error_correction": "high",
+            "box_size": 10,
+            "border": 4,
+            "fill_color": "black",
+            "back_color": "white",
+        },
+    }
+    if device is not None:
+        config["device"] = device
+    return config